@@ -0,0 +1,40 @@
+# One background thread per worker process, for image work (derivatives,
+# storage deletions) that a request should not wait for.
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _run(function, args):
+    try:
+        function(*args)
+    except Exception:
+        logger.exception('Background task %s%s failed', function.__name__, args)
+    finally:
+        # this thread's connection, the next task opens a fresh one
+        connection.close()
+
+
+def run_in_background(function, *args):
+    """
+        Queue `function(*args)` on the background thread, or run it right
+        away when BACKGROUND_TASKS is off. Tasks are lost if the worker
+        stops, so they must be recoverable from the database (see the
+        build_derivatives and flush_deletions commands).
+    """
+    global _executor
+    if not settings.BACKGROUND_TASKS:
+        return function(*args)
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='listings-background')
+    _executor.submit(_run, function, args)
@@ -0,0 +1,78 @@
+# Response cache for anonymous catalog GETs
+
+import hashlib
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.response import Response
+
+GENERATION_KEY = 'catalog:generation'
+
+
+def catalog_generation():
+    """
+        Every cached response is keyed on the current catalog generation, so
+        bumping it invalidates all of them at once without scanning keys.
+        If the counter was evicted it restarts from the clock, never from a
+        value that older entries may have used.
+    """
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, int(time.time() * 1000), timeout=None)
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+
+def _bump_generation():
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        catalog_generation()
+
+
+def invalidate_catalog():
+    # right away for this transaction, and again once the write is visible to
+    # other connections, so nothing cached in between survives
+    _bump_generation()
+    transaction.on_commit(_bump_generation)
+
+
+def response_cache_key(request):
+    params = urlencode(sorted(request.query_params.lists()), doseq=True)
+    raw = f'{request.get_host()}{request.path}?{params}'
+    return f'catalog:{catalog_generation()}:{hashlib.md5(raw.encode()).hexdigest()}'
+
+
+def is_cacheable(request):
+    return request.method in ('GET', 'HEAD') and not request.user.is_authenticated
+
+
+class CachedResponseMixin:
+    """
+        Caches the data of list and retrieve responses served to anonymous
+        users for `CATALOG_CACHE_TIMEOUT` seconds. Invalidated by
+        apps.listings.signals on every catalog write.
+    """
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        if not is_cacheable(request):
+            return handler(request, *args, **kwargs)
+
+        key = response_cache_key(request)
+        data = cache.get(key)
+        if data is not None:
+            return Response(data, headers={'X-Cache': 'HIT'})
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, timeout=settings.CATALOG_CACHE_TIMEOUT)
+            response['X-Cache'] = 'MISS'
+        return response
@@ -0,0 +1,102 @@
+# Catalog read model: one precomputed jsonb card per listing (ListingCard)
+
+import threading
+
+from django.db import transaction
+
+from .media import media_url, srcset
+from .models import ImageModel, Listing, ListingCard
+
+_pending = threading.local()
+
+
+def build_cards(listings):
+    """
+        Cards are the group_by=characteristics__label representation of the
+        listings, plus their stock. Returns {listing_id: card}. Images are
+        kept as stored names, see card_representation().
+    """
+    from .serializers import ListingGroupByLabelSeriazlizer
+
+    listings = list(listings)
+    stock = {listing.id: listing.stock for listing in listings}
+    serializer = ListingGroupByLabelSeriazlizer(listings, many=True, context={'media_names': True})
+    return {card['id']: {**card, 'stock': stock[card['id']]} for card in serializer.data}
+
+
+def image_representation(image, storage):
+    return {**image, 'image': media_url(image['image'], storage), 'srcset': srcset(image.get('srcset'), storage)}
+
+
+def card_representation(card):
+    """
+        The card as served: the image names it stores resolved to urls (see
+        media.media_url). Cards live until the next write, presigned urls
+        would expire in them.
+    """
+    from .serializers import categories_representation
+
+    storage = ImageModel._meta.get_field('image').storage
+    card = dict(card)
+    if card.get('default_image'):
+        card['default_image'] = image_representation(card['default_image'], storage)
+    if card.get('manufacturer'):
+        card['manufacturer'] = {
+            **card['manufacturer'],
+            'pictures': [image_representation(image, storage) for image in card['manufacturer'].get('pictures', [])],
+        }
+    card['variants'] = {
+        label: [{**variant, 'images': [image_representation(image, storage) for image in variant.get('images', [])]} for variant in variants]
+        for label, variants in (card.get('variants') or {}).items()
+    }
+    card['categories'] = categories_representation(card.get('categories', []))
+    return card
+
+
+def refresh_cards(listing_ids):
+    """
+        Rebuild and upsert the cards of the given listings in one statement.
+    """
+    listings = Listing.objects.filter(id__in=listing_ids).select_related('manufacturer').with_stock()
+    cards = [ListingCard(listing_id=listing_id, data=data) for listing_id, data in build_cards(listings).items()]
+    return ListingCard.objects.bulk_create(
+        cards,
+        update_conflicts=True,
+        unique_fields=['listing'],
+        update_fields=['data', 'updated_at'],
+    )
+
+
+def ensure_cards(listings):
+    """
+        Make sure every listing has its card loaded, building the missing ones.
+    """
+    listings = list(listings)
+    missing = [listing for listing in listings if not hasattr(listing, 'card')]
+    if missing:
+        cards = {card.listing_id: card for card in refresh_cards([listing.id for listing in missing])}
+        for listing in missing:
+            listing.card = cards[listing.id]
+    return listings
+
+
+def _flush():
+    listing_ids = getattr(_pending, 'listing_ids', set())
+    _pending.listing_ids = set()
+    if listing_ids:
+        refresh_cards(listing_ids)
+
+
+def schedule_refresh(listing_ids):
+    """
+        Refresh the cards once the current transaction commits (right away in
+        autocommit). Ids scheduled during the same transaction are refreshed
+        together by the first callback, the next ones find nothing to do.
+    """
+    listing_ids = {listing_id for listing_id in listing_ids if listing_id is not None}
+    if not listing_ids:
+        return
+    if not hasattr(_pending, 'listing_ids'):
+        _pending.listing_ids = set()
+    _pending.listing_ids.update(listing_ids)
+    transaction.on_commit(_flush)
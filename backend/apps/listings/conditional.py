@@ -0,0 +1,68 @@
+# Conditional GET (ETag / 304) for the catalog viewsets
+
+import hashlib
+
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+
+from .cache import catalog_generation
+from .media import signs_urls
+
+
+def compute_etag(request, *parts):
+    raw = ':'.join([request.get_full_path(), *(str(part) for part in parts)])
+    return hashlib.md5(raw.encode()).hexdigest()
+
+
+class ConditionalGetMixin:
+    """
+        A matching If-None-Match gets a 304 before any serialization. List
+        ETags come from the catalog generation (see apps.listings.cache),
+        which every catalog write bumps, so they cost no query at all. Detail
+        ETags come from the object's `updated_at`, which dependent writes
+        touch too (apps.listings.signals). No Last-Modified: to the second,
+        it can't tell two writes apart.
+        Presigned media urls expire while the ETag stays the same, so without
+        MEDIA_PUBLIC_URL (or a public bucket) responses are never conditional.
+    """
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(self.list_etag, super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(self.detail_etag, super().retrieve, request, *args, **kwargs)
+
+    def list_etag(self):
+        return compute_etag(self.request, catalog_generation())
+
+    def detail_etag(self):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            updated_at = (
+                self.get_queryset()
+                .filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+                .values_list('updated_at', flat=True)
+                .first()
+            )
+        except (TypeError, ValueError, ValidationError):
+            # a malformed lookup value, get_object() answers the 404
+            updated_at = None
+        if updated_at is None:
+            # let retrieve() answer the 404
+            return None
+        return compute_etag(self.request, updated_at.isoformat())
+
+    def conditional_response(self, get_etag, handler, request, *args, **kwargs):
+        if signs_urls(default_storage):
+            return handler(request, *args, **kwargs)
+        etag = get_etag()
+        if etag is not None:
+            not_modified = get_conditional_response(request, etag=quote_etag(etag))
+            if not_modified is not None:
+                return not_modified
+
+        response = handler(request, *args, **kwargs)
+        if etag is not None and response.status_code == 200:
+            response['ETag'] = quote_etag(etag)
+        return response
@@ -0,0 +1,227 @@
+# Set based soft deletion of listings and products
+
+import threading
+from datetime import timedelta
+
+from botocore.exceptions import BotoCoreError, ClientError
+from django.db import transaction
+from django.utils import timezone
+from storages.backends.s3 import S3Storage
+
+from .background import run_in_background
+from .cache import invalidate_catalog
+from .cards import schedule_refresh
+from .models import Category, ImageModel, Listing, Manufacturer, Product, RemoteImage, StorageDeletion
+from .uploads import bucket_key
+
+_pending = threading.local()
+
+# keys per S3 DeleteObjects call, the most it accepts
+DELETE_BATCH_SIZE = 1000
+# a file still not deleted after that many tries is left for inspection
+MAX_DELETE_ATTEMPTS = 8
+
+
+def stored_names(images):
+    """
+        (file name, image name) of the files of the images: the original and
+        its derivatives. Remote images have no file.
+    """
+    for image in images:
+        name = image.image.name
+        if not name or name.startswith(('http://', 'https://')):
+            continue
+        yield name, name
+        for widths in (image.derivatives or {}).values():
+            for derivative in widths.values():
+                yield derivative, name
+
+
+def queue_storage_deletion(images, flush=True):
+    """
+        Record the files of deleted images, deleted from storage once the
+        transaction commits by flush_storage_deletions() (or by the next
+        flush when `flush` is False).
+    """
+    deletions = [StorageDeletion(name=name, image=image) for name, image in stored_names(images)]
+    if not deletions:
+        return
+    StorageDeletion.objects.bulk_create(deletions, ignore_conflicts=True)
+    if flush:
+        transaction.on_commit(lambda: run_in_background(flush_all_storage_deletions))
+
+
+def retry_delay(attempts):
+    return timedelta(minutes=min(2 ** attempts, 60 * 24))
+
+
+def delete_files(storage, names):
+    """
+        Deletes the files, with one DeleteObjects call on a bucket. Returns
+        {name: error} for the ones that could not be deleted.
+    """
+    if isinstance(storage, S3Storage):
+        keys = {bucket_key(storage, name): name for name in names}
+        response = storage.bucket.meta.client.delete_objects(
+            Bucket=storage.bucket_name,
+            Delete={'Objects': [{'Key': key} for key in keys], 'Quiet': True},
+        )
+        return {keys[error['Key']]: f"{error.get('Code')}: {error.get('Message')}" for error in response.get('Errors', [])}
+    errors = {}
+    for name in names:
+        try:
+            storage.delete(name)
+        except OSError as error:
+            errors[name] = str(error)
+    return errors
+
+
+@transaction.atomic
+def flush_storage_deletions(limit=DELETE_BATCH_SIZE):
+    """
+        Deletes up to `limit` of the due files. Files whose image is stored
+        again (same content uploaded since) are only forgotten, failures are
+        retried later with a growing delay. Concurrent flushes skip each
+        other's rows. Returns the number of rows handled.
+    """
+    now = timezone.now()
+    deletions = list(
+        StorageDeletion.objects
+        .filter(retry_at__lte=now, attempts__lt=MAX_DELETE_ATTEMPTS)
+        .order_by('retry_at', 'id')
+        .select_for_update(skip_locked=True)[:limit]
+    )
+    if not deletions:
+        return 0
+    image_names = {deletion.image for deletion in deletions}
+    live = set(ImageModel.objects.filter(image__in=image_names).values_list('image', flat=True))
+    live |= set(Category.objects.filter(image__in=image_names).values_list('image', flat=True))
+    due = [deletion for deletion in deletions if deletion.image not in live]
+
+    storage = ImageModel._meta.get_field('image').storage
+    try:
+        errors = delete_files(storage, [deletion.name for deletion in due]) if due else {}
+    except (BotoCoreError, ClientError) as error:
+        errors = {deletion.name: str(error) for deletion in due}
+
+    failed = [deletion for deletion in due if deletion.name in errors]
+    for deletion in failed:
+        deletion.attempts += 1
+        deletion.retry_at = now + retry_delay(deletion.attempts)
+        deletion.last_error = errors[deletion.name]
+    StorageDeletion.objects.bulk_update(failed, ['attempts', 'retry_at', 'last_error'])
+    failed_ids = {deletion.id for deletion in failed}
+    StorageDeletion.objects.filter(id__in=[deletion.id for deletion in deletions if deletion.id not in failed_ids]).delete()
+    return len(deletions)
+
+
+def flush_all_storage_deletions():
+    """
+        Flush batch after batch until nothing is due. Returns the number of
+        rows handled.
+    """
+    handled = 0
+    while True:
+        batch = flush_storage_deletions()
+        if not batch:
+            return handled
+        handled += batch
+
+
+def unused_images(product_ids):
+    """
+        Images of the given products that no active product and no
+        manufacturer uses anymore.
+    """
+    return (
+        ImageModel.objects
+        .filter(product__in=product_ids)
+        .exclude(product__is_active=True)
+        .exclude(manufacturer__isnull=False)
+        .distinct()
+    )
+
+
+def delete_image_rows(image_ids):
+    """
+        Deletes the image rows in a fixed number of queries, without the
+        collector and the per row signals of QuerySet.delete(). Every table
+        pointing to ImageModel is cleared first, keep them in sync with the
+        model's relations: the foreign keys are deferred, a row left behind
+        fails the commit. Returns the number of images deleted.
+    """
+    Product.images.through.objects.filter(imagemodel_id__in=image_ids).delete()
+    Manufacturer.pictures.through.objects.filter(imagemodel_id__in=image_ids).delete()
+    RemoteImage.objects.filter(image_id__in=image_ids).delete()
+    return ImageModel.objects.filter(id__in=image_ids)._raw_delete(ImageModel.objects.db)
+
+
+def delete_images(images, flush=True):
+    """
+        Deletes image rows no active product shows anymore, without the per
+        image delete signals: nothing else to refresh than the catalog cache.
+        Their files are queued for deletion, see queue_storage_deletion().
+    """
+    image_ids = [image.id for image in images]
+    if not image_ids:
+        return 0
+    queue_storage_deletion(images, flush)
+    deleted = delete_image_rows(image_ids)
+    invalidate_catalog()
+    return deleted
+
+
+def delete_unused_images(product_ids):
+    return delete_images(list(unused_images(product_ids).only('id', 'image', 'derivatives')))
+
+
+def _flush():
+    product_ids = getattr(_pending, 'product_ids', set())
+    _pending.product_ids = set()
+    if product_ids:
+        delete_unused_images(product_ids)
+
+
+def schedule_image_cleanup(product_ids):
+    """
+        Delete the images the products leave unused once the current
+        transaction commits, batched like cards.schedule_refresh().
+    """
+    product_ids = set(product_ids)
+    if not product_ids:
+        return
+    if not hasattr(_pending, 'product_ids'):
+        _pending.product_ids = set()
+    _pending.product_ids.update(product_ids)
+    transaction.on_commit(_flush)
+
+
+@transaction.atomic
+def soft_delete_products(products):
+    """
+        Deactivate the products with one UPDATE and queue the cleanup of
+        their images. Returns the number of products deactivated.
+    """
+    product_ids = list(products.filter(is_active=True).values_list('id', flat=True))
+    if not product_ids:
+        return 0
+    Product.objects.filter(id__in=product_ids).update(is_active=False, updated_at=timezone.now())
+    schedule_image_cleanup(product_ids)
+    return len(product_ids)
+
+
+@transaction.atomic
+def soft_delete_listings(listings):
+    """
+        Deactivate the listings and all their products, one UPDATE per table.
+        Returns the number of listings deactivated.
+    """
+    listing_ids = list(listings.filter(is_active=True).values_list('id', flat=True))
+    if not listing_ids:
+        return 0
+    Listing.objects.filter(id__in=listing_ids).update(is_active=False, updated_at=timezone.now())
+    soft_delete_products(Product.objects.filter(listing_id__in=listing_ids))
+    # update() sends no model signals
+    schedule_refresh(listing_ids)
+    invalidate_catalog()
+    return len(listing_ids)
@@ -0,0 +1,142 @@
+# Responsive derivatives of the uploaded images: smaller widths in WebP and AVIF,
+# built once the upload is committed, on a background thread of the worker.
+
+import hashlib
+import logging
+import threading
+from io import BytesIO
+from pathlib import PurePosixPath
+
+from botocore.exceptions import BotoCoreError, ClientError
+from django.core.files.base import ContentFile
+from django.db import transaction
+from PIL import Image, ImageOps
+
+from .background import run_in_background
+from .models import ImageModel
+from .signals import listings_bulk_changed, listings_of_images, manufacturers_changed, manufacturers_of_images
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVE_WIDTHS = (160, 320, 640, 1280)
+# encoder options of each format, the ones this Pillow can't write are skipped
+DERIVATIVE_FORMATS = {
+    'avif': {'quality': 55},
+    'webp': {'quality': 80, 'method': 4},
+}
+
+_pending = threading.local()
+
+
+def derivative_formats():
+    Image.init()
+    return {name: options for name, options in DERIVATIVE_FORMATS.items() if name.upper() in Image.SAVE}
+
+
+def derivative_name(name, width, image_format, content):
+    """
+        Derivatives are named after their content too: media is served
+        immutable, new encoder settings must give new names.
+    """
+    path = PurePosixPath(name)
+    digest = hashlib.sha256(content).hexdigest()[:16]
+    return str(path.with_name(f'{path.stem}-{width}w-{digest}.{image_format}'))
+
+
+def render_derivatives(image):
+    """
+        Saves the derivatives of an ImageModel next to its original and
+        returns them as {format: {width: name}}. Only widths below the
+        original's are made, or the original width for small images.
+    """
+    storage = image.image.storage
+    with storage.open(image.image.name, 'rb') as file:
+        original = Image.open(file)
+        original.draft('RGB', (DERIVATIVE_WIDTHS[-1], DERIVATIVE_WIDTHS[-1]))
+        original = ImageOps.exif_transpose(original)
+        original.load()
+    if original.mode not in ('RGB', 'RGBA'):
+        original = original.convert('RGBA' if original.has_transparency_data else 'RGB')
+
+    widths = [width for width in DERIVATIVE_WIDTHS if width < original.width] or [original.width]
+    derivatives = {image_format: {} for image_format in derivative_formats()}
+    resized = original
+    # largest first, each width is resized from the previous one
+    for width in sorted(widths, reverse=True):
+        resized = resized.copy()
+        resized.thumbnail((width, resized.height), reducing_gap=2.0)
+        for image_format, options in derivative_formats().items():
+            buffer = BytesIO()
+            resized.save(buffer, format=image_format.upper(), **options)
+            content = buffer.getvalue()
+            name = derivative_name(image.image.name, width, image_format, content)
+            if not storage.exists(name):
+                name = storage.save(name, ContentFile(content))
+            derivatives[image_format][str(width)] = name
+    return derivatives
+
+
+def build_derivatives(images):
+    """
+        Builds and records the derivatives of the given images, then refreshes
+        the listings and manufacturers showing them. Images that can't be read
+        (remote urls, missing or broken files) get no derivatives and are not
+        tried again; a failing storage leaves them to the next run.
+        Decoding and uploads run outside any transaction, the rows are only
+        locked to record the result, if nothing recorded one meanwhile.
+    """
+    images = [image for image in images if image.derivatives is None]
+    built = {}
+    for image in images:
+        name = image.image.name or ''
+        if not name or name.startswith(('http://', 'https://')):
+            built[image.id] = {}
+            continue
+        try:
+            built[image.id] = render_derivatives(image)
+        except (OSError, ValueError, Image.DecompressionBombError) as error:
+            logger.warning('No derivatives for image %s (%s): %s', image.id, name, error)
+            built[image.id] = {}
+        except (BotoCoreError, ClientError) as error:
+            logger.warning('Derivatives of image %s (%s) not stored: %s', image.id, name, error)
+
+    with transaction.atomic():
+        rows = list(ImageModel.objects.select_for_update().filter(id__in=list(built), derivatives__isnull=True))
+        for row in rows:
+            row.derivatives = built[row.id]
+        ImageModel.objects.bulk_update(rows, ['derivatives'])
+        image_ids = [row.id for row in rows]
+        if image_ids:
+            manufacturers_changed(list(manufacturers_of_images(image_ids)))
+            listings_bulk_changed(list(listings_of_images(image_ids)))
+    for image in images:
+        if image.id in built:
+            image.derivatives = built[image.id]
+    return images
+
+
+def build_derivatives_of(image_ids):
+    build_derivatives(ImageModel.objects.filter(id__in=image_ids))
+
+
+def _flush():
+    image_ids = getattr(_pending, 'image_ids', set())
+    _pending.image_ids = set()
+    if image_ids:
+        run_in_background(build_derivatives_of, sorted(image_ids))
+
+
+def schedule_derivatives(image_ids):
+    """
+        Build the derivatives of the images once the current transaction
+        commits, batched like cards.schedule_refresh(). Images left without
+        derivatives (a worker restarted meanwhile) are caught up by the
+        build_derivatives command.
+    """
+    image_ids = {image_id for image_id in image_ids if image_id is not None}
+    if not image_ids:
+        return
+    if not hasattr(_pending, 'image_ids'):
+        _pending.image_ids = set()
+    _pending.image_ids.update(image_ids)
+    transaction.on_commit(_flush)
@@ -0,0 +1,133 @@
+# Facet counts (category, manufacturer, price band, language, characteristics)
+# of a filtered listing queryset, all from one GROUPING SETS query.
+
+import hashlib
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+from .cache import catalog_generation
+from .models import Category, Listing, Manufacturer, Product
+
+# Upper bounds of the price bands, the last band is open ended
+PRICE_BANDS = (10, 25, 50, 100)
+
+PRICE_BAND = f"width_bucket(listing.price, ARRAY{list(map(float, PRICE_BANDS))}::float8[])"
+
+# facet -> the columns it is grouped by
+FACETS = {
+    'category': ('category.id', 'category.name'),
+    'manufacturer': ('manufacturer.id', 'manufacturer.name'),
+    'price': (PRICE_BAND,),
+    'lang': ('listing.lang',),
+    'characteristics': ("product.characteristics ->> 'label'", "product.characteristics ->> 'value'"),
+}
+
+JOINS = {
+    'category': (
+        f'LEFT JOIN {Listing.categories.through._meta.db_table} listing_category ON listing_category.listing_id = listing.id '
+        f'LEFT JOIN {Category._meta.db_table} category ON category.id = listing_category.category_id'
+    ),
+    'manufacturer': f'LEFT JOIN {Manufacturer._meta.db_table} manufacturer ON manufacturer.id = listing.manufacturer_id',
+    'characteristics': f'LEFT JOIN {Product._meta.db_table} product ON product.listing_id = listing.id AND product.is_active',
+}
+
+# request params that don't change the filtered set
+NON_FILTER_PARAMS = ('page', 'page_size', 'cursor', 'pagination', 'ordering', 'group_by', 'facets')
+
+
+def parse_facets(value):
+    """
+        `?facets=1` asks for every facet, `?facets=category,price` for some.
+    """
+    value = value.strip().lower()
+    if value in ('true', '1', 'yes', 'all'):
+        return list(FACETS)
+    names = [name for name in FACETS if name in {part.strip() for part in value.split(',')}]
+    if not names:
+        raise ValueError(f'{value} names no facet')
+    return names
+
+
+def facets_sql(names, filtered_sql):
+    columns = [column for name in names for column in FACETS[name]]
+    flags = [f"GROUPING({', '.join(FACETS[name])}) = 0" for name in names]
+    grouping_sets = [f"({', '.join(FACETS[name])})" for name in names]
+    joins = [JOINS[name] for name in names if name in JOINS]
+    return (
+        f"SELECT {', '.join(flags + columns)}, COUNT(DISTINCT listing.id) "
+        f"FROM {Listing._meta.db_table} listing "
+        f"{' '.join(joins)} "
+        f"WHERE listing.id IN ({filtered_sql}) "
+        f"GROUP BY GROUPING SETS ({', '.join(grouping_sets)})"
+    )
+
+
+def price_band(bucket):
+    bounds = (None, *PRICE_BANDS, None)
+    return {'min': bounds[bucket], 'max': bounds[bucket + 1]}
+
+
+def facet_value(name, values):
+    if name in ('category', 'manufacturer'):
+        return {'id': values[0], 'name': values[1]}
+    if name == 'price':
+        return price_band(values[0])
+    if name == 'lang':
+        return {'value': values[0]}
+    return {'label': values[0], 'value': values[1]}
+
+
+def facet_counts(queryset, names=None):
+    """
+        {facet: [{...value, 'count': listings}]} for the listings of `queryset`,
+        most frequent first (price bands in price order). Listings without a
+        value for a facet (no category, no manufacturer...) are not counted in it.
+    """
+    names = list(names or FACETS)
+    facets = {name: [] for name in names}
+    if queryset.query.is_empty():
+        return facets
+
+    filtered_sql, params = queryset.order_by().values('id').query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(facets_sql(names, filtered_sql), params)
+        rows = cursor.fetchall()
+
+    for row in rows:
+        flags, values, count = row[:len(names)], row[len(names):-1], row[-1]
+        offset = 0
+        for name, flag in zip(names, flags):
+            width = len(FACETS[name])
+            facet_values = values[offset:offset + width]
+            offset += width
+            if flag and facet_values[0] is not None:
+                facets[name].append({**facet_value(name, facet_values), 'count': count})
+
+    for name, values in facets.items():
+        if name == 'price':
+            values.sort(key=lambda value: float('-inf') if value['min'] is None else value['min'])
+        else:
+            values.sort(key=lambda value: (-value['count'], str(value.get('name') or value.get('value'))))
+    return facets
+
+
+def facets_cache_key(params, names):
+    """
+        Facets only depend on the filters, so every page and ordering of the
+        same filtered set share one entry, dropped with the catalog generation.
+    """
+    filters = sorted((key, values) for key, values in params.lists() if key not in NON_FILTER_PARAMS)
+    raw = f"{urlencode(filters, doseq=True)}|{','.join(names)}"
+    return f'facets:{catalog_generation()}:{hashlib.md5(raw.encode()).hexdigest()}'
+
+
+def cached_facet_counts(queryset, params, names):
+    key = facets_cache_key(params, names)
+    facets = cache.get(key)
+    if facets is None:
+        facets = facet_counts(queryset, names)
+        cache.set(key, facets, timeout=settings.CATALOG_CACHE_TIMEOUT)
+    return facets
@@ -0,0 +1,196 @@
+# Declarative query param filters for the listings viewsets
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramWordSimilarity
+from django.db.models import Case, Exists, F, OuterRef, Q, Value, When
+
+from .models import SEARCH_CONFIGS, Category, Listing
+
+
+def parse_bool(value):
+    value = value.strip().lower()
+    if value in ('true', '1', 'yes'):
+        return True
+    if value in ('false', '0', 'no'):
+        return False
+    raise ValueError(f'{value} is not a boolean')
+
+
+def parse_null_or_int(value):
+    return None if value == 'null' else int(value)
+
+
+class Filter:
+    """
+        Maps one query param to one queryset lookup. `parse` turns the raw
+        string into the lookup value and raises ValueError when it can't,
+        in which case the filter is ignored, like the old isdigit() checks did.
+    """
+    def __init__(self, lookup, parse=str):
+        self.lookup = lookup
+        self.parse = parse
+
+    def filter(self, queryset, value):
+        return queryset.filter(**{self.lookup: value})
+
+
+class QuerySetMethodFilter(Filter):
+    """
+        Calls a queryset method (e.g. ListingQuerySet.in_stock) with the parsed value.
+    """
+    def filter(self, queryset, value):
+        return getattr(queryset, self.lookup)(value)
+
+
+class ListingCategoryFilter(Filter):
+    """
+        Filters on Listing.categories through an EXISTS subquery so the M2M
+        join can't duplicate listings (and no DISTINCT is needed).
+    """
+    def filter(self, queryset, value):
+        through = Listing.categories.through.objects.filter(listing_id=OuterRef('pk'), **{self.lookup: value})
+        return queryset.filter(Exists(through))
+
+
+class CategoryIdOrSlugFilter(Filter):
+    def __init__(self):
+        super().__init__(None)
+
+    def filter(self, queryset, value):
+        lookup = 'category_id' if value.isdigit() else 'category__slug'
+        return ListingCategoryFilter(lookup).filter(queryset, value)
+
+
+class CategoryTreeFilter(Filter):
+    """
+        Listings in a category (id or slug) or any of its descendants. The
+        category's path is read first so the prefix match is a constant
+        `LIKE 'path%'`, served by the category_path index.
+    """
+    def __init__(self):
+        super().__init__(None)
+
+    def filter(self, queryset, value):
+        lookup = 'id' if value.isdigit() else 'slug'
+        path = Category.objects.filter(**{lookup: value}).values_list('path', flat=True).first()
+        if not path:
+            return queryset.none()
+        return ListingCategoryFilter('category__path__startswith').filter(queryset, path)
+
+
+class SearchFilter(Filter):
+    """
+        Full text search on the trigger maintained Listing.search_vector, parsed
+        with the text search config of each listing's language, plus trigram
+        word similarity on the name for typos. Results are ranked unless an
+        explicit ordering is requested.
+    """
+    def __init__(self):
+        super().__init__(None, parse=lambda value: value.strip()[:256])
+
+    def filter(self, queryset, value):
+        config = Case(
+            *(When(lang=lang, then=Value(name)) for lang, name in SEARCH_CONFIGS.items()),
+            default=Value('simple'),
+        )
+        query = SearchQuery(value, config=config, search_type='websearch')
+        return (
+            queryset
+            .filter(Q(search_vector=query) | Q(name__trigram_word_similar=value))
+            .annotate(search_rank=SearchRank(F('search_vector'), query) + TrigramWordSimilarity(value, 'name'))
+            .order_by('-search_rank', 'id')
+        )
+
+
+class FilterSet:
+    """
+        `filters` maps query params to Filter instances, `ordering` maps the
+        accepted values of `?ordering=` (comma separated, `-` for descending)
+        to model fields.
+        Deciding whether the request is filtered at all only looks at the
+        query params, it never counts the queryset.
+    """
+    filters = {}
+    ordering = {}
+    ordering_param = 'ordering'
+    # annotation needed by an ordering field -> queryset method adding it
+    ordering_annotations = {}
+
+    def __init__(self, params):
+        self.params = params
+
+    def is_empty(self):
+        # no query param carries a value (not even page or page_size)
+        return not any(self.params.values())
+
+    def parsed(self):
+        for param, query_filter in self.filters.items():
+            raw = self.params.get(param)
+            if not isinstance(raw, str) or raw == '':
+                continue
+            try:
+                yield query_filter, query_filter.parse(raw)
+            except ValueError:
+                continue
+
+    def order_by(self):
+        keys = []
+        for key in self.params.get(self.ordering_param, '').split(','):
+            key = key.strip()
+            descending = key.startswith('-')
+            field = self.ordering.get(key.lstrip('-'))
+            if field is not None:
+                keys.append(f'-{field}' if descending else field)
+        return keys
+
+    def filter(self, queryset):
+        for query_filter, value in self.parsed():
+            queryset = query_filter.filter(queryset, value)
+        keys = self.order_by()
+        for key in keys:
+            if key.lstrip('-') in self.ordering_annotations:
+                queryset = getattr(queryset, self.ordering_annotations[key.lstrip('-')])()
+        if keys:
+            queryset = queryset.order_by(*keys, 'id')
+        return queryset
+
+
+class ListingFilterSet(FilterSet):
+    filters = {
+        'price': Filter('price', float),
+        'price_min': Filter('price__gte', float),
+        'price_max': Filter('price__lte', float),
+        'name': Filter('name__icontains'),
+        'manufacturer': Filter('manufacturer__name__icontains'),
+        'manufacturer_id': Filter('manufacturer_id', int),
+        'category': CategoryIdOrSlugFilter(),
+        'category_name': ListingCategoryFilter('category__name__icontains'),
+        'category_tree': CategoryTreeFilter(),
+        'lang': Filter('lang'),
+        'type': Filter('type', int),
+        'is_active': Filter('is_active', parse_bool),
+        'search': SearchFilter(),
+        'in_stock': QuerySetMethodFilter('in_stock', parse_bool),
+    }
+    ordering = {
+        'price': 'price',
+        'name': 'name',
+        'stock': 'stock_count',
+        'id': 'id',
+    }
+    ordering_annotations = {
+        'stock_count': 'with_stock',
+    }
+
+
+class CategoryFilterSet(FilterSet):
+    filters = {
+        'name': Filter('name__icontains'),
+        'language': Filter('language'),
+        'parent': Filter('parent', parse_null_or_int),
+        'slug': Filter('slug'),
+        'description': Filter('description__icontains'),
+    }
+    ordering = {
+        'name': 'name',
+        'id': 'id',
+    }
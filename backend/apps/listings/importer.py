@@ -0,0 +1,173 @@
+# Streaming catalog importer: reads a local CSV (the catalog spreadsheet export)
+# or NDJSON file record by record and writes it in batched bulk inserts.
+
+import csv
+import json
+import re
+from pathlib import Path
+
+from django.db import transaction
+
+from .cache import invalidate_catalog
+from .cards import schedule_refresh
+from .models import Category, Listing, Manufacturer, Product
+
+# "Couleur: Rouge, Bleu" in the Variable columns of the spreadsheet
+VARIABLE_PATTERN = r"Couleur\: |Champ\: |Motif\: |Taille\: |Couleur de l'imprimé\: |Genre\: "
+VARIABLE_COLUMNS = ['Variable', 'Variable 2', 'Variable 3']
+# a listing without variables is sold with a free comment
+COMMENT_OPTION = {'label': 'Ajoutez un commentaire', 'value': '', 'is_customized': True}
+
+
+def parse_number(value, default=0.0):
+    if isinstance(value, (int, float)):
+        return float(value)
+    value = (value or '').strip().replace(',', '.')
+    return float(value) if value else default
+
+
+def csv_options(row):
+    options = []
+    for column in VARIABLE_COLUMNS:
+        variable = row.get(column) or ''
+        match = re.match(VARIABLE_PATTERN, variable)
+        if not match:
+            continue
+        # the labels keep the "Couleur: " form of the listings created so far
+        label = match.group(0)
+        customized = label == 'Champ: '
+        choices = [choice for choice in re.sub(VARIABLE_PATTERN, '', variable).split(', ') if choice != '']
+        options += [
+            {'label': label, 'value': '' if customized else choice, 'is_customized': customized}
+            for choice in choices
+        ]
+    return options or [dict(COMMENT_OPTION)]
+
+
+def csv_record(row):
+    """
+        A row of the catalog spreadsheet as an import record.
+    """
+    category = (row.get('category') or '').strip()
+    sub_category = (row.get('sous catégorie') or '').strip()
+    manufacturer = (row.get('commerçants') or '').strip()
+    return {
+        'name': row.get('name') or '',
+        'description': row.get('description') or '',
+        'price': row.get('price €'),
+        'weight': row.get('weight g'),
+        'type': Listing.ProductType.FOOD if row.get('is food') == 'VRAI' else Listing.ProductType.OTHER,
+        'conservation': row.get('how to conserve it') or '',
+        'manufacturer': {'name': manufacturer, 'phone_number': f'+{row.get("manufacturer")}'} if manufacturer else {'name': 'Unknown'},
+        'categories': [[category, sub_category] if sub_category else [category]] if category else [],
+        'options': csv_options(row),
+    }
+
+
+def read_records(path, file_format=None):
+    """
+        Yields the import records of a .csv or .ndjson/.jsonl file, one at a
+        time. NDJSON lines are records already:
+        {"name": ..., "price": ..., "manufacturer": {"name": ..., "phone_number": ...},
+         "categories": ["Bijoux", ["Textile", "T-shirts"]], "options": [{"label": ..., "value": ..., "stock": ...}]}
+    """
+    path = Path(path)
+    file_format = file_format or ('csv' if path.suffix.lower() == '.csv' else 'ndjson')
+    with path.open(encoding='utf8', newline='') as file:
+        if file_format == 'csv':
+            for row in csv.DictReader(file):
+                yield csv_record(row)
+        else:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+
+class CatalogImporter:
+    """
+        Writes records chunk by chunk, one transaction and a fixed number of
+        queries per chunk: manufacturers and categories are resolved through
+        caches (the missing ones created once), then listings, products and
+        listing categories are inserted with one bulk_create each.
+    """
+    def __init__(self, build_cards=True):
+        self.build_cards = build_cards
+        self.manufacturers = {}
+        self.categories = {
+            (category.parent_id, category.name): category.id
+            for category in Category.objects.only('id', 'parent_id', 'name')
+        }
+
+    def manufacturer_key(self, record):
+        manufacturer = record.get('manufacturer') or {'name': 'Unknown'}
+        if isinstance(manufacturer, str):
+            manufacturer = {'name': manufacturer}
+        return manufacturer['name'], manufacturer.get('phone_number')
+
+    def manufacturer_ids(self, records):
+        missing = {self.manufacturer_key(record) for record in records} - self.manufacturers.keys()
+        if missing:
+            existing = Manufacturer.objects.filter(name__in={name for name, _ in missing}).order_by('id')
+            for manufacturer in existing:
+                self.manufacturers.setdefault((manufacturer.name, manufacturer.phone_number), manufacturer.id)
+            created = Manufacturer.objects.bulk_create([
+                Manufacturer(name=name, phone_number=phone_number)
+                for name, phone_number in missing - self.manufacturers.keys()
+            ])
+            self.manufacturers.update({(manufacturer.name, manufacturer.phone_number): manufacturer.id for manufacturer in created})
+        return self.manufacturers
+
+    def category_id(self, names):
+        """
+            The id of the last category of `names` (root first), creating the
+            missing ones. Categories are few, they are saved one by one so
+            their path is maintained.
+        """
+        parent_id = None
+        for name in names:
+            key = (parent_id, name)
+            if key not in self.categories:
+                self.categories[key] = Category.objects.create(name=name, parent_id=parent_id).id
+            parent_id = self.categories[key]
+        return parent_id
+
+    @transaction.atomic
+    def import_chunk(self, records):
+        manufacturers = self.manufacturer_ids(records)
+        listings = Listing.objects.bulk_create([
+            Listing(
+                name=record['name'].strip(),
+                description=(record.get('description') or '').strip(),
+                price=parse_number(record.get('price')),
+                weight=parse_number(record.get('weight'), default=None),
+                type=record.get('type', Listing.ProductType.OTHER),
+                conservation=record.get('conservation') or '',
+                lang=record.get('lang') or 'fra',
+                manufacturer_id=manufacturers[self.manufacturer_key(record)],
+            )
+            for record in records
+        ])
+
+        listing_categories = Listing.categories.through
+        links, products = [], []
+        for listing, record in zip(listings, records):
+            for names in record.get('categories') or []:
+                category_id = self.category_id([names] if isinstance(names, str) else names)
+                links.append(listing_categories(listing_id=listing.id, category_id=category_id))
+            for option in record.get('options') or [COMMENT_OPTION]:
+                products.append(Product(
+                    listing=listing,
+                    characteristics={'label': option.get('label', 'input'), 'value': option.get('value', '')},
+                    is_customized=option.get('is_customized', False),
+                    additional_price=parse_number(option.get('additional_price')),
+                    quantity=int(option.get('stock', 1)),
+                ))
+        listing_categories.objects.bulk_create(links, ignore_conflicts=True)
+        Product.objects.bulk_create(products)
+
+        # bulk inserts send no model signals. Cards left out are built by
+        # cards.ensure_cards() on first read, or by the rebuild_cards command.
+        if self.build_cards:
+            schedule_refresh([listing.id for listing in listings])
+        invalidate_catalog()
+        return listings
@@ -0,0 +1,240 @@
+# Ingestion of remote images: images given as an http(s) url are fetched
+# concurrently (asyncio, one pooled HTTP client), checked, and stored like the
+# uploads, outside the request that referenced them.
+
+import asyncio
+import ipaddress
+import socket
+from datetime import timedelta
+from io import BytesIO
+
+import httpx
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image
+
+from .background import run_in_background
+from .deletion import delete_image_rows, retry_delay
+from .derivatives import schedule_derivatives
+from .models import ImageModel, Manufacturer, Product, RemoteImage, get_filename
+from .signals import listings_bulk_changed, listings_of_images, manufacturers_changed, manufacturers_of_images
+
+# urls fetched per batch
+FETCH_BATCH_SIZE = 100
+# a batch being fetched is not claimed again before that
+FETCH_LEASE = timedelta(minutes=10)
+# an url still failing after that many tries is left as is
+MAX_FETCH_ATTEMPTS = 5
+# redirects followed per url
+MAX_REDIRECTS = 5
+
+
+class FetchError(Exception):
+    pass
+
+
+def is_remote(name):
+    return bool(name) and name.startswith(('http://', 'https://'))
+
+
+def queue_remote_images(images, fetch=True):
+    """
+        Record the images given as urls, fetched once the transaction commits
+        by ingest_remote_images() (or by the next run when `fetch` is False).
+        Until then their url is served as is.
+    """
+    remote = [RemoteImage(image_id=image.id) for image in images if is_remote(image.image.name)]
+    if not remote:
+        return
+    RemoteImage.objects.bulk_create(remote, ignore_conflicts=True)
+    if fetch:
+        transaction.on_commit(lambda: run_in_background(ingest_all_remote_images))
+
+
+async def resolve_host(url):
+    """
+        The address to connect to for `url`, once every address its host
+        resolves to is checked to be a public one: the urls come from the
+        catalog, they must not reach the loopback, the private network or the
+        cloud metadata endpoint. Hosts in REMOTE_IMAGE_PRIVATE_HOSTS are let
+        through. FetchError otherwise.
+    """
+    if url.scheme not in ('http', 'https'):
+        raise FetchError(f'Unsupported scheme {url.scheme}')
+    host = url.raw_host.decode('ascii')
+    try:
+        addresses = await asyncio.get_running_loop().getaddrinfo(host, url.port, type=socket.SOCK_STREAM)
+    except (socket.gaierror, UnicodeError) as error:
+        raise FetchError(f'Cannot resolve {host}: {error}')
+    addresses = [ipaddress.ip_address(sockaddr[0]) for *_, sockaddr in addresses]
+    if host not in settings.REMOTE_IMAGE_PRIVATE_HOSTS:
+        for address in addresses:
+            address = getattr(address, 'ipv4_mapped', None) or address
+            if not address.is_global:
+                raise FetchError(f'{host} resolves to the non public address {address}')
+    return addresses[0]
+
+
+async def fetch_image(client, url, max_size):
+    """
+        The content at `url`. Each request goes to the address resolve_host()
+        checked, with the url's Host header and TLS server name, so the host
+        can't be resolved again to another address. Redirects are followed
+        here, every hop is checked the same way.
+    """
+    url = httpx.URL(url)
+    for _ in range(MAX_REDIRECTS + 1):
+        address = await resolve_host(url)
+        host = url.raw_host.decode('ascii')
+        async with client.stream(
+            'GET', url.copy_with(host=str(address)),
+            headers={'Host': url.netloc.decode('ascii')},
+            extensions={'sni_hostname': host} if url.scheme == 'https' else {},
+        ) as response:
+            if response.is_redirect:
+                url = url.join(response.headers['Location'])
+                continue
+            if response.status_code != 200:
+                raise FetchError(f'HTTP {response.status_code}')
+            length = response.headers.get('Content-Length', '')
+            if length.isdigit() and int(length) > max_size:
+                raise FetchError(f'{length} bytes, more than {max_size}')
+            content = bytearray()
+            async for chunk in response.aiter_bytes():
+                content += chunk
+                if len(content) > max_size:
+                    raise FetchError(f'More than {max_size} bytes')
+            return bytes(content)
+    raise FetchError(f'More than {MAX_REDIRECTS} redirects')
+
+
+async def fetch_images(urls):
+    """
+        {url: content or FetchError} of the urls, REMOTE_IMAGE_CONCURRENCY at
+        a time over one client, so connections to a host are reused. Bodies
+        larger than IMAGE_UPLOAD_MAX_SIZE are cut short, hosts that aren't
+        public are refused (see resolve_host).
+    """
+    concurrency = settings.REMOTE_IMAGE_CONCURRENCY
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(limits=limits, timeout=settings.REMOTE_IMAGE_TIMEOUT) as client:
+        async def fetch(url):
+            async with semaphore:
+                try:
+                    return await fetch_image(client, url, settings.IMAGE_UPLOAD_MAX_SIZE)
+                except (httpx.HTTPError, httpx.InvalidURL, FetchError) as error:
+                    return FetchError(str(error) or type(error).__name__)
+
+        results = await asyncio.gather(*(fetch(url) for url in urls))
+    return dict(zip(urls, results))
+
+
+def image_file(content):
+    """
+        The fetched content as a file named like an upload, FetchError if
+        Pillow can't read it as an image.
+    """
+    try:
+        with Image.open(BytesIO(content)) as image:
+            image.verify()
+    except (OSError, SyntaxError, ValueError) as error:
+        raise FetchError(f'Not an image: {error}')
+    return ContentFile(content, name=get_filename(content))
+
+
+def replace_images(replacements):
+    """
+        Points the products and manufacturers using the images {old id: new
+        id} to the new ones, then deletes the old ones (remote images, there
+        is no file to delete).
+    """
+    for through, column in ((Product.images.through, 'product_id'), (Manufacturer.pictures.through, 'manufacturer_id')):
+        links = through.objects.filter(imagemodel_id__in=list(replacements))
+        through.objects.bulk_create([
+            through(**{column: owner_id, 'imagemodel_id': replacements[image_id]})
+            for owner_id, image_id in links.values_list(column, 'imagemodel_id')
+        ], ignore_conflicts=True)
+    delete_image_rows(list(replacements))
+
+    image_ids = set(replacements.values())
+    manufacturers_changed(list(manufacturers_of_images(image_ids)))
+    listings_bulk_changed(list(listings_of_images(image_ids)))
+
+
+def claim_remote_images(limit):
+    """
+        Up to `limit` due images, leased for FETCH_LEASE: concurrent runs
+        skip each other's rows, and no lock is held while fetching.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        queued = list(
+            RemoteImage.objects
+            .filter(retry_at__lte=now, attempts__lt=MAX_FETCH_ATTEMPTS)
+            .select_related('image')
+            .order_by('retry_at', 'id')
+            .select_for_update(skip_locked=True, of=('self',))[:limit]
+        )
+        RemoteImage.objects.filter(id__in=[entry.id for entry in queued]).update(retry_at=now + FETCH_LEASE)
+    return queued
+
+
+def ingest_remote_images(limit=FETCH_BATCH_SIZE):
+    """
+        Fetches up to `limit` of the due urls and stores their images through
+        ImageModel.objects.for_images(): content already stored is reused, the
+        same url given several times is fetched once. The products and
+        manufacturers using the remote images are pointed to the stored ones.
+        Failures are retried later with a growing delay. Returns the number
+        of urls handled.
+    """
+    queued = claim_remote_images(limit)
+    if not queued:
+        return 0
+    # images edited since they were queued are only forgotten
+    pending = [entry for entry in queued if is_remote(entry.image.image.name)]
+    results = asyncio.run(fetch_images(sorted({entry.image.image.name for entry in pending}))) if pending else {}
+    files = {}
+    for url, content in results.items():
+        if isinstance(content, bytes):
+            try:
+                files[url] = image_file(content)
+            except FetchError as error:
+                results[url] = error
+
+    now = timezone.now()
+    with transaction.atomic():
+        stored = dict(zip(files, ImageModel.objects.for_images(list(files.values()))))
+        schedule_derivatives([image.id for image in stored.values() if image.derivatives is None])
+        replacements = {
+            entry.image_id: stored[entry.image.image.name].id
+            for entry in pending if entry.image.image.name in stored
+        }
+        failed = [entry for entry in pending if entry.image_id not in replacements]
+        for entry in failed:
+            entry.attempts += 1
+            entry.retry_at = now + retry_delay(entry.attempts)
+            entry.last_error = str(results[entry.image.image.name])
+        RemoteImage.objects.bulk_update(failed, ['attempts', 'retry_at', 'last_error'])
+        failed_ids = {entry.id for entry in failed}
+        RemoteImage.objects.filter(id__in=[entry.id for entry in queued if entry.id not in failed_ids]).delete()
+        if replacements:
+            replace_images(replacements)
+    return len(queued)
+
+
+def ingest_all_remote_images():
+    """
+        Ingest batch after batch until nothing is due. Returns the number of
+        urls handled.
+    """
+    handled = 0
+    while True:
+        batch = ingest_remote_images()
+        if not batch:
+            return handled
+        handled += batch
@@ -0,0 +1,67 @@
+# Stock movements on product SKUs. Each one is a single conditional UPDATE, so
+# concurrent orders can never reserve or sell more units than a product holds.
+
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Product
+from .signals import listings_bulk_changed
+
+
+def _move(product, quantity, condition, changes):
+    if quantity <= 0:
+        raise ValueError(f'{quantity} is not a positive quantity')
+    updated = (
+        Product.objects
+        .filter(pk=product.pk, **condition)
+        .update(**changes, updated_at=timezone.now())
+    )
+    if not updated:
+        return False
+    product.refresh_from_db(fields=['quantity', 'reserved', 'sold', 'updated_at'])
+    listings_bulk_changed([product.listing_id])
+    return True
+
+
+def reserve(product, quantity=1):
+    """
+        Hold `quantity` available units for a pending order. Returns False,
+        changing nothing, when fewer are available.
+    """
+    return _move(
+        product, quantity,
+        {'is_active': True, 'is_sold': False, 'quantity__gte': F('reserved') + F('sold') + quantity},
+        {'reserved': F('reserved') + quantity},
+    )
+
+
+def release(product, quantity=1):
+    """
+        Give back units reserved by an order that was cancelled.
+    """
+    return _move(product, quantity, {'reserved__gte': quantity}, {'reserved': F('reserved') - quantity})
+
+
+def sell(product, quantity=1, reserved=True):
+    """
+        Mark units as sold, taking them from the order's reservation or, with
+        `reserved=False`, straight from the available units.
+    """
+    if reserved:
+        return _move(
+            product, quantity,
+            {'reserved__gte': quantity},
+            {'reserved': F('reserved') - quantity, 'sold': F('sold') + quantity},
+        )
+    return _move(
+        product, quantity,
+        {'is_active': True, 'is_sold': False, 'quantity__gte': F('reserved') + F('sold') + quantity},
+        {'sold': F('sold') + quantity},
+    )
+
+
+def restock(product, quantity):
+    """
+        Add units to a product.
+    """
+    return _move(product, quantity, {}, {'quantity': F('quantity') + quantity})
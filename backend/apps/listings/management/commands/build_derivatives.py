@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from apps.listings.derivatives import build_derivatives
+from apps.listings.models import ImageModel
+
+class Command(BaseCommand):
+    help = 'Build the missing WebP/AVIF derivatives of the images (all of them with --rebuild)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=100)
+        parser.add_argument(
+            '--rebuild', action='store_true',
+            help='Build them again for every image, under new names when they change (the old files are left to gc_media)',
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        if options['rebuild']:
+            ImageModel.objects.update(derivatives=None)
+        image_ids = list(ImageModel.objects.filter(derivatives__isnull=True).order_by('id').values_list('id', flat=True))
+        for start in range(0, len(image_ids), chunk_size):
+            build_derivatives(ImageModel.objects.filter(id__in=image_ids[start:start + chunk_size]))
+            self.stdout.write(f'{min(start + chunk_size, len(image_ids))}/{len(image_ids)} images')
+        self.stdout.write(self.style.SUCCESS(f'Derivatives built for {len(image_ids)} images.'))
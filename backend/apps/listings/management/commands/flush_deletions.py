@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from apps.listings.deletion import MAX_DELETE_ATTEMPTS, flush_all_storage_deletions
+from apps.listings.models import StorageDeletion
+
+class Command(BaseCommand):
+    help = 'Delete from storage the files of removed images that are due (run it periodically, it retries the failed ones)'
+
+    def handle(self, *args, **options):
+        handled = flush_all_storage_deletions()
+        self.stdout.write(self.style.SUCCESS(f'{handled} pending deletions handled.'))
+        stuck = StorageDeletion.objects.filter(attempts__gte=MAX_DELETE_ATTEMPTS).count()
+        if stuck:
+            self.stdout.write(self.style.WARNING(f'{stuck} files could not be deleted after {MAX_DELETE_ATTEMPTS} attempts, see StorageDeletion.last_error.'))
@@ -0,0 +1,119 @@
+import json
+import time
+from datetime import timedelta
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from apps.listings.deletion import delete_images, flush_storage_deletions
+from apps.listings.media_gc import MEDIA_FOLDERS, Throttle, orphan_images, orphan_objects, stored_objects
+from apps.listings.models import ImageModel, StorageDeletion
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete the image rows no product or manufacturer uses, then the files of the media folders '
+        'no row references. Resumable, rate limited, see --dry-run for a report only.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report what would be deleted, delete nothing')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Image rows scanned per query')
+        parser.add_argument('--grace-hours', type=float, default=24, help='Leave rows and files younger than that alone')
+        parser.add_argument(
+            '--requests-per-second', type=float, default=5,
+            help='Most storage calls (LIST, DeleteObjects) per second, 0 for no limit',
+        )
+        parser.add_argument('--pause', type=float, default=0.1, help='Seconds to wait between two chunks of rows')
+        parser.add_argument(
+            '--checkpoint', default='gc_media.progress',
+            help='File recording the progress, to resume after an interruption',
+        )
+        parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint and start over')
+
+    def handle(self, *args, **options):
+        self.dry_run = options['dry_run']
+        self.checkpoint = Path(options['checkpoint'])
+        self.throttle = Throttle(options['requests_per_second'])
+        cutoff = timezone.now() - timedelta(hours=options['grace_hours'])
+
+        state = {'phase': 'rows', 'after': 0}
+        if self.checkpoint.exists() and not options['restart'] and not self.dry_run:
+            state = json.loads(self.checkpoint.read_text())
+            self.stdout.write(f'Resuming: {state}')
+
+        if state['phase'] == 'rows':
+            self.mark_rows(state, cutoff, options['chunk_size'], options['pause'])
+            state = {'phase': 'storage', 'folder': 0, 'after': ''}
+            self.save(state)
+        if state['phase'] == 'storage':
+            self.sweep_storage(state, cutoff)
+            state = {'phase': 'flush'}
+            self.save(state)
+        if not self.dry_run:
+            self.flush()
+            self.checkpoint.unlink(missing_ok=True)
+
+    def save(self, state):
+        if not self.dry_run:
+            self.checkpoint.write_text(json.dumps(state))
+
+    def mark_rows(self, state, cutoff, chunk_size, pause):
+        orphans = 0
+        while True:
+            images, last_id = orphan_images(state['after'], chunk_size, cutoff)
+            if last_id is None:
+                break
+            if images and not self.dry_run:
+                # their files are deleted by the throttled flush() below
+                delete_images(images, flush=False)
+            orphans += len(images)
+            state['after'] = last_id
+            self.save(state)
+            self.stdout.write(f'Rows: scanned up to id {last_id}, {orphans} unused')
+            time.sleep(pause)
+        verb = 'would be deleted' if self.dry_run else 'deleted'
+        self.stdout.write(self.style.SUCCESS(f'{orphans} unused image rows {verb}.'))
+
+    def sweep_storage(self, state, cutoff):
+        storage = ImageModel._meta.get_field('image').storage
+        orphans, size = 0, 0
+        for index in range(state['folder'], len(MEDIA_FOLDERS)):
+            folder = MEDIA_FOLDERS[index]
+            try:
+                for page in stored_objects(storage, folder, state['after'], self.throttle):
+                    unreferenced = orphan_objects(page, cutoff)
+                    if unreferenced and not self.dry_run:
+                        StorageDeletion.objects.bulk_create(
+                            [StorageDeletion(name=name, image=name) for name, _, _ in unreferenced],
+                            ignore_conflicts=True,
+                        )
+                    orphans += len(unreferenced)
+                    size += sum(item[1] for item in unreferenced)
+                    if page:
+                        state.update(folder=index, after=page[-1][0])
+                        self.save(state)
+                    self.stdout.write(f'{folder}: {orphans} unreferenced files so far ({size / 1e6:.1f} MB)')
+            except ValueError as error:
+                raise CommandError(str(error))
+            state.update(folder=index + 1, after='')
+            self.save(state)
+        if self.dry_run:
+            self.stdout.write(self.style.SUCCESS(
+                f'{orphans} unreferenced files ({size / 1e6:.1f} MB) would be deleted, '
+                'plus the files of the unused rows above.'
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'{orphans} unreferenced files ({size / 1e6:.1f} MB) queued for deletion.'))
+
+    def flush(self):
+        handled = 0
+        while True:
+            self.throttle.wait()
+            batch = flush_storage_deletions()
+            if not batch:
+                break
+            handled += batch
+            self.stdout.write(f'{handled} queued deletions handled')
+        self.stdout.write(self.style.SUCCESS(f'{handled} queued deletions handled.'))
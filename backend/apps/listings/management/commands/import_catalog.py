@@ -0,0 +1,57 @@
+import itertools
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.listings.importer import CatalogImporter, read_records
+
+
+class Command(BaseCommand):
+    help = 'Import listings from a local CSV (catalog spreadsheet export) or NDJSON file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'ndjson'], help='Defaults to the file extension')
+        parser.add_argument('--chunk-size', type=int, default=500)
+        parser.add_argument(
+            '--checkpoint',
+            help='File recording how many records are imported, to resume after a failure (default: <path>.progress)',
+        )
+        parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint and import from the first record')
+        parser.add_argument(
+            '--no-cards', action='store_true',
+            help='Do not build the catalog cards while importing (they are built on first read, or by rebuild_cards)',
+        )
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        if not path.is_file():
+            raise CommandError(f'{path} is not a file')
+        checkpoint = Path(options['checkpoint'] or f'{path}.progress')
+        done = 0
+        if checkpoint.exists() and not options['restart']:
+            done = int(checkpoint.read_text().strip() or 0)
+            self.stdout.write(f'Resuming after record {done}.')
+
+        importer = CatalogImporter(build_cards=not options['no_cards'])
+        records = itertools.islice(read_records(path, options['format']), done, None)
+        started, imported = time.monotonic(), 0
+        while chunk := list(itertools.islice(records, options['chunk_size'])):
+            try:
+                importer.import_chunk(chunk)
+            except Exception as error:
+                raise CommandError(
+                    f'Failed on records {done + 1}-{done + len(chunk)}: {error}. '
+                    f'Run the command again to resume from record {done + 1}.'
+                ) from error
+            done += len(chunk)
+            imported += len(chunk)
+            checkpoint.write_text(str(done))
+            rate = imported / max(time.monotonic() - started, 1e-9)
+            self.stdout.write(f'{done} records imported ({rate:.0f} rows/s)')
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'{imported} records imported in {elapsed:.1f}s ({imported / max(elapsed, 1e-9):.0f} rows/s), {done} in total.'
+        ))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from apps.listings.ingestion import MAX_FETCH_ATTEMPTS, ingest_remote_images, queue_remote_images
+from apps.listings.models import ImageModel, RemoteImage
+
+class Command(BaseCommand):
+    help = 'Fetch and store the images given as urls that are due (run it periodically, it retries the failed ones)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Urls fetched concurrently per batch')
+
+    def handle(self, *args, **options):
+        # remote images saved before the ingestion queue existed
+        missing = ImageModel.objects.filter(image__regex=r'^https?://', remote__isnull=True).only('id', 'image')
+        queue_remote_images(missing, fetch=False)
+
+        handled = 0
+        while True:
+            batch = ingest_remote_images(options['batch_size'])
+            if not batch:
+                break
+            handled += batch
+            self.stdout.write(f'{handled} remote images handled')
+        self.stdout.write(self.style.SUCCESS(f'{handled} remote images handled.'))
+        stuck = RemoteImage.objects.filter(attempts__gte=MAX_FETCH_ATTEMPTS).count()
+        if stuck:
+            self.stdout.write(self.style.WARNING(f'{stuck} images could not be fetched after {MAX_FETCH_ATTEMPTS} attempts, see RemoteImage.last_error.'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from apps.listings.cards import refresh_cards
+from apps.listings.models import Listing
+
+class Command(BaseCommand):
+    help = 'Rebuild the catalog cards (ListingCard) of every listing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        listing_ids = list(Listing.objects.order_by('id').values_list('id', flat=True))
+        for start in range(0, len(listing_ids), chunk_size):
+            refresh_cards(listing_ids[start:start + chunk_size])
+        self.stdout.write(self.style.SUCCESS(f'{len(listing_ids)} cards rebuilt.'))
@@ -0,0 +1,95 @@
+# Media URLs for the representations: built from MEDIA_PUBLIC_URL when the
+# bucket is public (or behind a CDN), presigned URLs cached otherwise.
+
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import quote
+
+from django.conf import settings
+from storages.backends.s3 import S3Storage
+
+from .uploads import bucket_key
+
+# signed urls kept per worker process
+SIGNED_URL_CACHE_SIZE = 10000
+# a cached url is still valid this long after it is served
+SIGNED_URL_MARGIN = 60
+
+_signed_urls = OrderedDict()
+_lock = threading.Lock()
+
+
+def public_url(name, storage):
+    # the object key, with the storage's location, as presigned urls use it
+    return f"{settings.MEDIA_PUBLIC_URL.rstrip('/')}/{quote(bucket_key(storage, name))}"
+
+
+def signs_urls(storage):
+    """
+        Whether media_url() presigns the urls of the files of `storage`: urls
+        that expire, so a response holding them can't be revalidated forever.
+    """
+    return isinstance(storage, S3Storage) and not settings.MEDIA_PUBLIC_URL and storage.querystring_auth
+
+
+def signed_url_ttl(storage):
+    """
+        How long a presigned url can be reused: served from a cached catalog
+        response (CATALOG_CACHE_TIMEOUT), it must still work for a while.
+        Nothing else keeps urls: catalog cards store names (see cards.py).
+    """
+    return storage.querystring_expire - settings.CATALOG_CACHE_TIMEOUT - SIGNED_URL_MARGIN
+
+
+def signed_url(name, storage):
+    key = (id(storage), name)
+    now = time.monotonic()
+    with _lock:
+        cached = _signed_urls.get(key)
+        if cached is not None and cached[1] > now:
+            _signed_urls.move_to_end(key)
+            return cached[0]
+    url = storage.url(name)
+    ttl = signed_url_ttl(storage)
+    if ttl > 0:
+        with _lock:
+            _signed_urls[key] = (url, now + ttl)
+            _signed_urls.move_to_end(key)
+            while len(_signed_urls) > SIGNED_URL_CACHE_SIZE:
+                _signed_urls.popitem(last=False)
+    return url
+
+
+def media_url(name, storage):
+    """
+        The url of a stored file. Remote images (stored as their http(s) url)
+        are returned as is, bucket objects get a MEDIA_PUBLIC_URL based url
+        without any boto3 call, or a presigned one reused until shortly before
+        it expires. Other storages answer themselves.
+    """
+    if not name:
+        return None
+    if name.startswith(('http://', 'https://')):
+        return name
+    if not isinstance(storage, S3Storage):
+        return storage.url(name)
+    if settings.MEDIA_PUBLIC_URL:
+        return public_url(name, storage)
+    if not storage.querystring_auth:
+        return storage.url(name)
+    return signed_url(name, storage)
+
+
+def srcset(derivatives, storage):
+    """
+        {format: "url 160w, url 320w, ..."} of the {format: {width: name}}
+        derivatives of an image (see apps.listings.derivatives).
+    """
+    return {
+        image_format: ', '.join(
+            f'{media_url(name, storage)} {width}w' for width, name in sorted(widths.items(), key=lambda item: int(item[0]))
+        )
+        for image_format, widths in (derivatives or {}).items()
+        if widths
+    }
@@ -0,0 +1,106 @@
+# Garbage collection of the media: image rows that no product or manufacturer
+# uses (mark over the M2M tables), then bucket objects that no row references
+# (sweep over the bucket listing). Driven by the gc_media command.
+
+import time
+
+from django.db import connection
+from storages.backends.s3 import S3Storage
+
+from settings.settings import CATEGORY_FOLDER_NAME, PRODUCT_FOLDER_NAME
+
+from .models import Category, ImageModel, Manufacturer, Product, StorageDeletion
+
+# the folders images are stored in, the rest of the bucket (static files) is never swept
+MEDIA_FOLDERS = (PRODUCT_FOLDER_NAME, CATEGORY_FOLDER_NAME)
+
+LIVE_DERIVATIVES_SQL = (
+    f"SELECT sizes.value FROM {ImageModel._meta.db_table} image, "
+    "jsonb_each(image.derivatives) formats, jsonb_each_text(formats.value) sizes "
+    "WHERE image.derivatives IS NOT NULL AND sizes.value = ANY(%s)"
+)
+
+
+class Throttle:
+    """
+        Spaces calls at least 1 / `per_second` seconds apart.
+    """
+    def __init__(self, per_second):
+        self.interval = 1 / per_second if per_second else 0
+        self.next_call = 0
+
+    def wait(self):
+        now = time.monotonic()
+        if now < self.next_call:
+            time.sleep(self.next_call - now)
+        self.next_call = max(now, self.next_call) + self.interval
+
+
+def orphan_images(after_id, chunk_size, created_before):
+    """
+        Scans the `chunk_size` image rows after `after_id`. Returns those
+        created before `created_before` that no product and no manufacturer
+        uses, and the last id scanned (None once every row is scanned).
+    """
+    ids = list(ImageModel.objects.filter(id__gt=after_id).order_by('id').values_list('id', flat=True)[:chunk_size])
+    if not ids:
+        return [], None
+    images = (
+        ImageModel.objects
+        .filter(id__in=ids, created_at__lt=created_before)
+        .exclude(id__in=Product.images.through.objects.filter(imagemodel_id__in=ids).values('imagemodel_id'))
+        .exclude(id__in=Manufacturer.pictures.through.objects.filter(imagemodel_id__in=ids).values('imagemodel_id'))
+        .only('id', 'image', 'derivatives')
+        .order_by('id')
+    )
+    return list(images), ids[-1]
+
+
+def referenced_names(names):
+    """
+        The names among `names` that an image, its derivatives or a category
+        uses, or that are already queued for deletion.
+    """
+    names = list(names)
+    referenced = set(ImageModel.objects.filter(image__in=names).values_list('image', flat=True))
+    referenced |= set(Category.objects.filter(image__in=names).values_list('image', flat=True))
+    referenced |= set(StorageDeletion.objects.filter(name__in=names).values_list('name', flat=True))
+    with connection.cursor() as cursor:
+        cursor.execute(LIVE_DERIVATIVES_SQL, [names])
+        referenced |= {row[0] for row in cursor.fetchall()}
+    return referenced
+
+
+def stored_objects(storage, folder, start_after, throttle):
+    """
+        Pages of (name, size, last modified) of the objects in `folder`, in
+        key order, after the name `start_after`. One LIST call per page.
+    """
+    if not isinstance(storage, S3Storage):
+        raise ValueError('Only S3 compatible storages can be swept.')
+    location = f'{storage.location.strip("/")}/' if storage.location else ''
+    pages = storage.bucket.meta.client.get_paginator('list_objects_v2').paginate(
+        Bucket=storage.bucket_name,
+        Prefix=location + folder,
+        StartAfter=location + start_after if start_after else '',
+        PaginationConfig={'PageSize': 1000},
+    )
+    pages = iter(pages)
+    while True:
+        throttle.wait()
+        page = next(pages, None)
+        if page is None:
+            return
+        yield [(item['Key'][len(location):], item['Size'], item['LastModified']) for item in page.get('Contents', [])]
+
+
+def orphan_objects(objects, modified_before):
+    """
+        The objects of a page, last modified before `modified_before`, that no
+        row references.
+    """
+    candidates = [item for item in objects if item[2] < modified_before]
+    if not candidates:
+        return []
+    referenced = referenced_names(name for name, _, _ in candidates)
+    return [item for item in candidates if item[0] not in referenced]
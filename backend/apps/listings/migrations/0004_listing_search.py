@@ -0,0 +1,77 @@
+# Generated by Django 4.2.6 on 2026-10-18 18:14
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+SEARCH_VECTOR_TRIGGER = """
+CREATE OR REPLACE FUNCTION listings_listing_search_vector_update() RETURNS trigger AS $$
+DECLARE
+    config regconfig := CASE NEW.lang WHEN 'fra' THEN 'french' WHEN 'eng' THEN 'english' ELSE 'simple' END;
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector(config, coalesce(NEW.name, '')), 'A') ||
+        setweight(to_tsvector(config, coalesce(NEW.description, '')), 'B');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER listings_listing_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF name, description, lang ON listings_listing
+    FOR EACH ROW EXECUTE FUNCTION listings_listing_search_vector_update();
+
+-- fires the trigger for the existing rows
+UPDATE listings_listing SET name = name;
+"""
+
+DROP_SEARCH_VECTOR_TRIGGER = """
+DROP TRIGGER IF EXISTS listings_listing_search_vector_trigger ON listings_listing;
+DROP FUNCTION IF EXISTS listings_listing_search_vector_update();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("listings", "0003_remove_coupon_applied_to"),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name="listing",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="category",
+            index=django.contrib.postgres.indexes.GinIndex(
+                django.contrib.postgres.indexes.OpClass("name", name="gin_trgm_ops"),
+                name="category_name_trgm",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="listing",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["search_vector"], name="listing_search_vector"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="listing",
+            index=django.contrib.postgres.indexes.GinIndex(
+                django.contrib.postgres.indexes.OpClass("name", name="gin_trgm_ops"),
+                name="listing_name_trgm",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="manufacturer",
+            index=django.contrib.postgres.indexes.GinIndex(
+                django.contrib.postgres.indexes.OpClass("name", name="gin_trgm_ops"),
+                name="manufacturer_name_trgm",
+            ),
+        ),
+        migrations.RunSQL(SEARCH_VECTOR_TRIGGER, DROP_SEARCH_VECTOR_TRIGGER),
+    ]
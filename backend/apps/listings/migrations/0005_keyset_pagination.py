@@ -0,0 +1,17 @@
+# Generated by Django 4.2.6 on 2026-10-18 18:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("listings", "0004_listing_search"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="listing",
+            index=models.Index(fields=["name", "id"], name="listing_name_id"),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.6 on 2026-10-18 18:26
+
+from django.db import migrations, models
+
+# Paths of the existing categories, walking the adjacency list from the roots
+BACKFILL_PATHS = """
+WITH RECURSIVE tree(id, path) AS (
+    SELECT id, id::text || '/' FROM listings_category WHERE parent_id IS NULL
+    UNION ALL
+    SELECT category.id, tree.path || category.id::text || '/'
+    FROM listings_category category JOIN tree ON category.parent_id = tree.id
+)
+UPDATE listings_category SET path = tree.path FROM tree WHERE listings_category.id = tree.id;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("listings", "0007_updated_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="category",
+            name="path",
+            field=models.CharField(
+                default="", editable=False, max_length=255, verbose_name="Path"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="category",
+            index=models.Index(
+                fields=["path"], name="category_path", opclasses=["varchar_pattern_ops"]
+            ),
+        ),
+        migrations.RunSQL(BACKFILL_PATHS, migrations.RunSQL.noop),
+    ]
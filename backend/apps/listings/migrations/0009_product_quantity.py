@@ -0,0 +1,129 @@
+# Generated by Django 4.2.6 on 2026-10-18 18:34
+
+from django.db import migrations, models
+import django.db.models.expressions
+
+# Per unit rows -> SKUs. Sold units keep their row (it may be linked to an
+# order) with sold = 1. The unsold units of a variant, identical but for their
+# id and images, collapse into their first row, which keeps its images and
+# gets the unit count as quantity.
+COLLAPSE_UNITS = """
+-- check the foreign keys now: no trigger event may be left pending when the
+-- constraint is added below
+SET CONSTRAINTS ALL IMMEDIATE;
+
+UPDATE listings_product SET sold = quantity WHERE is_sold;
+
+CREATE TEMPORARY TABLE product_units ON COMMIT DROP AS
+SELECT
+    id,
+    first_value(id) OVER (PARTITION BY listing_id, characteristics, description, additional_price, is_available ORDER BY id) AS sku_id,
+    count(*) OVER (PARTITION BY listing_id, characteristics, description, additional_price, is_available) AS units
+FROM listings_product
+WHERE is_active AND NOT is_sold AND NOT is_customized AND in_order_id IS NULL AND listing_id IS NOT NULL;
+
+UPDATE listings_product SET quantity = product_units.units
+FROM product_units WHERE listings_product.id = product_units.sku_id;
+
+DELETE FROM listings_product_images
+WHERE product_id IN (SELECT id FROM product_units WHERE id <> sku_id);
+
+DELETE FROM listings_product
+WHERE id IN (SELECT id FROM product_units WHERE id <> sku_id);
+
+SET CONSTRAINTS ALL DEFERRED;
+"""
+
+# SKUs -> one row per unit, sharing the SKU's images: available units as they
+# were, reserved ones not available (no order to link them to), sold ones sold.
+# The SKU row becomes its first unit, or is deactivated when it has none left.
+EXPAND_UNITS = """
+SET CONSTRAINTS ALL IMMEDIATE;
+
+CREATE TEMPORARY TABLE product_units ON COMMIT DROP AS
+SELECT
+    gen_random_uuid() AS id,
+    product.id AS sku_id,
+    unit.status,
+    row_number() OVER (PARTITION BY product.id ORDER BY unit.rank) AS n
+FROM listings_product product
+CROSS JOIN LATERAL (
+    SELECT 1 AS rank, 'available' AS status FROM generate_series(1, product.quantity - product.reserved - product.sold)
+    UNION ALL
+    SELECT 2, 'reserved' FROM generate_series(1, product.reserved)
+    UNION ALL
+    SELECT 3, 'sold' FROM generate_series(1, product.sold)
+) unit
+WHERE product.is_active AND NOT product.is_sold AND NOT product.is_customized;
+
+UPDATE listings_product SET is_active = false
+WHERE is_active AND NOT is_sold AND NOT is_customized
+AND id NOT IN (SELECT sku_id FROM product_units);
+
+INSERT INTO listings_product (
+    id, characteristics, description, additional_price, is_customized, is_sold, sold_at,
+    is_available, is_active, in_order_id, listing_id, updated_at, quantity, reserved, sold
+)
+SELECT
+    product_units.id, characteristics, description, additional_price, is_customized,
+    product_units.status = 'sold',
+    CASE WHEN product_units.status = 'sold' THEN coalesce(sold_at, updated_at) END,
+    is_available AND product_units.status = 'available',
+    is_active, in_order_id, listing_id, updated_at, 1, 0, 0
+FROM product_units JOIN listings_product ON listings_product.id = product_units.sku_id
+WHERE product_units.n > 1;
+
+INSERT INTO listings_product_images (product_id, imagemodel_id)
+SELECT product_units.id, listings_product_images.imagemodel_id
+FROM product_units JOIN listings_product_images ON listings_product_images.product_id = product_units.sku_id
+WHERE product_units.n > 1;
+
+UPDATE listings_product SET
+    is_sold = product_units.status = 'sold',
+    sold_at = CASE WHEN product_units.status = 'sold' THEN coalesce(sold_at, updated_at) END,
+    is_available = is_available AND product_units.status = 'available'
+FROM product_units
+WHERE listings_product.id = product_units.sku_id AND product_units.n = 1;
+
+SET CONSTRAINTS ALL DEFERRED;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("listings", "0008_category_path"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="quantity",
+            field=models.PositiveIntegerField(default=1, verbose_name="Quantity"),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="reserved",
+            field=models.PositiveIntegerField(default=0, verbose_name="Reserved"),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="sold",
+            field=models.PositiveIntegerField(default=0, verbose_name="Sold"),
+        ),
+        migrations.RunSQL(COLLAPSE_UNITS, EXPAND_UNITS),
+        migrations.AddConstraint(
+            model_name="product",
+            constraint=models.CheckConstraint(
+                check=models.Q(
+                    (
+                        "quantity__gte",
+                        django.db.models.expressions.CombinedExpression(
+                            models.F("reserved"), "+", models.F("sold")
+                        ),
+                    )
+                ),
+                name="product_reserved_and_sold_within_quantity",
+            ),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 4.2.6 on 2026-10-18 18:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("listings", "0009_product_quantity"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="imagemodel",
+            name="derivatives",
+            field=models.JSONField(
+                blank=True, editable=False, null=True, verbose_name="Derivatives"
+            ),
+        ),
+    ]
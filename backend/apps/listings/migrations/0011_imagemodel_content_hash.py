@@ -0,0 +1,25 @@
+# Generated by Django 4.2.6 on 2026-10-18 18:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("listings", "0010_imagemodel_derivatives"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="imagemodel",
+            name="content_hash",
+            field=models.CharField(
+                blank=True,
+                editable=False,
+                max_length=64,
+                null=True,
+                unique=True,
+                verbose_name="Content hash",
+            ),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.6 on 2026-10-18 19:04
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("listings", "0012_storagedeletion"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="imagemodel",
+            name="created_at",
+            field=models.DateTimeField(
+                default=django.utils.timezone.now,
+                editable=False,
+                verbose_name="Created at",
+            ),
+        ),
+    ]
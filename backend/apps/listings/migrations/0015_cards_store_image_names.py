@@ -0,0 +1,16 @@
+from django.db import migrations
+
+# Cards used to store image urls, they store names now. Missing cards are
+# built again on first read (cards.ensure_cards) or by rebuild_cards.
+DROP_CARDS = "DELETE FROM listings_listingcard;"
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("listings", "0014_remoteimage"),
+    ]
+
+    operations = [
+        migrations.RunSQL(DROP_CARDS, migrations.RunSQL.noop),
+    ]
@@ -1,7 +1,13 @@
 from datetime import timezone
+import hashlib
 import uuid
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVectorField
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction
+from django.db.models.functions import Coalesce, Concat, Substr
 from django.utils.translation import gettext as _
+from django.utils import timezone as django_timezone
 from django.utils.text import slugify
 
 import pycountry
@@ -22,13 +28,36 @@ def base64_image_to_file (image) :
     data = ContentFile(decoded_image, name=get_filename(decoded_image))
     return data
 
-def get_filename(decoded_image):
-    import uuid
-    filename = str(uuid.uuid4())[:12]
-    extension = get_file_extension(filename, decoded_image)
+def content_hash(file):
+    """
+        sha256 of a file's content, read chunk by chunk.
+    """
+    hasher = hashlib.sha256()
+    file.seek(0)
+    for chunk in file.chunks():
+        hasher.update(chunk)
+    file.seek(0)
+    return hasher.hexdigest()
+
+def get_filename(decoded_image, digest=None):
+    """
+        Images are named after their content: the same bytes always get the
+        same name, so a stored object never changes.
+    """
+    filename = digest or hashlib.sha256(decoded_image).hexdigest()
+    extension = get_file_extension(filename, decoded_image[:32])
 
     return f"{filename}.{extension}"
 
+def get_upload_filename(uploaded_file):
+    """
+        get_filename() for a multipart upload, hashed chunk by chunk: the
+        upload stays on disk, it is never read in memory.
+    """
+    header = uploaded_file.read(32)
+    uploaded_file.seek(0)
+    return get_filename(header, content_hash(uploaded_file))
+
 def get_file_extension (file_name, decoded_image) :
     import imghdr
 
@@ -39,6 +68,32 @@ def get_file_extension (file_name, decoded_image) :
 
 LANGUAGE_CHOICES = ((language.alpha_3, _(language.name)) for language in pycountry.languages)  # type: ignore
 
+# Postgres text search configuration used for a listing language, anything else is 'simple'.
+# Keep in sync with the listings_listing_search_vector_update() trigger.
+SEARCH_CONFIGS = {'fra': 'french', 'eng': 'english'}
+
+class CategoryQuerySet(models.QuerySet):
+    def subtree(self, category):
+        """
+            The category and all its descendants, an index range scan on the path prefix.
+        """
+        return self.filter(path__startswith=category.path)
+
+    def with_listing_count(self):
+        """
+            Annotates `listing_count`: active listings in the category or any of its descendants.
+        """
+        listings = (
+            Listing.objects
+            .filter(is_active=True, categories__path__startswith=models.OuterRef('path'))
+            .order_by()
+            .values('is_active')
+            .annotate(count=models.Count('id', distinct=True))
+            .values('count')
+        )
+        return self.annotate(listing_count=Coalesce(models.Subquery(listings), 0))
+
+
 class Category(models.Model):
     name = models.CharField(blank=True, null=True, max_length=100)
     description = models.TextField(blank=True, null=True)
@@ -46,9 +101,18 @@ class Category(models.Model):
     slug = models.SlugField(blank=True, null=True, unique=True, max_length=100, allow_unicode=True)
     parent = models.ForeignKey('self', on_delete=models.CASCADE, blank=True, null=True, related_name='children')
     language = models.CharField(_("Language"), max_length=3, choices=LANGUAGE_CHOICES, default='fra')
+    updated_at = models.DateTimeField(_("Updated at"), auto_now=True, db_index=True)
+    # Materialized path of ids from the root, e.g. '1/5/12/'. Maintained by save().
+    path = models.CharField(_("Path"), max_length=255, editable=False, default='')
+
+    objects = CategoryQuerySet.as_manager()
 
     class Meta:
         verbose_name_plural = 'Categories'
+        indexes = [
+            GinIndex(OpClass('name', name='gin_trgm_ops'), name='category_name_trgm'),
+            models.Index(fields=['path'], name='category_path', opclasses=['varchar_pattern_ops']),
+        ]
 
     def __str__(self):
         return self.name
@@ -57,12 +121,84 @@ class Category(models.Model):
         # Automatically generate the slug from the category name
         if not self.slug:
             self.slug = slugify(self.name)
-        super().save(*args, **kwargs)
-
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            self.update_path()
+
+    def update_path(self):
+        """
+            Recompute the path from the parent's and rewrite the paths of all
+            descendants in one UPDATE when it moved.
+        """
+        parent_path = ''
+        if self.parent_id is not None:
+            parent_path = Category.objects.filter(pk=self.parent_id).values_list('path', flat=True).get()
+            if f'/{self.pk}/' in f'/{parent_path}':
+                raise ValueError(f'Category {self.pk} cannot be a descendant of itself')
+        old_path, self.path = self.path, f'{parent_path}{self.pk}/'
+        if old_path == self.path:
+            return
+        Category.objects.filter(pk=self.pk).update(path=self.path)
+        if old_path:
+            Category.objects.filter(path__startswith=old_path).exclude(pk=self.pk).update(
+                path=Concat(models.Value(self.path), Substr('path', len(old_path) + 1)),
+                updated_at=django_timezone.now(),
+            )
+
+    def is_ancestor_of(self, category):
+        return category.path.startswith(self.path)
+
+
+
+class ImageModelQuerySet(models.QuerySet):
+    def for_images(self, images):
+        """
+            One ImageModel per validated image (a file, or the name of one
+            already stored), in order. Files whose content is already stored
+            reuse that row and are not uploaded again; the others are
+            uploaded in parallel (see uploads.store_files) and inserted with
+            one bulk insert. Names reuse the row already pointing to them, a
+            confirmed upload token given again registers nothing new.
+        """
+        from django.core.files.base import File
+        from .uploads import store_files
+
+        digests = [content_hash(image) if isinstance(image, File) else None for image in images]
+        rows = self.in_bulk([digest for digest in digests if digest], field_name='content_hash')
+        new = {}
+        for image, digest in zip(images, digests):
+            if digest and digest not in rows:
+                new.setdefault(digest, image)
+        if new:
+            names = store_files(ImageModel._meta.get_field('image'), list(new.values()))
+            # a concurrent upload of the same content may win the race,
+            # read the rows back rather than trusting the insert
+            self.bulk_create(
+                [ImageModel(image=name, content_hash=digest) for digest, name in zip(new, names)],
+                ignore_conflicts=True,
+            )
+            rows.update(self.in_bulk(list(new), field_name='content_hash'))
+
+        names = {image for image, digest in zip(images, digests) if not digest and image}
+        named = {}
+        for row in self.filter(image__in=names).order_by('id'):
+            named.setdefault(row.image.name, row)
+        missing = [name for name in dict.fromkeys(image for image in images if image in names) if name not in named]
+        named.update(zip(missing, self.bulk_create([ImageModel(image=name) for name in missing])))
+        blank = iter(self.bulk_create([ImageModel(image=image) for image, digest in zip(images, digests) if not digest and not image]))
+        return [rows[digest] if digest else named[image] if image else next(blank) for image, digest in zip(images, digests)]
 
 
 class ImageModel(models.Model):
     image = models.ImageField(upload_to=PRODUCT_FOLDER_NAME, blank=True, null=True, max_length=512)
+    # sha256 of the content of uploaded images, see ImageModelQuerySet.for_images()
+    content_hash = models.CharField(_("Content hash"), max_length=64, unique=True, null=True, blank=True, editable=False)
+    # {format: {width: name}} built by apps.listings.derivatives, null until then
+    derivatives = models.JSONField(_("Derivatives"), null=True, blank=True, editable=False)
+    # the media garbage collector leaves recent images alone
+    created_at = models.DateTimeField(_("Created at"), default=django_timezone.now, editable=False)
+
+    objects = ImageModelQuerySet.as_manager()
 
 class Manufacturer(models.Model):
     name = models.CharField(_("First Name"), max_length=112, blank=True, null=True)
@@ -71,7 +207,12 @@ class Manufacturer(models.Model):
     # location = models.PointField(_("Location"), blank=True, null=True)
     pictures = models.ManyToManyField(ImageModel, verbose_name=_("Manufacturer Pictures"), blank=True)
     description = models.TextField(_("Manufacturer Description"), blank=True, default=str)
+    updated_at = models.DateTimeField(_("Updated at"), auto_now=True, db_index=True)
 
+    class Meta:
+        indexes = [
+            GinIndex(OpClass('name', name='gin_trgm_ops'), name='manufacturer_name_trgm'),
+        ]
 
     @property
     def default_picture(self):
@@ -96,17 +237,41 @@ class Product(models.Model):
     is_available = models.BooleanField(_("Is available"), default=True)
     is_active = models.BooleanField(_("Is active"), default=True)
 
+    # A product is a SKU: `quantity` units of the variant, of which `reserved`
+    # are held by pending orders and `sold` are gone (see apps.listings.inventory).
+    quantity = models.PositiveIntegerField(_("Quantity"), default=1)
+    reserved = models.PositiveIntegerField(_("Reserved"), default=0)
+    sold = models.PositiveIntegerField(_("Sold"), default=0)
+
     images = models.ManyToManyField(ImageModel, verbose_name=_("Product Pictures"), blank=True)
     in_order = models.ForeignKey("orders.Order", verbose_name=_("Orders"), blank=True, related_name='products', null=True, on_delete=models.SET_NULL)
     listing = models.ForeignKey("Listing", verbose_name=_("Listing"), blank=True, related_name='products', null=True, on_delete=models.SET_NULL)
+    updated_at = models.DateTimeField(_("Updated at"), auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.CheckConstraint(
+                check=models.Q(quantity__gte=models.F('reserved') + models.F('sold')),
+                name='product_reserved_and_sold_within_quantity',
+            ),
+        ]
 
+    @property
+    def available(self):
+        if self.is_sold:
+            return 0
+        return self.quantity - self.reserved - self.sold
 
     def delete(self, *args, **kwargs):
-        if self.is_sold:
+        if self.is_sold or self.sold or self.reserved:
+            from .deletion import schedule_image_cleanup
+
             self.is_active = False
-            for i in self.images.all():  # type: ignore
-                i.delete()
-            return self.save()
+            self.save()
+            # images no active product and no manufacturer uses are deleted
+            # on commit, their files later, in batches (see apps.listings.deletion)
+            schedule_image_cleanup([self.pk])
+            return
         else:
             return super().delete(*args, **kwargs)
 
@@ -116,6 +281,41 @@ class Product(models.Model):
         return f'Product {self.id}, sold ? {self.is_sold}'
 
 
+# Units of a product that can still be ordered
+AVAILABLE_UNITS = models.F('quantity') - models.F('reserved') - models.F('sold')
+
+
+def in_stock_units():
+    """
+        Products that hold stock: active, unsold, not customized (customized
+        products are made to order) and with units left. Stock is the sum of
+        their AVAILABLE_UNITS.
+    """
+    return Product.objects.filter(
+        is_active=True,
+        is_sold=False,
+        is_customized=False,
+        quantity__gt=models.F('reserved') + models.F('sold'),
+    )
+
+
+class ListingQuerySet(models.QuerySet):
+    def with_stock(self):
+        units = (
+            in_stock_units()
+            .filter(listing=models.OuterRef('pk'))
+            .order_by()
+            .values('listing')
+            .annotate(count=models.Sum(AVAILABLE_UNITS))
+            .values('count')
+        )
+        return self.annotate(stock_count=Coalesce(models.Subquery(units), 0))
+
+    def in_stock(self, in_stock=True):
+        units = models.Exists(in_stock_units().filter(listing=models.OuterRef('pk')))
+        return self.filter(units) if in_stock else self.exclude(units)
+
+
 class Listing(models.Model):
     class ProductType(models.IntegerChoices):
         OTHER = 0
@@ -135,12 +335,29 @@ class Listing(models.Model):
     name = models.CharField(_("Product Name"), max_length=112, default="Unnamed Product")
     description = models.TextField(_("Product Description"), blank=True, default=str)
     is_active = models.BooleanField(_("Is active"), default=True)
+    # also touched when its products, categories, manufacturer or images change (apps.listings.signals)
+    updated_at = models.DateTimeField(_("Updated at"), auto_now=True, db_index=True)
+    # maintained by a database trigger from name, description and lang
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = ListingQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_vector'], name='listing_search_vector'),
+            GinIndex(OpClass('name', name='gin_trgm_ops'), name='listing_name_trgm'),
+            # keyset pagination
+            models.Index(fields=['name', 'id'], name='listing_name_id'),
+        ]
 
     def __str__(self):
         return f'{self.name} - Category: {self.categories}'
 
     @property
     def default_image(self):
+        if hasattr(self, '_default_image'):
+            # batched by apps.listings.prefetch
+            return self._default_image
         product = self.products.filter(is_active=True, images__image__isnull=False).first()
         if product is None:
             return None
@@ -148,7 +365,10 @@ class Listing(models.Model):
 
     @property
     def stock(self):
-        return self.products.orders.filter(is_sold=False).count()
+        if hasattr(self, 'stock_count'):
+            # annotated by ListingQuerySet.with_stock()
+            return self.stock_count
+        return in_stock_units().filter(listing=self).aggregate(stock=Coalesce(models.Sum(AVAILABLE_UNITS), 0))['stock']
 
     def save(self, *args, **kwargs):
         self.name = self.name.strip()  # type: ignore
@@ -156,10 +376,57 @@ class Listing(models.Model):
         return super().save(*args, **kwargs)
 
     def delete(self, *args, **kwargs):
+        from .deletion import soft_delete_listings
+
         self.is_active = False
-        for product in self.products.all():  # type: ignore
-            product.delete()
-        self.save()
+        soft_delete_listings(Listing.objects.filter(pk=self.pk))
+
+
+class ListingCard(models.Model):
+    """
+        Read model for the catalog: the grouped representation of a listing
+        (variants, default image, manufacturer, categories) plus its stock,
+        kept up to date by apps.listings.signals. See apps.listings.cards.
+    """
+    listing = models.OneToOneField(Listing, on_delete=models.CASCADE, primary_key=True, related_name='card')
+    data = models.JSONField(_("Card"), encoder=DjangoJSONEncoder)
+    updated_at = models.DateTimeField(_("Updated at"), auto_now=True)
+
+    def __str__(self):
+        return f'Card of {self.listing_id}'
+
+
+class StorageDeletion(models.Model):
+    """
+        A stored file waiting to be deleted from storage, in batches, outside
+        the request that removed it. See apps.listings.deletion.
+    """
+    name = models.CharField(_("Name"), max_length=512, unique=True)
+    # the image the file is (or is a derivative of): the file is kept if an
+    # image of that name is stored again meanwhile
+    image = models.CharField(_("Image"), max_length=512)
+    attempts = models.PositiveSmallIntegerField(_("Attempts"), default=0)
+    retry_at = models.DateTimeField(_("Retry at"), default=django_timezone.now, db_index=True)
+    last_error = models.TextField(_("Last error"), blank=True, default=str)
+    created_at = models.DateTimeField(_("Created at"), auto_now_add=True)
+
+    def __str__(self):
+        return f'Deletion of {self.name}'
+
+
+class RemoteImage(models.Model):
+    """
+        An image given as an http(s) url, waiting to be fetched and stored
+        like an upload. See apps.listings.ingestion.
+    """
+    image = models.OneToOneField(ImageModel, verbose_name=_("Image"), on_delete=models.CASCADE, related_name='remote')
+    attempts = models.PositiveSmallIntegerField(_("Attempts"), default=0)
+    retry_at = models.DateTimeField(_("Retry at"), default=django_timezone.now, db_index=True)
+    last_error = models.TextField(_("Last error"), blank=True, default=str)
+    created_at = models.DateTimeField(_("Created at"), auto_now_add=True)
+
+    def __str__(self):
+        return f'Fetch of image {self.image_id}'
 
 
 class Coupon(models.Model):
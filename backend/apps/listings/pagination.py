@@ -1,22 +1,174 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ImproperlyConfigured, ValidationError as DjangoValidationError
+from django.db.models import BooleanField, F, Func, Value
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from rest_framework.utils.urls import replace_query_param
 
 # Define the number of items per page
 ITEMS_PER_PAGE = 16
 
-class CategoryPagination(PageNumberPagination):
-    page_size = ITEMS_PER_PAGE
-    page_size_query_param = 'page_size'
-    max_page_size = 1000
-    ordering = ['-created_at']
 
-class ListingPagination(PageNumberPagination):
-    page_size = ITEMS_PER_PAGE
-    page_size_query_param = 'page_size'
-    max_page_size = 1000
-    ordering = ['-created_at']
+class RowComparison(Func):
+    """
+        `(a, b, ...) > (x, y, ...)` (or `<`): the rows after a position in
+        the (a, b, ...) order, which a btree index on those fields serves.
+    """
+    output_field = BooleanField()
+
+    def __init__(self, fields, values, operator):
+        super().__init__(*(F(field) for field in fields), *values)
+        self.operator = operator
+
+    def as_sql(self, compiler, connection, **extra_context):
+        sqls, params = [], []
+        for expression in self.get_source_expressions():
+            sql, expression_params = compiler.compile(expression)
+            sqls.append(sql)
+            params.extend(expression_params)
+        half = len(sqls) // 2
+        return f"({', '.join(sqls[:half])}) {self.operator} ({', '.join(sqls[half:])})", params
+
+
+class KeysetCursorPagination(CursorPagination):
+    """
+        Cursor pagination on the whole `ordering`: DRF's cursor only keeps the
+        first field and falls back to an offset among equal values, this one
+        holds the values of every field of the row a page starts after. The
+        fields must all be sorted the same way, and not null.
+    """
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        if len({key.startswith('-') for key in self.ordering}) > 1:
+            raise ImproperlyConfigured(f'{self.ordering} mixes ascending and descending fields.')
+
+        self.base_url = request.build_absolute_uri()
+        self.fields = [key.lstrip('-') for key in self.ordering]
+        position, reverse = self.decode_cursor(request, queryset.model)
+        descending = self.ordering[0].startswith('-')
+        ordering = [f'-{field}' for field in self.fields] if descending != reverse else self.fields
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(RowComparison(self.fields, position, '<' if descending != reverse else '>'))
+
+        rows = list(queryset[:self.page_size + 1])
+        more = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        if reverse:
+            self.page.reverse()
+        self.has_next = more if not reverse else position is not None
+        self.has_previous = more if reverse else position is not None
+        return self.page
+
+    def decode_cursor(self, request, model):
+        """
+            (position, reverse) of the cursor, the position as values to
+            compare the ordering fields to. (None, False) without a cursor.
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None, False
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            fields = [model._meta.pk if field == 'pk' else model._meta.get_field(field) for field in self.fields]
+            if len(cursor['p']) != len(fields):
+                raise ValueError(encoded)
+            position = [Value(field.to_python(value), output_field=field) for field, value in zip(fields, cursor['p'])]
+            return position, bool(cursor['r'])
+        except (binascii.Error, DjangoValidationError, KeyError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, instance, reverse):
+        position = [str(getattr(instance, field)) for field in self.fields]
+        encoded = base64.urlsafe_b64encode(json.dumps({'p': position, 'r': int(reverse)}).encode()).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
 
-class DefaultPagination(PageNumberPagination):
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+
+class KeysetPagination(PageNumberPagination):
+    """
+        Page number pagination by default. Clients opt in to keyset (cursor)
+        pagination with `?pagination=cursor` on the first page and then follow
+        the `next` / `previous` links, which carry a `cursor` param. Cursor
+        pages don't COUNT(*) nor OFFSET, so their cost doesn't depend on depth.
+        `cursor_ordering` must be a stable ordering on indexed, non null fields,
+        all sorted the same way (see KeysetCursorPagination). Cursor pages
+        always follow it: the query params of `cursor_excluded_params`, which
+        would order the results otherwise, are refused.
+    """
     page_size = ITEMS_PER_PAGE
     page_size_query_param = 'page_size'
     max_page_size = 1000
-    ordering = ['-created_at']
\ No newline at end of file
+    cursor_ordering = ('pk',)
+    cursor_query_param = 'cursor'
+    mode_query_param = 'pagination'
+    cursor_excluded_params = ()
+
+    cursor_paginator = None
+
+    def use_cursor(self, request):
+        return (
+            self.cursor_query_param in request.query_params
+            or request.query_params.get(self.mode_query_param) == 'cursor'
+        )
+
+    def get_cursor_paginator(self):
+        paginator = KeysetCursorPagination()
+        paginator.page_size = self.page_size
+        paginator.page_size_query_param = self.page_size_query_param
+        paginator.max_page_size = self.max_page_size
+        paginator.ordering = self.cursor_ordering
+        paginator.cursor_query_param = self.cursor_query_param
+        return paginator
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.use_cursor(request):
+            excluded = [param for param in self.cursor_excluded_params if request.query_params.get(param)]
+            if excluded:
+                raise ValidationError({
+                    param: 'Cursor pages follow their own ordering, use page numbers for this.' for param in excluded
+                })
+            self.cursor_paginator = self.get_cursor_paginator()
+            return self.cursor_paginator.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response_schema(schema)
+        return super().get_paginated_response_schema(schema)
+
+
+class CategoryPagination(KeysetPagination):
+    # category names are nullable, ids are not
+    cursor_ordering = ('id',)
+    cursor_excluded_params = ('ordering',)
+
+class ListingPagination(KeysetPagination):
+    # served by the listing_name_id index
+    cursor_ordering = ('name', 'id')
+    cursor_excluded_params = ('ordering', 'search')
+
+class DefaultPagination(KeysetPagination):
+    cursor_ordering = ('pk',)
+
+class OrderPagination(KeysetPagination):
+    cursor_ordering = ('-created_at', '-id')
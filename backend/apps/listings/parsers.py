@@ -0,0 +1,50 @@
+# Multipart bodies for the catalog: images as file parts instead of base64 strings
+
+import json
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import DataAndFiles, FormParser, JSONParser, MultiPartParser
+
+# a string "upload:<part name>" in the JSON document stands for that file part
+UPLOAD_PREFIX = 'upload:'
+
+
+def attach_uploads(value, files):
+    if isinstance(value, dict):
+        return {key: attach_uploads(item, files) for key, item in value.items()}
+    if isinstance(value, list):
+        return [attach_uploads(item, files) for item in value]
+    if isinstance(value, str) and value.startswith(UPLOAD_PREFIX):
+        name = value[len(UPLOAD_PREFIX):]
+        if name not in files:
+            raise ParseError(f'No file part named {name}')
+        return files[name]
+    return value
+
+
+class MultiPartJSONParser(MultiPartParser):
+    """
+        Multipart bodies whose file parts are streamed to temporary files by
+        Django's upload handlers (see FILE_UPLOAD_HANDLERS). Plain form
+        fields work as with MultiPartParser, nested documents (a listing and
+        its options, a manufacturer and its pictures) go as JSON in a `data`
+        part, where "upload:<part name>" references a file part:
+
+            data={"name": ..., "options": [{"label": ..., "images": [{"image": "upload:front"}]}]}
+            front=<image file>
+    """
+    def parse(self, stream, media_type=None, parser_context=None):
+        parsed = super().parse(stream, media_type, parser_context)
+        if 'data' not in parsed.data:
+            return parsed
+        try:
+            document = json.loads(parsed.data['data'])
+        except ValueError as error:
+            raise ParseError(f'data is not valid JSON: {error}')
+        if not isinstance(document, dict):
+            raise ParseError('data must be a JSON object')
+        return DataAndFiles(attach_uploads(document, parsed.files), parsed.files)
+
+
+# parser_classes of the catalog viewsets taking images
+CATALOG_PARSER_CLASSES = [JSONParser, MultiPartJSONParser, FormParser]
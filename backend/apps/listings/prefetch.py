@@ -0,0 +1,169 @@
+# Page-level loaders used by the listing serializers, so that a whole page of
+# listings is represented with a fixed number of queries instead of a few per row.
+
+from django.db.models import F, Sum, prefetch_related_objects
+
+from .models import AVAILABLE_UNITS, Product, in_stock_units
+
+
+def variant_stock(listing_ids):
+    """
+        {(listing_id, label, value): units in stock}, one grouped SUM for all
+        the listings.
+    """
+    rows = (
+        in_stock_units()
+        .filter(listing_id__in=listing_ids)
+        .values('listing_id', 'characteristics__label', 'characteristics__value')
+        .annotate(stock=Sum(AVAILABLE_UNITS))
+        .order_by()
+    )
+    return {
+        (row['listing_id'], row['characteristics__label'], row['characteristics__value']): row['stock']
+        for row in rows
+    }
+
+
+def attach_stock(products):
+    """
+        Set `_stock` on every variant. Customized variants are made to order
+        and have no stock.
+    """
+    stock = variant_stock({product.listing_id for product in products})
+    for product in products:
+        characteristics = product.characteristics or {}
+        key = (product.listing_id, characteristics.get('label'), characteristics.get('value'))
+        product._stock = None if product.is_customized else stock.get(key, 0)
+
+
+def flat_products_by_listing(listing_ids):
+    """
+        Same selection as ListingSerializer used to do per listing: one product
+        per (label, value) for regular variants, one per label for customized
+        ones. Returns {listing_id: [Product, ...]} with images prefetched.
+    """
+    listing_ids = list(listing_ids)
+    products = {listing_id: [] for listing_id in listing_ids}
+    if not listing_ids:
+        return products
+
+    unique_products = list(
+        Product.objects
+        .filter(is_customized=False, is_active=True, listing_id__in=listing_ids)
+        .order_by('listing_id', 'characteristics__label', 'characteristics__value')
+        .distinct('listing_id', 'characteristics__label', 'characteristics__value')
+    )
+    customized_products = list(
+        Product.objects
+        .filter(is_customized=True, is_active=True, listing_id__in=listing_ids)
+        .order_by('listing_id', 'characteristics__label')
+        .distinct('listing_id', 'characteristics__label')
+    )
+    prefetch_related_objects(unique_products + customized_products, 'images')
+    attach_stock(unique_products + customized_products)
+
+    for product in unique_products + customized_products:
+        products[product.listing_id].append(product)
+    return products
+
+
+def category_values_by_listing(listings):
+    """
+        Equivalent of `listing.categories.values('id', 'name', 'image')` for every
+        listing, backed by a single prefetch that also feeds the `categories` pk field.
+    """
+    prefetch_related_objects(listings, 'categories')
+    return {
+        listing.id: [
+            {'id': category.id, 'name': category.name, 'image': category.image.name}
+            for category in listing.categories.all()
+        ]
+        for listing in listings
+    }
+
+
+def variants_by_listing(listing_ids):
+    """
+        One product per (label, value) across every listing of the page, in
+        a single DISTINCT ON query. Returns {listing_id: [Product, ...]} ordered
+        by label then value, with images prefetched.
+    """
+    listing_ids = list(listing_ids)
+    products = {listing_id: [] for listing_id in listing_ids}
+    if not listing_ids:
+        return products
+
+    variants = list(
+        Product.objects
+        .filter(is_active=True, listing_id__in=listing_ids)
+        .order_by('listing_id', 'characteristics__label', 'characteristics__value')
+        .distinct('listing_id', 'characteristics__label', 'characteristics__value')
+    )
+    prefetch_related_objects(variants, 'images')
+    attach_stock(variants)
+
+    for product in variants:
+        products[product.listing_id].append(product)
+    return products
+
+
+def default_images_by_listing(listing_ids):
+    """
+        Batched version of `Listing.default_image`: the first image of the first
+        active product that has a picture, for every listing in one query.
+    """
+    listing_ids = list(listing_ids)
+    images = {listing_id: None for listing_id in listing_ids}
+    if not listing_ids:
+        return images
+
+    first_products = (
+        Product.objects
+        .filter(is_active=True, images__image__isnull=False, listing_id__in=listing_ids)
+        .order_by('listing_id', 'id')
+        .distinct('listing_id')
+        .values('id')
+    )
+    rows = (
+        Product.images.through.objects
+        .filter(product_id__in=first_products)
+        .order_by('product_id', 'imagemodel_id')
+        .distinct('product_id')
+        .select_related('imagemodel')
+        .annotate(listing_id=F('product__listing_id'))
+    )
+    for row in rows:
+        images[row.listing_id] = row.imagemodel
+    return images
+
+
+def prefetch_listing_representation(listings):
+    """
+        Attach the flattened products and category values to each listing so
+        ListingSerializer.to_representation doesn't have to query them.
+    """
+    listings = list(listings)
+    products = flat_products_by_listing(listing.id for listing in listings)
+    categories = category_values_by_listing(listings)
+    for listing in listings:
+        listing._flat_products = products[listing.id]
+        listing._category_values = categories[listing.id]
+    return listings
+
+
+def prefetch_grouped_representation(listings):
+    """
+        Same idea for ListingGroupByLabelSeriazlizer: variants, default image,
+        categories and manufacturer pictures for the whole page.
+    """
+    listings = list(listings)
+    listing_ids = [listing.id for listing in listings]
+    variants = variants_by_listing(listing_ids)
+    default_images = default_images_by_listing(listing_ids)
+    categories = category_values_by_listing(listings)
+    prefetch_related_objects(listings, 'manufacturer__pictures')
+    for listing in listings:
+        listing._variants = variants[listing.id]
+        listing._default_image = default_images[listing.id]
+        listing._category_values = categories[listing.id]
+    return listings
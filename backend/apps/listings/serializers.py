@@ -1,21 +1,97 @@
 # Serializers for Category Model, Product Model
 
 import functools
+import itertools
+import operator
 import warnings
+from django.core.files.uploadedfile import UploadedFile
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
 from rest_framework import serializers
-from .models import Category, Coupon, ImageModel, Manufacturer, Product, Listing, base64_image_to_file
+from .models import Category, Coupon, ImageModel, Manufacturer, Product, Listing, base64_image_to_file, get_upload_filename
 
 from apps.orders.models import Order
 from .models import Category, ImageModel, Manufacturer, Product, Listing, base64_image_to_file
+from .cards import card_representation, ensure_cards
+from .deletion import schedule_image_cleanup
+from .derivatives import schedule_derivatives
+from .ingestion import queue_remote_images
+from .media import media_url, srcset
+from .signals import listings_bulk_changed
+from .uploads import CONTENT_TYPES, FOLDERS, TOKEN_PREFIX, uploaded_key
+from .prefetch import (
+    category_values_by_listing,
+    flat_products_by_listing,
+    prefetch_grouped_representation,
+    prefetch_listing_representation,
+)
+
+
+# product fields an option sets: an update leaving one out resets it to its default
+OPTION_FIELDS = ('description', 'additional_price', 'is_customized', 'is_available')
+
+
+def variant_key(characteristics):
+    characteristics = characteristics or {}
+    return characteristics.get('label'), characteristics.get('value')
+
+
+def variants_representation(products, context=None, stock=True):
+    """
+        ProductSerializer data plus, with `stock`, the stock of each variant
+        (see prefetch.attach_stock)
+    """
+    representation = ProductSerializer(instance=products, many=True, context=context or {}).data
+    if stock:
+        for product, data in zip(products, representation):
+            data['stock'] = product._stock
+    return representation
+
+
+def categories_representation(categories):
+    """
+        The `category_values_by_listing` of a listing, images as urls (see
+        apps.listings.media) rather than stored names.
+    """
+    storage = Category._meta.get_field('image').storage
+    return [
+        {**category, 'image': media_url(category['image'], storage) if category['image'] else category['image']}
+        for category in categories
+    ]
 
 
 class Base64ImageField(serializers.FileField):
     def to_internal_value (self, data) :
         if isinstance(data, str) and (data.startswith('http://') or data.startswith('https://')):
+            # served as is until apps.listings.ingestion fetches and stores it
             return data
+        if isinstance(data, str) and data.startswith(TOKEN_PREFIX):
+            # a presigned upload (see uploads.presigned_upload), already in the bucket
+            try:
+                return uploaded_key(data)
+            except ValueError as error:
+                raise serializers.ValidationError(str(error))
+        if isinstance(data, UploadedFile):
+            # a multipart part, already streamed to disk (see parsers.MultiPartJSONParser)
+            data.name = get_upload_filename(data)
+            return super().to_internal_value(data)
         data = base64_image_to_file(data)
         return super().to_internal_value(data)
 
+    def to_representation(self, value):
+        if not value:
+            return None
+        # cards store names, resolved when read (see cards.card_representation)
+        if not self.use_url or self.context.get('media_names'):
+            return value.name
+        # see apps.listings.media, no signing per image per response
+        url = media_url(value.name, value.storage)
+        request = self.context.get('request', None)
+        if request is not None and url.startswith('/'):
+            return request.build_absolute_uri(url)
+        return url
+
 
 class CategorySerializer(serializers.ModelSerializer):
     image = Base64ImageField(max_length=None, use_url=True, required=False)
@@ -23,12 +99,71 @@ class CategorySerializer(serializers.ModelSerializer):
         model = Category
         fields = '__all__'
 
+    def validate_parent(self, parent):
+        if parent is not None and self.instance is not None and self.instance.is_ancestor_of(parent):
+            raise serializers.ValidationError("A category cannot be moved under itself or one of its sub-categories.")
+        return parent
+
+
+def nest_categories(categories):
+    """
+        Links each category to its children (`_children`) and returns the
+        roots: categories whose parent is not part of `categories`.
+    """
+    nodes = {category.id: category for category in categories}
+    roots = []
+    for category in nodes.values():
+        category._children = []
+    for category in nodes.values():
+        parent = nodes.get(category.parent_id)
+        (parent._children if parent is not None else roots).append(category)
+    return roots
+
+
+class CategoryTreeSerializer(CategorySerializer):
+    """
+        A category with its `listing_count` (see CategoryQuerySet.with_listing_count)
+        and its nested `children`, linked by nest_categories().
+    """
+    listing_count = serializers.IntegerField(read_only=True)
+
+    class Meta(CategorySerializer.Meta):
+        fields = ('id', 'name', 'slug', 'description', 'image', 'language', 'parent', 'path', 'listing_count')
+
+    def to_representation(self, instance):
+        representation = super().to_representation(instance)
+        representation['children'] = [self.to_representation(child) for child in instance._children]
+        return representation
+
 
 class ImageModelSerializer(serializers.ModelSerializer):
     image = Base64ImageField(max_length=None, use_url=True, required=False)
+    srcset = serializers.SerializerMethodField()
     class Meta:
         model = ImageModel
-        fields = ['id', 'image',]
+        fields = ['id', 'image', 'srcset']
+
+    def create(self, validated_data):
+        # an image already stored is reused, see ImageModelQuerySet.for_images()
+        image, = ImageModel.objects.for_images([validated_data.get('image')])
+        if image.derivatives is None:
+            schedule_derivatives([image.id])
+        queue_remote_images([image])
+        return image
+
+    def get_srcset(self, image):
+        """
+            {format: "url 160w, url 320w, ..."} of the derivatives (see
+            apps.listings.derivatives), empty until they are built.
+        """
+        if self.context.get('media_names'):
+            return image.derivatives or {}
+        return srcset(image.derivatives, image.image.storage)
+
+
+class PresignedUploadSerializer(serializers.Serializer):
+    folder = serializers.ChoiceField(choices=list(FOLDERS), default='product')
+    content_type = serializers.ChoiceField(choices=list(CONTENT_TYPES))
 
 
 class ManufacturerSerializer(serializers.ModelSerializer):
@@ -48,20 +183,22 @@ class ProductSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
         fields = '__all__'
+        # only moved by apps.listings.inventory
+        read_only_fields = ('reserved', 'sold')
 
     def create(self, validated_data):
-        if 'images' in validated_data:
-            images = validated_data.pop('images')
-            instance = super().create(validated_data)
-            for image in images:
-                image_serializer = ImageModelSerializer(data=image)
-                if image_serializer.is_valid():
-                    image_serializer.save()
-                    instance.images.add(image_serializer.instance)
-                else:
-                    warnings.warn(f'errors: {image_serializer.errors}')
-            return instance
-        return super().create(validated_data)
+        images = validated_data.pop('images', [])
+        instance = super().create(validated_data)
+        if images:
+            # uploaded in parallel, linked with one insert
+            rows = ImageModel.objects.for_images([image.get('image') for image in images])
+            schedule_derivatives([row.id for row in rows if row.derivatives is None])
+            queue_remote_images(rows)
+            Product.images.through.objects.bulk_create(
+                [Product.images.through(product_id=instance.id, imagemodel_id=row.id) for row in rows],
+                ignore_conflicts=True,
+            )
+        return instance
 
     def validate(self, attrs):
         characteristics = attrs.get('characteristics')
@@ -84,31 +221,153 @@ class BaseListingSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
-    def generate_products(self, options):
-        products = []
-        stock = 0
+    def parse_option(self, option, raise_exception=False):
+        """
+            Validates an option (`label`, `value`, `stock` or product fields)
+            as a product. Returns its validated data, or None with a warning
+            (a ValidationError with `raise_exception`).
+        """
+        option = dict(option)
+        if 'characteristics' not in option:
+            label = option.pop("label", "input")
+            value = option.pop('value', "")
+            option['characteristics'] = {'label': label, 'value': value}
+        option.setdefault('quantity', option.pop('stock', 1))
+        serializer = ProductSerializer(data=option)
+        if not serializer.is_valid():
+            if raise_exception:
+                raise serializers.ValidationError({'options': serializer.errors})
+            warnings.warn(f'errors: {serializer.errors}')
+            return None
+        return dict(serializer.validated_data)
+
+    def insert_products(self, products_data, listing, images_data=()):
+        """
+            Inserts one product per validated data and the images of each, plus
+            the `images_data` ([(product, [image data])]) of existing products,
+            with one bulk INSERT per table.
+        """
+        products, images = [], []
+        for data in products_data:
+            product_images = data.pop('images', [])
+            product = Product(listing=listing, **data)
+            products.append(product)
+            images += [(product, image.get('image')) for image in product_images]
+        images += [(product, image.get('image')) for product, product_images in images_data for image in product_images]
+
+        Product.objects.bulk_create(products)
+        rows = ImageModel.objects.for_images([image for _, image in images])
+        schedule_derivatives([row.id for row in rows if row.derivatives is None])
+        queue_remote_images(rows)
+        # the same content given twice for a product is linked once
+        Product.images.through.objects.bulk_create([
+            Product.images.through(product_id=product.id, imagemodel_id=row.id)
+            for (product, _), row in zip(images, rows)
+        ], ignore_conflicts=True)
+        return products
 
-        for option in options:
-            stock = 1
-            if 'characteristics' not in option:
-                label = option.pop("label", "input")
-                stock = option.pop('stock', 1)
-                value = option.pop('value', "")
-                option['characteristics'] = {'label': label, 'value': value}
-            if stock == 0:
-                stock = 1
-            for _ in range(stock):
-                product = ProductSerializer(data=option)
-                if product.is_valid():
-                    product.save()
-                    products.append(product)
-                else:
-                    warnings.warn(f'errors: {product.errors}')
+    def generate_products(self, options, listing):
+        """
+            One product (SKU) per option, holding its `stock` as `quantity`.
+            Each option is validated once, then the products and their images
+            are inserted with one bulk INSERT per table.
+        """
+        products = self.insert_products(
+            [data for data in map(self.parse_option, options) if data is not None], listing
+        )
+        # bulk inserts send no model signals
+        listings_bulk_changed([listing.id])
         return products
 
+    def update_products(self, options, listing):
+        """
+            Applies `options` to the live (active, unsold) products of the
+            listing as a diff keyed on (label, value):
+            - new variants are inserted,
+            - existing ones are updated only if a field changed, their `stock`
+              being what's left once reserved and sold units are counted and
+              the OPTION_FIELDS left out being reset to their default,
+            - the variants left out are deactivated, and the images only they
+              showed deleted once the transaction commits. So are the extra
+              live rows of a variant: the one holding reserved or sold units,
+              else the least recently updated, is kept.
+            An invalid option fails the whole update, it would otherwise read
+            as a variant left out. An option without `images` keeps the
+            current ones; images given with the `id` of a current image are
+            kept, the others are created. Every step is one bulk statement.
+        """
+        current, duplicates = {}, []
+        for product in (
+            listing.products.filter(is_active=True, is_sold=False)
+            .order_by(F('reserved').desc(), F('sold').desc(), 'updated_at', 'id')
+            .prefetch_related('images')
+        ):
+            if current.setdefault(variant_key(product.characteristics), product) is not product:
+                duplicates.append(product.id)
+
+        wanted = {}
+        for option in options:
+            data = self.parse_option(option, raise_exception=True)
+            wanted[variant_key(data['characteristics'])] = (data, option.get('images'))
+
+        now = timezone.now()
+        new_products, changed, changed_fields = [], [], set()
+        unlinked, new_images = [], []
+        for key, (data, raw_images) in wanted.items():
+            product = current.get(key)
+            if product is None:
+                new_products.append(data)
+                continue
+            images = data.pop('images', None)
+            for field in OPTION_FIELDS:
+                data.setdefault(field, Product._meta.get_field(field).get_default())
+            data['quantity'] += product.reserved + product.sold
+            fields = [field for field, value in data.items() if getattr(product, field) != value]
+            if fields:
+                for field in fields:
+                    setattr(product, field, data[field])
+                product.updated_at = now
+                changed.append(product)
+                changed_fields.update(fields)
+
+            if raw_images is None:
+                continue
+            current_ids = {image.id for image in product.images.all()}
+            kept_ids = {raw.get('id') for raw in raw_images if isinstance(raw, dict)} & current_ids
+            added = [image for raw, image in zip(raw_images, images or []) if not (isinstance(raw, dict) and raw.get('id') in current_ids)]
+            if kept_ids != current_ids:
+                unlinked.append(Q(product_id=product.id) & ~Q(imagemodel_id__in=kept_ids))
+            if added:
+                new_images.append((product, added))
+
+        removed = [product.id for key, product in current.items() if key not in wanted] + duplicates
+        if removed:
+            Product.objects.filter(id__in=removed).update(is_active=False, updated_at=now)
+            schedule_image_cleanup(removed)
+        if changed:
+            Product.objects.bulk_update(changed, [*changed_fields, 'updated_at'])
+        if unlinked:
+            Product.images.through.objects.filter(functools.reduce(operator.or_, unlinked)).delete()
+        self.insert_products(new_products, listing, new_images)
+        # bulk writes send no model signals
+        listings_bulk_changed([listing.id])
+
+
+class ListingListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        """
+            Load the products, images and categories of the whole page at once
+            instead of letting every listing query its own.
+        """
+        iterable = data.all() if hasattr(data, 'all') else data
+        return super().to_representation(self.child.prefetch(iterable))
+
 
 class ListingSerializer(BaseListingSerializer):
-    options = serializers.ListSerializer(child=serializers.JSONField(), required=False)
+    # dicts rather than JSON values, images of a multipart body are uploaded files
+    options = serializers.ListSerializer(child=serializers.DictField(), required=False)
+    prefetch = staticmethod(prefetch_listing_representation)
+
     class Meta:
         model = Listing
         fields = [
@@ -120,35 +379,26 @@ class ListingSerializer(BaseListingSerializer):
             'categories',
             'options'
         ]
+        list_serializer_class = ListingListSerializer
 
     def to_representation(self, instance):
         """
             We want to flatten the products field to be a list of unique products
-        """
-        representation = super().to_representation(instance)
-        filtered_products = Product.objects.filter(
-            is_customized=False,
-            is_active=True,
-            listing__id=instance.id
-        )
-        unique_products_dict = (
-            filtered_products
-            .order_by('characteristics__label', 'characteristics__value')
-            .distinct('characteristics__label', 'characteristics__value')
-        )
-        """
             We don't wan'to display all of the customized products, so we flatten them
         """
-        customized_products = (
-            Product.objects
-            .filter(is_customized=True, is_active=True, listing__id=instance.id)
-            .order_by('characteristics__label')
-            .distinct('characteristics__label')
-        )
-        representation['products'] = ProductSerializer(instance=unique_products_dict.union(customized_products), many=True).data
-        representation['categories'] = list(instance.categories.values('id', 'name', 'image'))
+        if hasattr(instance, '_flat_products'):
+            products, categories = instance._flat_products, instance._category_values
+        else:
+            # single instance (retrieve / create / update), nothing was batched
+            products = flat_products_by_listing([instance.id])[instance.id]
+            categories = category_values_by_listing([instance])[instance.id]
+        representation = super().to_representation(instance)
+        # the products keep their shape, the stock of each is opt-in (?variant_stock=true)
+        representation['products'] = variants_representation(products, stock=self.context.get('variant_stock', False))
+        representation['categories'] = categories_representation(categories)
         return representation
 
+    @transaction.atomic
     def create(self, validated_data):
         """
             Will receive data like this:
@@ -198,21 +448,17 @@ class ListingSerializer(BaseListingSerializer):
         """
         options = validated_data.pop('options', [])
         instance = super().create(validated_data)
-        products = self.generate_products(options)
-        instance.products.add(*map(lambda p: p.instance, products))
+        self.generate_products(options, instance)
         return instance
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         """
             For PUT not PATCH.
             Current configuration doesn't allow for PATCHing the products field
         """
         if 'options' in validated_data:
-            options = validated_data.pop('options', [])
-            products = self.generate_products(options)
-            for product in instance.products.all():
-                product.delete()
-            instance.products.add(*map(lambda p: p.instance, products))
+            self.update_products(validated_data.pop('options', []), instance)
         return super().update(instance, validated_data)
 
 
@@ -228,6 +474,7 @@ class ListingGroupByLabelSeriazlizer(BaseListingSerializer):
     variants = serializers.JSONField(required=False)
     manufacturer = AtomicManufacturerSerializer(required=False)
     default_image = ImageModelSerializer(required=False)
+    prefetch = staticmethod(prefetch_grouped_representation)
 
     class Meta:
         model = Listing
@@ -241,6 +488,7 @@ class ListingGroupByLabelSeriazlizer(BaseListingSerializer):
             'variants',
             'default_image'
         ]
+        list_serializer_class = ListingListSerializer
 
     def to_representation(self, instance):
         """
@@ -290,34 +538,49 @@ class ListingGroupByLabelSeriazlizer(BaseListingSerializer):
                 }
             ]
         """
+        if not hasattr(instance, '_variants'):
+            # single instance (retrieve / create / update), nothing was batched
+            instance = self.prefetch([instance])[0]
         representation = super().to_representation(instance)
-        representation['categories'] = list(instance.categories.values('id', 'name', 'image'))
-        products = Product.objects.filter(
-            is_active=True,
-            listing__id=instance.id
-        ).order_by('characteristics__label', 'characteristics__value') \
-         .distinct('characteristics__label', 'characteristics__value')
-        products = ProductSerializer(instance=products, many=True).data
-        grouped = {}
-
-        for product in products:
-            grouped[product['characteristics']['label']].append(product) \
-                if product['characteristics']['label'] in grouped \
-                else grouped.update({product['characteristics']['label']: [product]})
-
-        representation['variants'] = grouped
+        categories = instance._category_values
+        representation['categories'] = categories if self.context.get('media_names') else categories_representation(categories)
+        products = variants_representation(instance._variants, self.context)
+
+        # variants are already sorted by label, so grouping is a single pass
+        representation['variants'] = {
+            label: list(group)
+            for label, group in itertools.groupby(products, key=lambda product: product['characteristics']['label'])
+        }
         return representation
 
+    @transaction.atomic
     def create(self, validated_data):
         variants = validated_data.pop('variants', {})
         products = map(lambda tuple: tuple[1], variants.items())
         products = functools.reduce(lambda acc, curr: acc + curr, products, [])
         instance = super().create(validated_data)
-        products = self.generate_products(products)
-        instance.products.add(*map(lambda p: p.instance, products))
+        self.generate_products(products, instance)
         return instance
 
 
+class ListingCardListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        iterable = data.all() if hasattr(data, 'all') else data
+        return super().to_representation(ensure_cards(iterable))
+
+
+class ListingCardSerializer(serializers.BaseSerializer):
+    """
+        Read only, returns the precomputed ListingCard of the listing, its
+        images resolved to urls (see cards.card_representation).
+    """
+    class Meta:
+        list_serializer_class = ListingCardListSerializer
+
+    def to_representation(self, instance):
+        return card_representation(ensure_cards([instance])[0].card.data)
+
+
 class CouponSerializer(serializers.ModelSerializer):
     applied_to = ListingSerializer(many=True, read_only=True)  # FIXME(adina): primary key field ?
 
@@ -0,0 +1,158 @@
+# Keeps the derived catalog data in sync with writes on the listing models
+
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .cache import invalidate_catalog
+from .cards import schedule_refresh
+from .deletion import queue_storage_deletion
+from .models import Category, ImageModel, Listing, Manufacturer, Product
+
+
+def listings_of_categories(category_ids):
+    return Listing.categories.through.objects.filter(category_id__in=category_ids).values_list('listing_id', flat=True)
+
+
+def listings_of_manufacturers(manufacturer_ids):
+    return Listing.objects.filter(manufacturer_id__in=manufacturer_ids).values_list('id', flat=True)
+
+
+def manufacturers_of_images(image_ids):
+    return Manufacturer.pictures.through.objects.filter(imagemodel_id__in=image_ids).values_list('manufacturer_id', flat=True)
+
+
+def listings_changed(listing_ids):
+    """
+        Something a listing is built from changed: refresh its card and touch
+        its updated_at (used for the ETag).
+    """
+    listing_ids = {listing_id for listing_id in listing_ids if listing_id is not None}
+    if listing_ids:
+        Listing.objects.filter(id__in=listing_ids).update(updated_at=timezone.now())
+        schedule_refresh(listing_ids)
+
+
+def listings_bulk_changed(listing_ids):
+    """
+        For writes that bypass the model signals (bulk_create, update()).
+    """
+    listings_changed(listing_ids)
+    invalidate_catalog()
+
+
+def manufacturers_changed(manufacturer_ids):
+    Manufacturer.objects.filter(id__in=manufacturer_ids).update(updated_at=timezone.now())
+
+
+def listings_of_images(image_ids):
+    return (
+        Listing.objects
+        .filter(Q(products__images__in=image_ids) | Q(manufacturer__pictures__in=image_ids))
+        .values_list('id', flat=True)
+        .distinct()
+    )
+
+
+@receiver(post_save, sender=Listing)
+def listing_saved(sender, instance, **kwargs):
+    schedule_refresh([instance.id])
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def product_changed(sender, instance, **kwargs):
+    listings_changed([instance.listing_id])
+
+
+@receiver(m2m_changed, sender=Listing.categories.through)
+def listing_categories_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        listings_changed([instance.id])
+    elif pk_set:
+        listings_changed(pk_set)
+    else:
+        # category.listing_set.clear()
+        listings_changed(listings_of_categories([instance.id]))
+
+
+@receiver(m2m_changed, sender=Product.images.through)
+def product_images_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        listings_changed([instance.listing_id])
+    else:
+        listings_changed(listings_of_images([instance.id]))
+
+
+@receiver(m2m_changed, sender=Manufacturer.pictures.through)
+def manufacturer_pictures_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        manufacturers_changed([instance.id])
+        listings_changed(listings_of_manufacturers([instance.id]))
+    else:
+        manufacturers_changed(pk_set or manufacturers_of_images([instance.id]))
+        listings_changed(listings_of_images([instance.id]))
+
+
+@receiver(post_save, sender=Category)
+def category_saved(sender, instance, **kwargs):
+    listings_changed(listings_of_categories([instance.id]))
+
+
+@receiver(pre_delete, sender=Category)
+def category_deleted(sender, instance, **kwargs):
+    # the M2M rows are gone by post_delete
+    listings_changed(list(listings_of_categories([instance.id])))
+
+
+@receiver(post_save, sender=Manufacturer)
+def manufacturer_saved(sender, instance, **kwargs):
+    listings_changed(listings_of_manufacturers([instance.id]))
+
+
+@receiver(post_save, sender=ImageModel)
+def image_saved(sender, instance, **kwargs):
+    from .derivatives import schedule_derivatives
+    from .ingestion import queue_remote_images
+
+    manufacturers_changed(manufacturers_of_images([instance.id]))
+    listings_changed(listings_of_images([instance.id]))
+    if instance.derivatives is None:
+        schedule_derivatives([instance.id])
+    queue_remote_images([instance])
+
+
+@receiver(pre_delete, sender=ImageModel)
+def image_deleted(sender, instance, **kwargs):
+    manufacturers_changed(list(manufacturers_of_images([instance.id])))
+    listings_changed(list(listings_of_images([instance.id])))
+
+
+@receiver(post_delete, sender=ImageModel)
+def image_removed(sender, instance, **kwargs):
+    queue_storage_deletion([instance])
+
+
+@receiver(post_save, sender=Listing)
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Manufacturer)
+@receiver(post_save, sender=ImageModel)
+@receiver(post_delete, sender=Listing)
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Manufacturer)
+@receiver(post_delete, sender=ImageModel)
+@receiver(m2m_changed, sender=Listing.categories.through)
+@receiver(m2m_changed, sender=Product.images.through)
+@receiver(m2m_changed, sender=Manufacturer.pictures.through)
+def catalog_changed(sender, **kwargs):
+    if kwargs.get('action', 'post_').startswith('post_'):
+        invalidate_catalog()
@@ -2,9 +2,21 @@
 # from .manufacturer import *
 # from .listing_groupby import *
 # from .listing_create import *
-# from .listing_delete import *
+from .listing_delete import *
 # from .listing_update import *
 from .listing_filters import *
+from .listing_list import *
+from .listing_card import *
+from .category_tree import *
+from .inventory import *
+from .catalog_import import *
+from .image_upload import *
+from .presigned_upload import *
+from .image_derivatives import *
+from .media_urls import *
+from .storage_deletion import *
+from .media_gc import *
+from .remote_images import *
 # from .coupon import *
 
 '''
@@ -0,0 +1,86 @@
+import csv
+import io
+import json
+import tempfile
+from pathlib import Path
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from apps.listings.models import Category, Listing, Manufacturer, Product
+
+CSV_COLUMNS = [
+    'name', 'description', 'price €', 'weight g', 'is food', 'how to conserve it', 'commerçants',
+    'manufacturer', 'category', 'sous catégorie', 'Variable', 'Variable 2', 'Variable 3',
+]
+
+
+class CatalogImportTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write(self, name, content):
+        path = Path(self.directory.name) / name
+        path.write_text(content, encoding='utf8')
+        return str(path)
+
+    def import_catalog(self, path, **options):
+        call_command('import_catalog', path, stdout=io.StringIO(), **options)
+
+    def test_csv(self):
+        rows = io.StringIO()
+        writer = csv.DictWriter(rows, CSV_COLUMNS)
+        writer.writeheader()
+        writer.writerow({
+            'name': 'T-shirt ', 'price €': '25,5', 'weight g': '200', 'is food': 'FAUX', 'commerçants': 'Aladin',
+            'manufacturer': '972', 'category': 'Textile', 'sous catégorie': 'T-shirts',
+            'Variable': 'Couleur: Blanc, Noir', 'Variable 2': 'Champ: Prénom', 'Variable 3': '',
+        })
+        writer.writerow({'name': 'Dattes', 'price €': '23', 'is food': 'VRAI', 'category': 'Alimentation'})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.import_catalog(self.write('catalog.csv', rows.getvalue()))
+
+        shirt = Listing.objects.get(name='T-shirt')
+        self.assertEqual(shirt.price, 25.5)
+        self.assertEqual((shirt.manufacturer.name, shirt.manufacturer.phone_number), ('Aladin', '+972'))
+        self.assertEqual(shirt.categories.get().parent.name, 'Textile')
+        self.assertEqual(
+            sorted(
+                (product.characteristics['label'], product.characteristics['value'], product.is_customized)
+                for product in shirt.products.all()
+            ),
+            [('Champ: ', '', True), ('Couleur: ', 'Blanc', False), ('Couleur: ', 'Noir', False)],
+        )
+        dates = Listing.objects.get(name='Dattes')
+        self.assertEqual(dates.type, Listing.ProductType.FOOD)
+        self.assertEqual(dates.manufacturer.name, 'Unknown')
+        self.assertEqual(dates.products.get().characteristics['label'], 'Ajoutez un commentaire')
+        self.assertEqual(dates.card.data['name'], 'Dattes')
+
+    def test_ndjson_resumes_after_a_failure(self):
+        records = [
+            {'name': f'Listing {i}', 'price': i, 'manufacturer': 'Maker', 'categories': [['Bijoux', 'Colliers']],
+             'options': [{'label': 'Taille', 'value': 'M', 'stock': 3}]}
+            for i in range(5)
+        ]
+        records[3]['price'] = 'not a price'
+        path = self.write('catalog.ndjson', '\n'.join(map(json.dumps, records)))
+
+        with self.assertRaises(CommandError):
+            self.import_catalog(path, chunk_size=2)
+        self.assertEqual(Listing.objects.count(), 2)
+        self.assertEqual(Path(f'{path}.progress').read_text(), '2')
+
+        records[3]['price'] = 3
+        Path(path).write_text('\n'.join(map(json.dumps, records)), encoding='utf8')
+        self.import_catalog(path, chunk_size=2)
+        self.assertEqual(sorted(Listing.objects.values_list('name', flat=True)), [f'Listing {i}' for i in range(5)])
+        self.assertEqual(Manufacturer.objects.filter(name='Maker').count(), 1)
+        self.assertEqual(Category.objects.count(), 2)
+        self.assertEqual(Product.objects.get(listing__name='Listing 4').quantity, 3)
+
+        # nothing left to import
+        self.import_catalog(path)
+        self.assertEqual(Listing.objects.count(), 5)
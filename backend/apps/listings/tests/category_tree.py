@@ -0,0 +1,54 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+
+from apps.listings.models import Category, Listing
+from apps.listings.tests.utils import BaseTestCase
+
+
+class CategoryTreeTests(BaseTestCase):
+    url = '/listings/category/tree/'
+
+    def setUp(self):
+        super().setUp()
+        self.category3 = Category.objects.create(name='Category 3', parent=self.category2)
+        self.other = Category.objects.create(name='Other')
+
+    def test_paths(self):
+        self.category1.refresh_from_db()
+        self.assertEqual(self.category1.path, f'{self.category1.id}/')
+        self.assertEqual(self.category3.path, f'{self.category1.id}/{self.category2.id}/{self.category3.id}/')
+        self.assertEqual(set(Category.objects.subtree(self.category2)), {self.category2, self.category3})
+
+    def test_moving_a_category_moves_its_descendants(self):
+        self.category2.parent = self.other
+        self.category2.save()
+        self.category3.refresh_from_db()
+        self.assertEqual(self.category3.path, f'{self.other.id}/{self.category2.id}/{self.category3.id}/')
+
+        self.client.force_authenticate(user=self.admin_user)
+        response = self.client.patch(f'/listings/category/{self.category2.id}/', {'parent': self.category3.id}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_tree(self):
+        listing = Listing.objects.create(name='In 3')
+        listing.categories.add(self.category3, self.category1)
+        Listing.objects.create(name='Inactive', is_active=False).categories.add(self.category2)
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(ctx.captured_queries), 1)
+
+        self.assertEqual([node['name'] for node in response.data], ['Category 1', 'Other'])
+        root, other = response.data
+        self.assertEqual(root['listing_count'], 1)
+        self.assertEqual(other['listing_count'], 0)
+        self.assertEqual(other['children'], [])
+        child = root['children'][0]
+        self.assertEqual((child['name'], child['listing_count']), ('Category 2', 1))
+        self.assertEqual([(node['name'], node['listing_count']) for node in child['children']], [('Category 3', 1)])
+
+        # filters apply, orphaned nodes become roots
+        response = self.client.get(self.url, {'parent': self.category1.id}, format='json')
+        self.assertEqual([node['name'] for node in response.data], ['Category 2'])
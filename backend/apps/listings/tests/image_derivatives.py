@@ -0,0 +1,65 @@
+import base64
+from unittest.mock import patch
+
+from botocore.exceptions import EndpointConnectionError
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.test import override_settings
+from PIL import Image
+from rest_framework import status
+
+from apps.listings.derivatives import DERIVATIVE_FORMATS, build_derivatives
+from apps.listings.models import ImageModel
+from apps.listings.tests.image_upload import IN_MEMORY_STORAGES
+from apps.listings.tests.utils import BaseTestCase
+
+
+@override_settings(STORAGES=IN_MEMORY_STORAGES, BACKGROUND_TASKS=False)
+class ImageDerivativesTests(BaseTestCase):
+    def test_derivatives_after_create(self):
+        self.client.force_authenticate(user=self.admin_user)
+        with open(self.absolute_path, 'rb') as image:
+            encoded = base64.b64encode(image.read()).decode()
+        data = {'name': 'Derived', 'price': 10, 'options': [{'label': 'Color', 'value': 'Red', 'images': [{'image': encoded}]}]}
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/listings/product/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        image = ImageModel.objects.get(product__listing_id=response.data['id'])
+        self.assertEqual(set(image.derivatives), {'webp', 'avif'})
+        # the original is 920px wide
+        self.assertEqual(set(image.derivatives['webp']), {'160', '320', '640'})
+        self.assertTrue(all(default_storage.exists(name) for name in image.derivatives['avif'].values()))
+
+        # encoded differently, the derivatives get new names
+        with patch.dict(DERIVATIVE_FORMATS, webp={'quality': 30}):
+            ImageModel.objects.filter(id=image.id).update(derivatives=None)
+            rebuilt, = build_derivatives(ImageModel.objects.filter(id=image.id))
+        self.assertEqual(rebuilt.derivatives['avif'], image.derivatives['avif'])
+        self.assertTrue(set(rebuilt.derivatives['webp'].values()).isdisjoint(image.derivatives['webp'].values()))
+
+        response = self.client.get(f'/listings/card/{response.data["id"]}/', format='json')
+        srcset = response.data['default_image']['srcset']
+        self.assertEqual(len(srcset['webp'].split(', ')), 3)
+        self.assertTrue(srcset['webp'].endswith(' 640w'))
+
+    def test_unreadable_images_are_not_retried(self):
+        image = ImageModel.objects.create(image='products_images/missing.png', derivatives=None)
+        remote = ImageModel.objects.create(image='https://example.com/image.png')
+        build_derivatives(ImageModel.objects.filter(id__in=[image.id, remote.id]))
+        self.assertEqual(list(ImageModel.objects.filter(id__in=[image.id, remote.id]).values_list('derivatives', flat=True)), [{}, {}])
+        self.assertFalse(ImageModel.objects.filter(derivatives__isnull=True, id__in=[image.id, remote.id]).exists())
+
+    def test_bombs_are_not_retried_storage_failures_are(self):
+        with open(self.absolute_path, 'rb') as file:
+            image, = ImageModel.objects.for_images([ContentFile(file.read(), name='hero.png')])
+        with patch.object(Image, 'MAX_IMAGE_PIXELS', 100):
+            build_derivatives(ImageModel.objects.filter(id=image.id))
+        image.refresh_from_db()
+        self.assertEqual(image.derivatives, {})
+
+        ImageModel.objects.filter(id=image.id).update(derivatives=None)
+        with patch.object(default_storage, 'save', side_effect=EndpointConnectionError(endpoint_url='https://r2')):
+            build_derivatives(ImageModel.objects.filter(id=image.id))
+        image.refresh_from_db()
+        self.assertIsNone(image.derivatives)
@@ -0,0 +1,126 @@
+import hashlib
+import io
+import json
+import threading
+
+from django.core.files.storage import InMemoryStorage, default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
+from PIL import Image
+from rest_framework import status
+
+from apps.listings.models import Category, ImageModel, Listing, Product
+from apps.listings.tests.utils import BaseTestCase
+
+
+class LockedInMemoryStorage(InMemoryStorage):
+    """
+        InMemoryStorage creates its directories unsafely, saves are serialized
+        since images are uploaded from several threads (uploads.store_files).
+    """
+    lock = threading.Lock()
+
+    def _save(self, name, content):
+        with self.lock:
+            return super()._save(name, content)
+
+
+class ThreadRecordingStorage(LockedInMemoryStorage):
+    threads = set()
+
+    def _save(self, name, content):
+        self.threads.add(threading.current_thread().name)
+        return super()._save(name, content)
+
+
+IN_MEMORY_STORAGES = {
+    'default': {'BACKEND': 'apps.listings.tests.image_upload.LockedInMemoryStorage'},
+    'staticfiles': {'BACKEND': 'django.core.files.storage.InMemoryStorage'},
+}
+
+
+@override_settings(STORAGES=IN_MEMORY_STORAGES)
+class ImageUploadTests(BaseTestCase):
+    def image(self):
+        return open(self.absolute_path, 'rb')
+
+    def other_image(self, color='red'):
+        buffer = io.BytesIO()
+        Image.new('RGB', (40, 30), color).save(buffer, format='PNG')
+        return SimpleUploadedFile(f'{color}.png', buffer.getvalue(), content_type='image/png')
+
+    def test_category_image_upload(self):
+        self.client.force_authenticate(user=self.admin_user)
+        with self.image() as image:
+            response = self.client.post('/listings/category/', {'name': 'Uploaded', 'image': image}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        category = Category.objects.get(id=response.data['id'])
+        self.assertTrue(category.image.name.endswith('.png'))
+        with open(self.absolute_path, 'rb') as image, default_storage.open(category.image.name) as stored:
+            self.assertEqual(stored.read(), image.read())
+
+    def test_listing_images_reference_file_parts(self):
+        self.client.force_authenticate(user=self.admin_user)
+        document = {'name': 'Uploaded', 'price': 10, 'options': [
+            {'label': 'Color', 'value': 'Red', 'images': [{'image': 'upload:front'}, {'image': 'upload:back'}]},
+            {'label': 'Color', 'value': 'Blue'},
+        ]}
+        with self.image() as front:
+            response = self.client.post(
+                '/listings/product/', {'data': json.dumps(document), 'front': front, 'back': self.other_image()}, format='multipart'
+            )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        red = Listing.objects.get(id=response.data['id']).products.get(characteristics__value='Red')
+        names = [image.image.name for image in red.images.all()]
+        self.assertEqual(len(names), 2)
+        self.assertTrue(all(name.endswith('.png') and default_storage.exists(name) for name in names))
+
+    def test_missing_file_part(self):
+        self.client.force_authenticate(user=self.admin_user)
+        document = {'name': 'Uploaded', 'options': [{'label': 'Color', 'value': 'Red', 'images': [{'image': 'upload:front'}]}]}
+        response = self.client.post('/listings/product/', {'data': json.dumps(document)}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Listing.objects.filter(name='Uploaded').exists())
+
+    def test_same_content_is_stored_once(self):
+        self.client.force_authenticate(user=self.admin_user)
+        with self.image() as image:
+            digest = hashlib.sha256(image.read()).hexdigest()
+        document = {'name': 'Uploaded', 'options': [
+            {'label': 'Color', 'value': 'Red', 'images': [{'image': 'upload:front'}, {'image': 'upload:back'}]},
+            {'label': 'Color', 'value': 'Blue', 'images': [{'image': 'upload:front'}]},
+        ]}
+        for _ in range(2):
+            with self.image() as front, self.image() as back:
+                response = self.client.post(
+                    '/listings/product/', {'data': json.dumps(document), 'front': front, 'back': back}, format='multipart'
+                )
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        image = ImageModel.objects.get(content_hash=digest)
+        self.assertEqual(image.image.name, f'products_images/{digest}.png')
+        self.assertEqual(Product.objects.filter(images=image).count(), 4)
+        self.assertEqual(ImageModel.objects.filter(image__startswith='products_images/').count(), 1)
+
+    @override_settings(STORAGES={**IN_MEMORY_STORAGES, 'default': {
+        'BACKEND': 'apps.listings.tests.image_upload.ThreadRecordingStorage',
+    }})
+    def test_images_of_a_request_are_uploaded_in_parallel(self):
+        self.client.force_authenticate(user=self.admin_user)
+        colors = ['red', 'green', 'blue', 'white', 'black']
+        document = {'name': 'Uploaded', 'options': [
+            {'label': 'Color', 'value': 'Red', 'images': [{'image': f'upload:{color}'} for color in colors]},
+        ]}
+        ThreadRecordingStorage.threads.clear()
+        response = self.client.post(
+            '/listings/product/',
+            {'data': json.dumps(document), **{color: self.other_image(color) for color in colors}},
+            format='multipart',
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        product = Listing.objects.get(id=response.data['id']).products.get()
+        names = [image.image.name for image in product.images.all()]
+        self.assertEqual(len(names), len(colors))
+        self.assertTrue(all(default_storage.exists(name) for name in names))
+        self.assertTrue(ThreadRecordingStorage.threads)
+        self.assertTrue(all(name.startswith('image-upload') for name in ThreadRecordingStorage.threads))
@@ -0,0 +1,51 @@
+from django.db import IntegrityError, transaction
+
+from apps.listings import inventory
+from apps.listings.models import Listing, Product
+from apps.listings.tests.utils import BaseTestCase
+
+
+class InventoryTests(BaseTestCase):
+    url = "/listings/product/"
+
+    def setUp(self):
+        super().setUp()
+        response = self.create_legit_listing()
+        self.listing = Listing.objects.get(id=response.data['id'])
+        # Color Blue, stock 3
+        self.product = self.listing.products.get(characteristics__value='Blue')
+
+    def test_options_stock_is_a_quantity(self):
+        self.assertEqual(self.listing.products.count(), 4)
+        self.assertEqual(self.product.quantity, 3)
+        self.assertEqual(self.listing.stock, 10)
+        response = self.client.get(f'{self.url}{self.listing.id}/', {'group_by': 'characteristics__label'}, format='json')
+        stock = {variant['characteristics']['value']: variant['stock'] for variant in response.data['variants']['Color']}
+        self.assertEqual(stock, {'Red': 2, 'Blue': 3})
+
+    def test_reserve_release_sell(self):
+        self.assertTrue(inventory.reserve(self.product, 2))
+        self.assertEqual(self.product.available, 1)
+        self.assertFalse(inventory.reserve(self.product, 2))
+        self.assertTrue(inventory.sell(self.product, 1))
+        self.assertTrue(inventory.release(self.product, 1))
+        self.assertFalse(inventory.release(self.product, 1))
+        self.assertTrue(inventory.sell(self.product, 2, reserved=False))
+        self.assertFalse(inventory.sell(self.product, 1, reserved=False))
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.quantity, self.product.reserved, self.product.sold), (3, 0, 3))
+        self.assertEqual(Listing.objects.with_stock().get(id=self.listing.id).stock_count, 7)
+
+        self.assertTrue(inventory.restock(self.product, 5))
+        self.assertEqual(self.listing.stock, 12)
+        with self.assertRaises(ValueError):
+            inventory.reserve(self.product, 0)
+
+    def test_counters_never_exceed_quantity(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Product.objects.filter(pk=self.product.pk).update(sold=4)
+
+    def test_sold_sku_is_deactivated_on_delete(self):
+        inventory.sell(self.product, 1, reserved=False)
+        self.product.delete()
+        self.assertFalse(Product.objects.get(pk=self.product.pk).is_active)
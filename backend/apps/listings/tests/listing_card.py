@@ -0,0 +1,67 @@
+from django.core.management import call_command
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+
+from apps.listings.models import ImageModel, Listing, ListingCard
+from apps.listings.tests.presigned_upload import S3_SETTINGS
+from apps.listings.tests.utils import BaseTestCase
+
+class ListingCardTests(BaseTestCase):
+    url = "/listings/card/"
+
+    def create_listing(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.create_legit_listing()
+        return Listing.objects.get(id=response.data['id'])
+
+    def test_card_is_built_on_create(self):
+        listing = self.create_listing()
+        card = ListingCard.objects.get(listing=listing)
+        self.assertEqual(card.data['stock'], 10)
+        self.assertEqual(set(card.data['variants']), {'Color', 'Size'})
+
+    def test_card_is_refreshed_on_writes(self):
+        listing = self.create_listing()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category1.name = 'Renamed'
+            self.category1.save()
+        self.assertEqual(ListingCard.objects.get(listing=listing).data['categories'][0]['name'], 'Renamed')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            # the Red SKU holds 2 units
+            listing.products.filter(characteristics__value='Red').first().delete()
+        self.assertEqual(ListingCard.objects.get(listing=listing).data['stock'], 8)
+
+    def test_card_page_is_a_single_select(self):
+        for _ in range(3):
+            self.create_listing()
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url, {'pagination': 'cursor'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 3)
+        self.assertEqual(len(ctx.captured_queries), 1)
+
+    def test_rebuild_cards(self):
+        listing = self.create_listing()
+        ListingCard.objects.all().delete()
+        call_command('rebuild_cards', stdout=open('/dev/null', 'w'))
+        self.assertEqual(ListingCard.objects.get(listing=listing).data['id'], listing.id)
+
+    @override_settings(**S3_SETTINGS)
+    def test_cards_store_image_names(self):
+        listing = self.create_listing()
+        image = ImageModel.objects.create(image='products_images/red.png', derivatives={'webp': {'160': 'products_images/red-160w.webp'}})
+        with self.captureOnCommitCallbacks(execute=True):
+            listing.products.get(characteristics__value='Red').images.add(image)
+        red, = [variant for variant in ListingCard.objects.get(listing=listing).data['variants']['Color'] if variant['characteristics']['value'] == 'Red']
+        self.assertEqual(red['images'][0]['image'], 'products_images/red.png')
+
+        # urls are built when the card is served
+        with self.settings(MEDIA_PUBLIC_URL='https://cdn.example.com/'):
+            response = self.client.get(f'{self.url}{listing.id}/', format='json')
+        red, = [variant for variant in response.data['variants']['Color'] if variant['characteristics']['value'] == 'Red']
+        self.assertEqual(red['images'][0]['image'], 'https://cdn.example.com/products_images/red.png')
+        self.assertEqual(red['images'][0]['srcset'], {'webp': 'https://cdn.example.com/products_images/red-160w.webp 160w'})
+        self.assertEqual(response.data['default_image']['image'], 'https://cdn.example.com/products_images/red.png')
@@ -1,7 +1,11 @@
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
-from apps.listings.models import Listing, Manufacturer
+from apps.listings.models import ImageModel, Listing, Manufacturer, Product
 
+from apps.listings.tests.image_upload import IN_MEMORY_STORAGES
 from apps.listings.tests.utils import BaseTestCase
 
 class ListingDeleteTests(BaseTestCase):
@@ -14,7 +18,9 @@ class ListingDeleteTests(BaseTestCase):
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
         self.assertEqual(Listing.objects.count(), 1)
         self.assertFalse(Listing.objects.filter(id=listing_id).first().is_active)
-        self.assertEqual(Listing.objects.filter(id=listing_id).first().products.count(), 0)
+        # retired, not deleted
+        self.assertEqual(Listing.objects.filter(id=listing_id).first().products.count(), 4)
+        self.assertFalse(Listing.objects.filter(id=listing_id).first().products.filter(is_active=True).exists())
 
 
     def test_delete_sold_products_in_listings(self):
@@ -26,6 +32,56 @@ class ListingDeleteTests(BaseTestCase):
         self.assertEqual(Listing.objects.count(), 1)
         self.assertFalse(Listing.objects.filter(id=listing_id).first().is_active)
         # since they have been sold, they are now archived
-        self.assertEqual(Listing.objects.filter(id=listing_id).first().products.count(), 5)
+        self.assertEqual(Listing.objects.filter(id=listing_id).first().products.count(), 2)
         self.assertFalse(any([product.is_active for product in Listing.objects.filter(id=listing_id).first().products.all()]))
 
+    def test_bulk_delete(self):
+        listing_ids = [self.create_legit_listing().data['id'] for _ in range(3)]
+        other = Manufacturer.objects.create(name='Other')
+        kept = Listing.objects.create(name='Kept', manufacturer=other)
+
+        response = self.client.delete(f'{self.url}/?ids={listing_ids[0]},{listing_ids[1]}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['deleted'], 2)
+        self.assertEqual(Listing.objects.filter(is_active=True).count(), 2)
+        self.assertEqual(Product.objects.filter(listing_id__in=listing_ids[:2], is_active=True).count(), 0)
+
+        # a whole manufacturer's range
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.delete(f'{self.url}/?manufacturer_id={self.manufacturer.id}')
+        self.assertEqual(response.data['deleted'], 1)
+        self.assertLess(len(ctx.captured_queries), 15)
+        self.assertEqual(list(Listing.objects.filter(is_active=True)), [kept])
+
+        response = self.client.delete(f'{self.url}/')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.delete(f'{self.url}/?ids=a,b')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.client.force_authenticate(self.client_user)
+        response = self.client.delete(f'{self.url}/?ids={kept.id}')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    @override_settings(STORAGES=IN_MEMORY_STORAGES)
+    def test_unused_images_are_cleaned_up_on_commit(self):
+        listing = Listing.objects.get(id=self.create_legit_listing().data['id'])
+        shared, own = ImageModel.objects.create(image='shared.png'), ImageModel.objects.create(image='own.png')
+        listing.products.first().images.add(shared, own)
+        Product.objects.create(is_active=True).images.add(shared)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            listing.delete()
+        self.assertTrue(ImageModel.objects.filter(id=shared.id).exists())
+        self.assertFalse(ImageModel.objects.filter(id=own.id).exists())
+
+    @override_settings(STORAGES=IN_MEMORY_STORAGES)
+    def test_sold_product_keeps_the_manufacturer_pictures(self):
+        product = Product.objects.create(is_sold=True)
+        picture, own = ImageModel.objects.create(image='picture.png'), ImageModel.objects.create(image='own.png')
+        product.images.add(picture, own)
+        self.manufacturer.pictures.add(picture)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product.delete()
+        self.assertFalse(Product.objects.get(id=product.id).is_active)
+        self.assertEqual(list(self.manufacturer.pictures.all()), [picture])
+        self.assertFalse(ImageModel.objects.filter(id=own.id).exists())
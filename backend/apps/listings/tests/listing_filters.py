@@ -1,5 +1,8 @@
 from rest_framework import status
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from apps.listings.models import Listing
 
 from apps.listings.tests.utils import BaseTestCase
 
@@ -74,4 +77,138 @@ class ListingFilteringTests(BaseTestCase):
     def test_filter_by_invalid_name(self):
         filters = {'name': {'invalid': 'data'}}  # Invalid data type for name
         response = self.client.get(self.url, filters, format='json')
-        self.assertEqual(response.data['count'], 0)
\ No newline at end of file
+        self.assertEqual(response.data['count'], 0)
+
+    def test_filter_by_price_range(self):
+        self.create_legit_listing()
+        response = self.client.get(self.url, {'price_min': 5, 'price_max': 15}, format='json')
+        self.assertEqual(response.data['count'], 1)
+        response = self.client.get(self.url, {'price_min': 11}, format='json')
+        self.assertEqual(response.data['count'], 0)
+
+    def test_filter_by_category_id_or_slug(self):
+        self.create_legit_listing()
+        response = self.client.get(self.url, {'category': self.category1.id}, format='json')
+        self.assertEqual(response.data['count'], 1)
+        response = self.client.get(self.url, {'category': self.category1.slug}, format='json')
+        self.assertEqual(response.data['count'], 1)
+        response = self.client.get(self.url, {'category': self.category2.slug}, format='json')
+        self.assertEqual(response.data['count'], 0)
+
+    def test_filter_by_category_name_does_not_duplicate(self):
+        listing_id = self.create_legit_listing().data['id']
+        Listing.objects.get(id=listing_id).categories.add(self.category2)
+        response = self.client.get(self.url, {'category_name': 'Category'}, format='json')
+        self.assertEqual(response.data['count'], 1)
+
+    def test_filter_by_manufacturer_id_and_type(self):
+        self.create_legit_listing()
+        response = self.client.get(self.url, {'manufacturer_id': self.manufacturer.id, 'type': 0}, format='json')
+        self.assertEqual(response.data['count'], 1)
+        response = self.client.get(self.url, {'manufacturer_id': self.manufacturer.id, 'type': 1}, format='json')
+        self.assertEqual(response.data['count'], 0)
+
+    def test_ordering(self):
+        self.create_legit_listing()
+        Listing.objects.create(name="Cheap Listing", price=1.0)
+        response = self.client.get(self.url, {'ordering': '-price'}, format='json')
+        self.assertEqual([listing['price'] for listing in response.data['results']], [10.0, 1.0])
+        response = self.client.get(self.url, {'ordering': 'price'}, format='json')
+        self.assertEqual([listing['price'] for listing in response.data['results']], [1.0, 10.0])
+
+    def test_no_filter_returns_nothing_without_counting(self):
+        self.create_legit_listing()
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url, format='json')
+        self.assertEqual(response.data['count'], 0)
+        self.assertFalse(any('COUNT(' in query['sql'] for query in ctx.captured_queries))
+
+    def test_detail_does_not_need_filters(self):
+        listing_id = self.create_legit_listing().data['id']
+        response = self.client.get(f'{self.url}{listing_id}/', format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_search(self):
+        self.create_legit_listing()
+        Listing.objects.create(name="Tote bag blanc", description="Sac en coton imprimé", lang='fra')
+        Listing.objects.create(name="Dattes medjoul", description="Dates from Jericho", lang='eng')
+
+        response = self.client.get(self.url, {'search': 'cotons'}, format='json')
+        self.assertEqual([listing['name'] for listing in response.data['results']], ["Tote bag blanc"])
+
+        # english stemming on the description
+        response = self.client.get(self.url, {'search': 'date'}, format='json')
+        self.assertEqual([listing['name'] for listing in response.data['results']], ["Dattes medjoul"])
+
+        # typo tolerance on the name
+        response = self.client.get(self.url, {'search': 'medjol'}, format='json')
+        self.assertEqual([listing['name'] for listing in response.data['results']], ["Dattes medjoul"])
+
+        # combines with the other filters
+        response = self.client.get(self.url, {'search': 'medjoul', 'price_min': 1}, format='json')
+        self.assertEqual(response.data['count'], 0)
+
+    def test_in_stock_and_stock_ordering(self):
+        listing = Listing.objects.get(id=self.create_legit_listing().data['id'])
+        sold_out = Listing.objects.create(name="Sold out", price=10.0)
+        sold_out.products.add(self.sold_product, self.product2)
+
+        self.assertEqual(listing.stock, 10)
+        self.assertEqual(sold_out.stock, 0)
+        self.assertEqual(Listing.objects.with_stock().get(id=listing.id).stock, 10)
+
+        response = self.client.get(self.url, {'in_stock': 'true'}, format='json')
+        self.assertEqual([result['id'] for result in response.data['results']], [listing.id])
+        response = self.client.get(self.url, {'in_stock': 'false'}, format='json')
+        self.assertEqual([result['id'] for result in response.data['results']], [sold_out.id])
+
+        response = self.client.get(self.url, {'ordering': '-stock'}, format='json')
+        self.assertEqual([result['id'] for result in response.data['results']], [listing.id, sold_out.id])
+
+        self.assertNotIn('stock', response.data['results'][0]['products'][0])
+        response = self.client.get(self.url, {'ordering': '-stock', 'variant_stock': 'true'}, format='json')
+        stock = {product['characteristics']['value']: product['stock'] for product in response.data['results'][0]['products']}
+        self.assertEqual(stock, {'Red': 2, 'Blue': 3, 'Small': 1, 'Large': 4})
+
+    def test_filter_by_category_tree(self):
+        listing_id = self.create_legit_listing().data['id']
+        Listing.objects.get(id=listing_id).categories.set([self.category2])
+        for value in (self.category1.id, self.category1.slug, self.category2.id):
+            response = self.client.get(self.url, {'category_tree': value}, format='json')
+            self.assertEqual(response.data['count'], 1)
+        response = self.client.get(self.url, {'category_tree': 'unknown'}, format='json')
+        self.assertEqual(response.data['count'], 0)
+        response = self.client.get(self.url, {'category': self.category1.id}, format='json')
+        self.assertEqual(response.data['count'], 0)
+
+    def test_facets(self):
+        listing = Listing.objects.get(id=self.create_legit_listing().data['id'])
+        listing.categories.add(self.category2)
+        other = Listing.objects.create(name='Test Other', price=30, lang='eng')
+        other.categories.add(self.category2)
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url, {'name': 'Test', 'facets': 1, 'page_size': 1}, format='json')
+        self.assertEqual(len(response.data['results']), 1)
+        facets = response.data['facets']
+        self.assertEqual(facets['category'], [
+            {'id': self.category2.id, 'name': 'Category 2', 'count': 2},
+            {'id': self.category1.id, 'name': 'Category 1', 'count': 1},
+        ])
+        self.assertEqual(facets['manufacturer'], [{'id': self.manufacturer.id, 'name': 'Sample Manufacturer', 'count': 1}])
+        self.assertEqual(facets['price'], [{'min': 10, 'max': 25, 'count': 1}, {'min': 25, 'max': 50, 'count': 1}])
+        self.assertEqual({(value['value'], value['count']) for value in facets['lang']}, {('fra', 1), ('eng', 1)})
+        self.assertIn({'label': 'Size', 'value': 'Large', 'count': 1}, facets['characteristics'])
+        self.assertEqual(len(facets['characteristics']), 4)
+
+        # the next page reuses the cached facets
+        with CaptureQueriesContext(connection) as next_page:
+            response = self.client.get(self.url, {'name': 'Test', 'facets': 1, 'page_size': 1, 'page': 2}, format='json')
+        self.assertEqual(response.data['facets'], facets)
+        self.assertEqual(sum('GROUPING SETS' in query['sql'] for query in ctx.captured_queries), 1)
+        self.assertFalse(any('GROUPING SETS' in query['sql'] for query in next_page.captured_queries))
+
+        response = self.client.get(self.url, {'name': 'Test', 'facets': 'price,unknown'}, format='json')
+        self.assertEqual(list(response.data['facets']), ['price'])
+        response = self.client.get(self.url, {'name': 'Test', 'facets': 'price', 'price_min': 25}, format='json')
+        self.assertEqual(response.data['facets']['price'], [{'min': 25, 'max': 50, 'count': 1}])
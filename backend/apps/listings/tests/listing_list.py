@@ -0,0 +1,217 @@
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+from apps.listings import inventory
+from apps.listings.models import ImageModel, Listing, Product
+
+from apps.listings.tests.image_upload import IN_MEMORY_STORAGES
+from apps.listings.tests.utils import BaseTestCase
+
+class ListingListTests(BaseTestCase):
+    url = "/listings/product/"
+
+    def count_queries(self, params):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url, params, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response, len(ctx.captured_queries)
+
+    def test_list_representation(self):
+        self.create_legit_listing()
+        response = self.client.get(self.url, {'name': 'Test'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        listing = response.data['results'][0]
+        self.assertEqual(len(listing['products']), 4)
+        expected = Listing.objects.get(id=listing['id']).categories.values('id', 'name', 'image')
+        self.assertEqual(listing['categories'], list(expected))
+
+        # a single listing is represented the same way as in a page
+        detail = self.client.get(f'{self.url}{listing["id"]}/', {'name': 'Test'}, format='json')
+        self.assertEqual(detail.data['products'], listing['products'])
+        self.assertEqual(detail.data['categories'], listing['categories'])
+
+    def test_list_query_count_does_not_grow_with_page_size(self):
+        self.create_legit_listing()
+        _, one_listing = self.count_queries({'name': 'Test', 'page_size': 50})
+        for _ in range(5):
+            self.create_legit_listing()
+        response, six_listings = self.count_queries({'name': 'Test', 'page_size': 50})
+        self.assertEqual(len(response.data['results']), 6)
+        self.assertEqual(one_listing, six_listings)
+
+    def test_grouped_query_count_does_not_grow_with_page_size(self):
+        params = {'group_by': 'characteristics__label', 'page_size': 50}
+        listing = Listing.objects.get(id=self.create_legit_listing().data['id'])
+        listing.products.add(self.product1)
+        response, one_listing = self.count_queries(params)
+        self.assertEqual(set(response.data['results'][0]['variants']), {'Color', 'Size', 'color'})
+        self.assertEqual(response.data['results'][0]['manufacturer']['id'], self.manufacturer.id)
+        self.assertEqual(response.data['results'][0]['default_image']['id'], listing.default_image.id)
+        for _ in range(5):
+            self.create_legit_listing()
+        response, six_listings = self.count_queries(params)
+        self.assertEqual(len(response.data['results']), 6)
+        self.assertEqual(one_listing, six_listings)
+
+    def test_cursor_pagination(self):
+        for name in ['b', 'a', 'c', 'a', 'a', 'a', 'd']:
+            Listing.objects.create(name=name)
+        expected = list(Listing.objects.order_by('name', 'id').values_list('id', flat=True))
+        response = self.client.get(self.url, {'pagination': 'cursor', 'page_size': 2}, format='json')
+        self.assertNotIn('count', response.data)
+        self.assertIsNone(response.data['previous'])
+        pages = [[listing['id'] for listing in response.data['results']]]
+        while response.data['next']:
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(response.data['next'], format='json')
+            # the position among equal names is in the cursor, not an offset
+            self.assertFalse(any('COUNT(' in query['sql'] or 'OFFSET' in query['sql'] for query in ctx.captured_queries))
+            pages.append([listing['id'] for listing in response.data['results']])
+        self.assertEqual(sum(pages, []), expected)
+
+        # and back
+        while response.data['previous']:
+            response = self.client.get(response.data['previous'], format='json')
+            self.assertEqual([listing['id'] for listing in response.data['results']], pages[-2])
+            pages.pop()
+        self.assertEqual(len(pages), 1)
+
+        response = self.client.get(self.url, {'pagination': 'cursor', 'ordering': '-price'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(self.url, {'cursor': 'not a cursor'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        # page number clients keep working
+        response = self.client.get(self.url, {'page': 3, 'page_size': 2}, format='json')
+        self.assertEqual(response.data['count'], 7)
+        self.assertEqual([listing['name'] for listing in response.data['results']], ['b', 'c'])
+
+    def test_anonymous_responses_are_cached_until_a_write(self):
+        self.create_legit_listing()
+        self.client.force_authenticate(user=None)
+        params = {'name': 'Test'}
+
+        response = self.client.get(self.url, params, format='json')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url, params, format='json')
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(len(ctx.captured_queries), 0)
+        self.assertEqual(response.data['count'], 1)
+
+        Listing.objects.create(name="Test Listing 2")
+        response = self.client.get(self.url, params, format='json')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['count'], 2)
+
+        # authenticated users are never served from the cache
+        self.client.force_authenticate(user=self.admin_user)
+        response = self.client.get(self.url, params, format='json')
+        self.assertNotIn('X-Cache', response)
+
+    @override_settings(MEDIA_PUBLIC_URL='https://media.example.com/')
+    def test_conditional_get(self):
+        listing = Listing.objects.get(id=self.create_legit_listing().data['id'])
+        params = {'name': 'Test'}
+        response = self.client.get(self.url, params, format='json')
+        etag = response['ETag']
+        self.assertNotIn('Last-Modified', response)
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url, params, format='json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(len(ctx.captured_queries), 0)
+
+        detail = self.client.get(f'{self.url}{listing.id}/', format='json')
+        response = self.client.get(f'{self.url}{listing.id}/', format='json', HTTP_IF_NONE_MATCH=detail['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # a product change touches its listing
+        listing.products.first().delete()
+        response = self.client.get(self.url, params, format='json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get(f'{self.url}{listing.id}/', format='json', HTTP_IF_NONE_MATCH=detail['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.client.get(f'{self.url}abc/', format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_no_conditional_get_with_presigned_urls(self):
+        listing_id = self.create_legit_listing().data['id']
+        for url in (self.url, f'{self.url}{listing_id}/'):
+            response = self.client.get(url, format='json')
+            self.assertNotIn('ETag', response)
+            response = self.client.get(url, format='json', HTTP_IF_NONE_MATCH='*')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_create_inserts_units_in_bulk(self):
+        self.client.force_authenticate(user=self.admin_user)
+        queries = []
+        for stock in (2, 50):
+            data = {"name": "Bulk", "options": [
+                {"label": "Color", "value": "Red", "stock": stock},
+                {"label": "Size", "value": "L", "stock": 1},
+            ]}
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.post(self.url, data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            queries.append(len(ctx.captured_queries))
+            listing = Listing.objects.with_stock().get(id=response.data['id'])
+            self.assertEqual(listing.stock_count, stock + 1)
+        self.assertEqual(queries[0], queries[1])
+
+    @override_settings(STORAGES=IN_MEMORY_STORAGES)
+    def test_put_applies_options_as_a_diff(self):
+        listing = Listing.objects.get(id=self.create_legit_listing().data['id'])
+        products = {product.characteristics['value']: product for product in listing.products.all()}
+        url = f'{self.url}{listing.id}/'
+        options = [
+            {"label": "Color", "value": "Red", "stock": 2, "additional_price": 3},
+            {"label": "Color", "value": "Blue", "stock": 3},
+            {"label": "Size", "value": "Large", "stock": 4},
+            {"label": "Size", "value": "Medium", "stock": 5},
+        ]
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.put(url, {"name": "Test Listing", "options": options}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        updates = [query['sql'] for query in ctx.captured_queries if query['sql'].startswith('UPDATE "listings_product"')]
+        # one bulk_update for Red, one soft delete for Small
+        self.assertEqual(len(updates), 2)
+
+        current = {product.characteristics['value']: product for product in listing.products.filter(is_active=True)}
+        self.assertEqual(set(current), {'Red', 'Blue', 'Large', 'Medium'})
+        for value in ('Red', 'Blue', 'Large'):
+            self.assertEqual(current[value].id, products[value].id)
+        self.assertEqual(current['Blue'].updated_at, products['Blue'].updated_at)
+        self.assertEqual(current['Red'].additional_price, 3)
+        self.assertFalse(listing.products.get(id=products['Small'].id).is_active)
+        self.assertEqual(listing.stock, 14)
+
+        # stock is what is left to sell
+        inventory.reserve(current['Blue'], 2)
+        self.client.put(url, {"name": "Test Listing", "options": options}, format='json')
+        current['Blue'].refresh_from_db()
+        self.assertEqual((current['Blue'].quantity, current['Blue'].available), (5, 3))
+
+        # a field left out is reset, the images of a removed variant are cleaned up
+        image = ImageModel.objects.create(image='medium.png')
+        current['Medium'].images.add(image)
+        options[0].pop('additional_price')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put(url, {"name": "Test Listing", "options": options[:3]}, format='json')
+        current['Red'].refresh_from_db()
+        self.assertEqual(current['Red'].additional_price, 0)
+        self.assertFalse(ImageModel.objects.filter(id=image.id).exists())
+
+        # a malformed option fails the update rather than dropping its variant
+        invalid = [options[0], {**options[1], 'stock': 'many'}, options[2]]
+        response = self.client.put(url, {"name": "Test Listing", "options": invalid}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertTrue(listing.products.get(id=current['Blue'].id).is_active)
+
+        # extra live rows of a variant are deactivated, the one holding the reservation is kept
+        duplicate = Product.objects.create(listing=listing, characteristics={'label': 'Color', 'value': 'Blue'}, quantity=1)
+        self.client.put(url, {"name": "Test Listing", "options": options[:3]}, format='json')
+        self.assertFalse(listing.products.get(id=duplicate.id).is_active)
+        self.assertEqual(listing.products.get(is_active=True, characteristics__value='Blue').id, current['Blue'].id)
@@ -0,0 +1,77 @@
+import io
+import tempfile
+from pathlib import Path
+
+import boto3
+from django.core.management import call_command
+from django.test import override_settings
+from moto import mock_aws
+
+from apps.listings.models import Category, ImageModel, Product, StorageDeletion
+from apps.listings.tests.presigned_upload import S3_SETTINGS
+from apps.listings.tests.utils import BaseTestCase
+
+
+@override_settings(**S3_SETTINGS)
+class MediaGCTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        aws = mock_aws()
+        aws.start()
+        self.addCleanup(aws.stop)
+        self.s3 = boto3.client('s3', region_name='us-east-1')
+        self.s3.create_bucket(Bucket='uploads')
+        for key in (
+            'products_images/used.png', 'products_images/used-160w.webp', 'products_images/unused.png',
+            'products_images/stray.png', 'categories_cover/cover.png', 'static/app.css',
+        ):
+            self.s3.put_object(Bucket='uploads', Key=key, Body=b'content')
+
+        used = ImageModel.objects.create(image='products_images/used.png', derivatives={'webp': {'160': 'products_images/used-160w.webp'}})
+        Product.objects.create(is_active=False).images.add(used)
+        self.unused = ImageModel.objects.create(image='products_images/unused.png', derivatives={})
+        Category.objects.create(name='Covered', image='categories_cover/cover.png')
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.checkpoint = Path(directory.name) / 'gc.progress'
+
+    def gc(self, *args):
+        out = io.StringIO()
+        call_command(
+            'gc_media', '--grace-hours', '0', '--pause', '0', '--requests-per-second', '0',
+            '--checkpoint', str(self.checkpoint), *args, stdout=out,
+        )
+        return out.getvalue()
+
+    def keys(self):
+        return {item['Key'] for item in self.s3.list_objects_v2(Bucket='uploads')['Contents']}
+
+    def test_dry_run_reports_only(self):
+        keys = self.keys()
+        out = self.gc('--dry-run')
+        self.assertIn('1 unused image rows would be deleted', out)
+        self.assertIn('1 unreferenced files', out)
+        self.assertEqual(self.keys(), keys)
+        self.assertTrue(ImageModel.objects.filter(id=self.unused.id).exists())
+        self.assertFalse(StorageDeletion.objects.exists())
+        self.assertFalse(self.checkpoint.exists())
+
+    def test_collect(self):
+        out = self.gc()
+        self.assertIn('1 unused image rows deleted', out)
+        self.assertFalse(ImageModel.objects.filter(id=self.unused.id).exists())
+        self.assertEqual(self.keys(), {
+            'products_images/used.png', 'products_images/used-160w.webp', 'categories_cover/cover.png', 'static/app.css',
+        })
+        self.assertFalse(StorageDeletion.objects.exists())
+        self.assertFalse(self.checkpoint.exists())
+
+    def test_resume_from_checkpoint(self):
+        # interrupted after the rows, in the middle of the product images
+        self.checkpoint.write_text('{"phase": "storage", "folder": 0, "after": "products_images/stray.png"}')
+        self.gc()
+        # stray.png was before the checkpoint, unused.png's row is only deleted by the rows phase
+        self.assertIn('products_images/stray.png', self.keys())
+        self.assertTrue(ImageModel.objects.filter(id=self.unused.id).exists())
+        self.gc('--restart')
+        self.assertNotIn('products_images/stray.png', self.keys())
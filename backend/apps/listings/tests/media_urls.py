@@ -0,0 +1,56 @@
+from django.test import override_settings
+
+from apps.listings import media
+from apps.listings.models import Category, ImageModel, Listing
+from apps.listings.serializers import ImageModelSerializer, ListingGroupByLabelSeriazlizer, ListingSerializer
+from apps.listings.tests.presigned_upload import S3_SETTINGS
+from apps.listings.tests.utils import BaseTestCase
+
+
+@override_settings(**S3_SETTINGS)
+class MediaURLTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        media._signed_urls.clear()
+        self.image = ImageModel.objects.create(image='products_images/some image.png')
+
+    @override_settings(MEDIA_PUBLIC_URL='https://cdn.example.com/media/')
+    def test_public_urls(self):
+        data = ImageModelSerializer(self.image).data
+        self.assertEqual(data['image'], 'https://cdn.example.com/media/products_images/some%20image.png')
+        self.assertFalse(media._signed_urls)
+
+    @override_settings(MEDIA_PUBLIC_URL='https://cdn.example.com/', STORAGES={**S3_SETTINGS['STORAGES']}, AWS_LOCATION='media')
+    def test_public_urls_in_a_location(self):
+        self.assertEqual(ImageModelSerializer(self.image).data['image'], 'https://cdn.example.com/media/products_images/some%20image.png')
+
+    @override_settings(MEDIA_PUBLIC_URL='', CATALOG_CACHE_TIMEOUT=60)
+    def test_signed_urls_are_cached_until_close_to_expiry(self):
+        url = ImageModelSerializer(self.image).data['image']
+        self.assertIn('X-Amz-Signature=', url)
+        (signed, expires_at), = media._signed_urls.values()
+        self.assertEqual(signed, url)
+        self.assertEqual(ImageModelSerializer(self.image).data['image'], url)
+
+        # expired: signed again
+        key, = media._signed_urls
+        media._signed_urls[key] = ('stale', 0)
+        self.assertNotEqual(ImageModelSerializer(self.image).data['image'], 'stale')
+
+    @override_settings(MEDIA_PUBLIC_URL='', CATALOG_CACHE_TIMEOUT=60 * 60)
+    def test_short_lived_signatures_are_not_cached(self):
+        # AWS_QUERYSTRING_EXPIRE (1h) doesn't outlive a cached catalog response
+        ImageModelSerializer(self.image).data
+        self.assertFalse(media._signed_urls)
+
+    def test_remote_images(self):
+        image = ImageModel.objects.create(image='https://example.com/image.png')
+        self.assertEqual(ImageModelSerializer(image).data['image'], 'https://example.com/image.png')
+
+    @override_settings(MEDIA_PUBLIC_URL='https://cdn.example.com/media/')
+    def test_category_images_of_listings(self):
+        listing = Listing.objects.create(name='Covered')
+        listing.categories.add(Category.objects.create(name='Covered', image='categories_cover/cover.png'), self.category1)
+        for serializer in (ListingSerializer, ListingGroupByLabelSeriazlizer):
+            images = {category['name']: category['image'] for category in serializer(listing).data['categories']}
+            self.assertEqual(images, {'Covered': 'https://cdn.example.com/media/categories_cover/cover.png', 'Category 1': ''})
@@ -0,0 +1,80 @@
+import boto3
+import requests
+from django.test import override_settings
+from moto import mock_aws
+from rest_framework import status
+
+from apps.listings.models import Category, ImageModel
+from apps.listings.tests.utils import BaseTestCase
+
+# moto stands in for the bucket. Overridden STORAGES lose their OPTIONS in
+# Django 4.2 (DEFAULT_FILE_STORAGE compatibility), so configure it with settings.
+S3_STORAGES = {
+    'default': {'BACKEND': 'storages.backends.s3.S3Storage'},
+    'staticfiles': {'BACKEND': 'django.core.files.storage.InMemoryStorage'},
+}
+
+
+S3_SETTINGS = {
+    'STORAGES': S3_STORAGES,
+    'AWS_STORAGE_BUCKET_NAME': 'uploads',
+    'AWS_S3_ACCESS_KEY_ID': 'test',
+    'AWS_S3_SECRET_ACCESS_KEY': 'test',
+    'AWS_S3_REGION_NAME': 'us-east-1',
+}
+
+
+@override_settings(**S3_SETTINGS)
+class PresignedUploadTests(BaseTestCase):
+    url = '/listings/upload/'
+
+    def setUp(self):
+        super().setUp()
+        aws = mock_aws()
+        aws.start()
+        self.addCleanup(aws.stop)
+        boto3.client('s3', region_name='us-east-1').create_bucket(Bucket='uploads')
+        self.client.force_authenticate(user=self.admin_user)
+
+    def upload(self, folder='product'):
+        response = self.client.post(self.url, {'folder': folder, 'content_type': 'image/png'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        with open(self.absolute_path, 'rb') as image:
+            put = requests.put(response.data['url'], data=image.read(), headers=response.data['headers'])
+        self.assertEqual(put.status_code, 200)
+        return response.data
+
+    def test_category_image_from_presigned_upload(self):
+        upload = self.upload(folder='category')
+        self.assertTrue(upload['key'].startswith('categories_cover/'))
+        response = self.client.post('/listings/category/', {'name': 'Direct', 'image': upload['token']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Category.objects.get(id=response.data['id']).image.name, upload['key'])
+
+    def test_confirm_registers_image(self):
+        upload = self.upload()
+        response = self.client.post(f'{self.url}confirm/', {'image': upload['token']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(ImageModel.objects.get(id=response.data['id']).image.name, upload['key'])
+
+    def test_confirm_is_idempotent_per_key(self):
+        upload = self.upload()
+        ids = {self.client.post(f'{self.url}confirm/', {'image': upload['token']}, format='json').data['id'] for _ in range(3)}
+        self.assertEqual(len(ids), 1)
+        self.assertEqual(ImageModel.objects.filter(image=upload['key']).count(), 1)
+
+    def test_confirm_rejects_missing_or_forged_uploads(self):
+        images = ImageModel.objects.count()
+        response = self.client.post(self.url, {'content_type': 'image/png'}, format='json')
+        token = response.data['token']
+        # signed, but nothing was PUT
+        response = self.client.post(f'{self.url}confirm/', {'image': token}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(f'{self.url}confirm/', {'image': token[:-2] + 'xx'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(ImageModel.objects.count(), images)
+
+    def test_admin_only(self):
+        self.client.force_authenticate(user=self.client_user)
+        response = self.client.post(self.url, {'content_type': 'image/png'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
@@ -0,0 +1,170 @@
+import asyncio
+import io
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.test import override_settings
+from PIL import Image
+from rest_framework import status
+
+from apps.listings.ingestion import FetchError, fetch_images, ingest_remote_images
+from apps.listings.models import ImageModel, Listing, Product, RemoteImage
+from apps.listings.tests.image_upload import IN_MEMORY_STORAGES
+from apps.listings.tests.utils import BaseTestCase
+
+
+def png(color):
+    buffer = io.BytesIO()
+    Image.new('RGB', (40, 30), color).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+class ImageHost(BaseHTTPRequestHandler):
+    """
+        The remote hosts: {path: body} of the images, {path: location} of
+        the redirects, 404 for anything else. Keeps the connections alive and
+        records the client port of each request.
+    """
+    protocol_version = 'HTTP/1.1'
+    bodies = {}
+    redirects = {}
+    ports = []
+
+    def do_GET(self):
+        self.ports.append(self.client_address[1])
+        if self.path in self.redirects:
+            self.send_response(302)
+            self.send_header('Location', self.redirects[self.path])
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = self.bodies.get(self.path)
+        self.send_response(200 if body is not None else 404)
+        self.send_header('Content-Length', str(len(body or b'')))
+        self.end_headers()
+        self.wfile.write(body or b'')
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(STORAGES=IN_MEMORY_STORAGES, IMAGE_UPLOAD_MAX_SIZE=10_000, REMOTE_IMAGE_PRIVATE_HOSTS=['127.0.0.1'])
+class RemoteImageTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        server = ThreadingHTTPServer(('127.0.0.1', 0), ImageHost)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.host = f'http://127.0.0.1:{server.server_port}'
+        ImageHost.ports.clear()
+        ImageHost.bodies = {
+            '/red.png': png('red'),
+            '/blue.png': png('blue'),
+            '/text': b'not an image',
+            '/huge.png': b'\x89PNG' + bytes(20_000),
+        }
+        ImageHost.redirects = {
+            '/moved.png': '/red.png',
+            '/inside.png': f'http://localhost:{server.server_port}/red.png',
+        }
+
+    def test_listing_images_are_fetched_and_stored(self):
+        self.client.force_authenticate(user=self.admin_user)
+        document = {'name': 'Remote', 'price': 10, 'options': [{'label': 'Color', 'value': 'Red', 'images': [
+            {'image': f'{self.host}/red.png'}, {'image': f'{self.host}/missing.png'},
+        ]}]}
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/listings/product/', document, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        product = Listing.objects.get(id=response.data['id']).products.get()
+        names = sorted(image.image.name for image in product.images.all())
+        self.assertEqual(len(names), 2)
+        self.assertEqual(names[0], f'{self.host}/missing.png')
+        with default_storage.open(names[1]) as stored:
+            self.assertEqual(stored.read(), png('red'))
+        failed = RemoteImage.objects.get()
+        self.assertEqual((failed.image.image.name, failed.attempts), (f'{self.host}/missing.png', 1))
+        self.assertIn('404', failed.last_error)
+
+    def test_content_dedupe_size_limit_and_connection_reuse(self):
+        uploaded = ImageModel.objects.for_images([ContentFile(png('blue'), name='blue.png')])[0]
+        urls = ['/blue.png', '/red.png', '/red.png', '/text', '/huge.png']
+        products = [Product.objects.create() for _ in urls]
+        for product, url in zip(products, urls):
+            product.images.add(ImageModel.objects.create(image=f'{self.host}{url}'))
+
+        with override_settings(REMOTE_IMAGE_CONCURRENCY=1):
+            self.assertEqual(ingest_remote_images(), len(urls))
+        # the url given twice is fetched once, the connection is only
+        # replaced after the oversized body is cut short
+        self.assertEqual(len(ImageHost.ports), 4)
+        self.assertEqual(len(set(ImageHost.ports)), 2)
+
+        images = [product.images.get() for product in products]
+        self.assertEqual(images[0], uploaded)
+        self.assertEqual(images[1], images[2])
+        self.assertEqual(images[1].content_hash, ImageModel.objects.for_images([ContentFile(png('red'), name='red.png')])[0].content_hash)
+        errors = dict(RemoteImage.objects.values_list('image__image', 'last_error'))
+        self.assertIn('Not an image', errors[f'{self.host}/text'])
+        self.assertIn('more than 10000', errors[f'{self.host}/huge.png'])
+        self.assertEqual(ImageModel.objects.filter(image__startswith='http').count(), 2)
+
+    def test_command_queues_earlier_remote_images(self):
+        product = Product.objects.create()
+        product.images.add(ImageModel.objects.create(image=f'{self.host}/red.png'))
+        RemoteImage.objects.all().delete()
+        call_command('ingest_images', stdout=io.StringIO())
+        self.assertFalse(product.images.get().image.name.startswith('http'))
+        self.assertFalse(RemoteImage.objects.exists())
+
+    def test_listing_with_a_failed_remote_image_can_be_deleted(self):
+        listing = Listing.objects.get(id=self.create_legit_listing().data['id'])
+        image = ImageModel.objects.create(image=f'{self.host}/missing.png')
+        RemoteImage.objects.filter(image=image).update(attempts=1, last_error='HTTP 404')
+        listing.products.first().images.add(image)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(f'/listings/product/{listing.id}/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        # the foreign keys are deferred, check them as the commit would
+        connection.check_constraints()
+        self.assertFalse(ImageModel.objects.filter(id=image.id).exists())
+        self.assertFalse(RemoteImage.objects.exists())
+
+    def test_private_hosts_are_refused(self):
+        results = asyncio.run(fetch_images([f'{self.host}/moved.png', f'{self.host}/inside.png']))
+        self.assertEqual(results[f'{self.host}/moved.png'], png('red'))
+        # the redirect leads to a host that isn't allowed
+        self.assertIsInstance(results[f'{self.host}/inside.png'], FetchError)
+        self.assertIn('non public address', str(results[f'{self.host}/inside.png']))
+        requests = len(ImageHost.ports)
+
+        with override_settings(REMOTE_IMAGE_PRIVATE_HOSTS=[]):
+            results = asyncio.run(fetch_images([f'{self.host}/red.png', 'http://169.254.169.254/latest/meta-data/']))
+        self.assertTrue(all('non public address' in str(error) for error in results.values()))
+        self.assertEqual(len(ImageHost.ports), requests)
+
+    def test_connections_go_to_the_checked_address(self):
+        lookups = []
+        getaddrinfo = socket.getaddrinfo
+
+        def resolve(host, *args, **kwargs):
+            if host == 'images.test':
+                # a rebinding resolver would answer another address next time
+                lookups.append(host)
+                host = '127.0.0.1'
+            return getaddrinfo(host, *args, **kwargs)
+
+        url = self.host.replace('127.0.0.1', 'images.test')
+        with patch('socket.getaddrinfo', resolve), override_settings(REMOTE_IMAGE_PRIVATE_HOSTS=['images.test']):
+            results = asyncio.run(fetch_images([f'{url}/moved.png']))
+        self.assertEqual(results[f'{url}/moved.png'], png('red'))
+        # once per hop, the connection never resolves the name again
+        self.assertEqual(lookups, ['images.test', 'images.test'])
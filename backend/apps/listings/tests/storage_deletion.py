@@ -0,0 +1,81 @@
+import boto3
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.test import override_settings
+from moto import mock_aws
+
+from apps.listings.deletion import MAX_DELETE_ATTEMPTS, delete_image_rows, flush_storage_deletions
+from apps.listings.models import ImageModel, Listing, Manufacturer, Product, RemoteImage, StorageDeletion
+from apps.listings.tests.presigned_upload import S3_SETTINGS
+from apps.listings.tests.utils import BaseTestCase
+
+
+@override_settings(**S3_SETTINGS)
+class StorageDeletionTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        aws = mock_aws()
+        aws.start()
+        self.addCleanup(aws.stop)
+        self.s3 = boto3.client('s3', region_name='us-east-1')
+        self.s3.create_bucket(Bucket='uploads')
+
+    def keys(self):
+        return {item['Key'] for item in self.s3.list_objects_v2(Bucket='uploads').get('Contents', [])}
+
+    def test_files_are_deleted_after_commit(self):
+        listing = Listing.objects.get(id=self.create_legit_listing().data['id'])
+        image = ImageModel.objects.create(image=ContentFile(b'image', name='own.png'), derivatives={})
+        ImageModel.objects.filter(id=image.id).update(derivatives={'webp': {'160': 'products_images/own-160w.webp'}})
+        self.s3.put_object(Bucket='uploads', Key='products_images/own-160w.webp', Body=b'derivative')
+        listing.products.first().images.add(image)
+        self.assertEqual(self.keys(), {'products_images/own.png', 'products_images/own-160w.webp'})
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            listing.delete()
+        with self.captureOnCommitCallbacks() as flushes:
+            for callback in callbacks:
+                callback()
+        # the request is done before any storage call
+        self.assertEqual(len(self.keys()), 2)
+        self.assertEqual(StorageDeletion.objects.count(), 2)
+
+        for flush in flushes:
+            flush()
+        self.assertEqual(self.keys(), set())
+        self.assertFalse(StorageDeletion.objects.exists())
+
+    def test_stored_again_is_kept_and_failures_are_retried(self):
+        StorageDeletion.objects.bulk_create([
+            StorageDeletion(name='products_images/again.png', image='products_images/again.png'),
+            StorageDeletion(name='products_images/gone.png', image='products_images/gone.png'),
+        ])
+        ImageModel.objects.create(image='products_images/again.png')
+        self.s3.put_object(Bucket='uploads', Key='products_images/again.png', Body=b'image')
+        self.assertEqual(flush_storage_deletions(), 2)
+        self.assertEqual(self.keys(), {'products_images/again.png'})
+        self.assertFalse(StorageDeletion.objects.exists())
+
+        deletion = StorageDeletion.objects.create(name='products_images/late.png', image='products_images/late.png')
+        self.s3.delete_object(Bucket='uploads', Key='products_images/again.png')
+        self.s3.delete_bucket(Bucket='uploads')
+        self.assertEqual(flush_storage_deletions(), 1)
+        deletion.refresh_from_db()
+        self.assertEqual(deletion.attempts, 1)
+        self.assertIn('NoSuchBucket', deletion.last_error)
+        # not due before its retry delay
+        self.assertEqual(flush_storage_deletions(), 0)
+        self.assertLess(deletion.attempts, MAX_DELETE_ATTEMPTS)
+
+    def test_raw_image_delete_clears_every_relation(self):
+        # a new relation to ImageModel must be cleared by delete_image_rows() too
+        related = {relation.related_model for relation in ImageModel._meta.related_objects}
+        self.assertEqual(related, {Manufacturer, Product, RemoteImage})
+
+        image = ImageModel.objects.create(image='https://example.com/photo.png')
+        Product.objects.create().images.add(image)
+        self.manufacturer.pictures.add(image)
+        self.assertTrue(RemoteImage.objects.filter(image=image).exists())
+        self.assertEqual(delete_image_rows([image.id]), 1)
+        connection.check_constraints()
+        self.assertFalse(Manufacturer.pictures.through.objects.filter(imagemodel_id=image.id).exists())
@@ -1,5 +1,7 @@
 import base64
 import os
+from django.core.cache import cache
+from django.test import override_settings
 from django.urls import reverse
 from rest_framework.test import APITestCase
 
@@ -11,8 +13,11 @@ if absolute_path and not absolute_path.startswith('/'):
     absolute_path = '/' + absolute_path
 
 
+# background tasks run inline, on the test's connection
+@override_settings(BACKGROUND_TASKS=False)
 class BaseTestCase(APITestCase):
     def setUp(self):
+        cache.clear()
 
         # Create a sample manufacturer for testing
         self.manufacturer = Manufacturer.objects.create(
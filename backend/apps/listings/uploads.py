@@ -0,0 +1,117 @@
+# Image uploads: parallel saves of the files a request brings, and direct to
+# storage uploads, where the client PUTs the image bytes to a presigned URL of
+# the bucket and the app servers only sign the URL and check the result.
+
+import functools
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import default_storage
+from django.utils.functional import LazyObject, empty
+from storages.backends.s3 import S3Storage
+from storages.utils import clean_name, safe_join
+
+from settings.settings import CATEGORY_FOLDER_NAME, PRODUCT_FOLDER_NAME
+
+FOLDERS = {'product': PRODUCT_FOLDER_NAME, 'category': CATEGORY_FOLDER_NAME}
+CONTENT_TYPES = {
+    'image/jpeg': 'jpg',
+    'image/png': 'png',
+    'image/gif': 'gif',
+    'image/webp': 'webp',
+    'image/avif': 'avif',
+}
+# the token of an upload, given back in place of an image to use the uploaded file
+TOKEN_PREFIX = 'presigned:'
+TOKEN_SALT = 'listings.uploads'
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _store(field, file):
+    name = field.generate_filename(None, file.name)
+    # content left in storage by a deleted row is not uploaded again
+    if field.storage.exists(name):
+        return name
+    return field.storage.save(name, file, max_length=field.max_length)
+
+
+def store_files(field, files):
+    """
+        Saves the files to the storage of the FileField `field`, on a pool of
+        IMAGE_UPLOAD_WORKERS threads shared by the requests of the worker, so
+        the uploads of a request overlap. Returns the stored names, in order.
+        The threads only talk to the storage, never to the database.
+    """
+    global _pool
+    if len(files) < 2:
+        return [_store(field, file) for file in files]
+    if isinstance(field.storage, LazyObject) and field.storage._wrapped is empty:
+        # set up here, the threads would each set up their own instance
+        field.storage._setup()
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=settings.IMAGE_UPLOAD_WORKERS, thread_name_prefix='image-upload')
+    return list(_pool.map(functools.partial(_store, field), files))
+
+
+def bucket_key(storage, name):
+    """
+        The object key of `name` in the bucket of the S3 `storage`, the
+        storage's location included.
+    """
+    return safe_join(storage.location, clean_name(name))
+
+
+def presigned_upload(folder, content_type):
+    """
+        A new key in `folder` and a presigned PUT url for it, valid for
+        IMAGE_UPLOAD_URL_EXPIRES seconds. The Content-Type and Cache-Control
+        are part of the signature, the client has to send the given headers.
+    """
+    if not isinstance(default_storage, S3Storage):
+        raise ImproperlyConfigured('Presigned uploads need an S3 compatible default storage.')
+    key = f'{FOLDERS[folder]}{uuid.uuid4().hex[:12]}.{CONTENT_TYPES[content_type]}'
+    url = default_storage.bucket.meta.client.generate_presigned_url(
+        'put_object',
+        Params={
+            'Bucket': default_storage.bucket_name,
+            'Key': bucket_key(default_storage, key),
+            'ContentType': content_type,
+            'CacheControl': settings.IMAGE_CACHE_CONTROL,
+        },
+        ExpiresIn=settings.IMAGE_UPLOAD_URL_EXPIRES,
+        HttpMethod='PUT',
+    )
+    return {
+        'key': key,
+        'url': url,
+        'method': 'PUT',
+        'headers': {'Content-Type': content_type, 'Cache-Control': settings.IMAGE_CACHE_CONTROL},
+        'expires_in': settings.IMAGE_UPLOAD_URL_EXPIRES,
+        'token': TOKEN_PREFIX + signing.dumps(key, salt=TOKEN_SALT),
+    }
+
+
+def uploaded_key(token):
+    """
+        The storage key of a finished presigned upload. Raises ValueError when
+        the token wasn't issued by presigned_upload() (or is too old), when
+        nothing was uploaded, or when the upload is over IMAGE_UPLOAD_MAX_SIZE,
+        in which case it is deleted.
+    """
+    try:
+        key = signing.loads(token[len(TOKEN_PREFIX):], salt=TOKEN_SALT, max_age=settings.IMAGE_UPLOAD_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        raise ValueError('Invalid or expired upload token.')
+    if not default_storage.exists(key):
+        raise ValueError('Nothing was uploaded for this token.')
+    if default_storage.size(key) > settings.IMAGE_UPLOAD_MAX_SIZE:
+        default_storage.delete(key)
+        raise ValueError(f'Images are limited to {settings.IMAGE_UPLOAD_MAX_SIZE} bytes.')
+    return key
@@ -2,13 +2,26 @@
 
 from rest_framework import routers
 from django.urls import path, include
-from .views import CategoryViewSet, CouponViewSet, ListingViewSet, ManufacturerViewSet
+from .views import CategoryViewSet, CouponViewSet, ImageUploadViewSet, ListingCardViewSet, ListingViewSet, ManufacturerViewSet
 
-router = routers.DefaultRouter()
+class Router(routers.DefaultRouter):
+    """
+        Also routes DELETE on the list url to the viewset's `bulk_destroy`,
+        for the viewsets that have one.
+    """
+    routes = [
+        route._replace(mapping={**route.mapping, 'delete': 'bulk_destroy'}) if route.name == '{basename}-list' else route
+        for route in routers.DefaultRouter.routes
+    ]
+
+
+router = Router()
 router.register('product', ListingViewSet)
+router.register('card', ListingCardViewSet, basename='card')
 router.register('category', CategoryViewSet)
 router.register('manufacturer', ManufacturerViewSet)
 router.register('gertrude', CouponViewSet)
+router.register('upload', ImageUploadViewSet, basename='upload')
 
 
 urlpatterns = [
@@ -1,66 +1,63 @@
+import functools
+
 from rest_framework import viewsets
+from rest_framework.decorators import action
 
 from rest_framework.permissions import IsAdminUser
 
+from apps.listings.cache import CachedResponseMixin
+from apps.listings.conditional import ConditionalGetMixin
+from apps.listings.deletion import soft_delete_listings
+from apps.listings.facets import cached_facet_counts, parse_facets
+from apps.listings.filters import CategoryFilterSet, ListingFilterSet, parse_bool
+from apps.listings.parsers import CATALOG_PARSER_CLASSES
+from apps.listings.uploads import TOKEN_PREFIX, presigned_upload
 from apps.listings.pagination import CategoryPagination, DefaultPagination, ListingPagination
 from apps.users.permissions import IsAdminOrReadOnly
-from .serializers import CategorySerializer, CouponSerializer, ListingGroupByLabelSeriazlizer, ListingSerializer, ManufacturerSerializer
+from .serializers import CategorySerializer, CategoryTreeSerializer, CouponSerializer, ImageModelSerializer, ListingCardSerializer, ListingGroupByLabelSeriazlizer, ListingSerializer, ManufacturerSerializer, PresignedUploadSerializer, nest_categories
 from .models import Category, Listing, Manufacturer, Coupon
 from rest_framework import status
 from rest_framework.response import Response
 
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(ConditionalGetMixin, CachedResponseMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all().order_by('name')
     serializer_class = CategorySerializer
+    parser_classes = CATALOG_PARSER_CLASSES
     permission_classes = [IsAdminOrReadOnly]
     pagination_class = CategoryPagination
 
     def filter_queryset(self, queryset):
-        length = queryset.count()
-        filters = self.request.query_params
-
-        if 'name' in filters and isinstance(filters['name'], str):
-            queryset = queryset.filter(name__icontains=filters['name'])
-
-        if 'language' in filters and isinstance(filters['language'], str):
-            queryset = queryset.filter(language=filters['language'])
-        
-        if 'parent' in filters and isinstance(filters['parent'], str):
-            queryset = queryset.filter(parent=None if filters['parent'] == "null" else  filters['parent'])
-        
-        if 'description' in filters and isinstance(filters['description'], str):
-            queryset = queryset.filter(description__icontains=filters['description'])
-
-        if length == queryset.count() and any(filters.values()) is False:
-            return []
-        return queryset
-
-class ListingViewSet(viewsets.ModelViewSet):
+        filters = CategoryFilterSet(self.request.query_params)
+        if self.action == 'list' and filters.is_empty():
+            return queryset.none()
+        return filters.filter(queryset)
+
+    @action(detail=False, pagination_class=None)
+    def tree(self, request):
+        """
+            The whole category tree (or the part matching the filters) in one
+            query, nested, with the active listing count of each subtree.
+        """
+        return self.conditional_response(
+            self.list_etag, functools.partial(self.cached_response, self.tree_response), request
+        )
+
+    def tree_response(self, request):
+        categories = list(self.filter_queryset(self.get_queryset()).with_listing_count())
+        return Response(CategoryTreeSerializer(nest_categories(categories), many=True, context=self.get_serializer_context()).data)
+
+class ListingViewSet(ConditionalGetMixin, CachedResponseMixin, viewsets.ModelViewSet):
     queryset = Listing.objects.all().order_by('name')
     serializer_class = ListingSerializer
+    parser_classes = CATALOG_PARSER_CLASSES
     permission_classes = [IsAdminOrReadOnly]
     pagination_class = ListingPagination
 
     def filter_queryset(self, queryset):
-        length = queryset.count()
-        filters = self.request.query_params
-
-        if 'price' in filters and filters['price'].isdigit():
-            queryset = queryset.filter(price=filters['price'])
-
-        if 'category_name' in filters and isinstance(filters['category_name'], str):
-            queryset = queryset.filter(categories__name__icontains=filters['category_name'])
-
-        if 'name' in filters and isinstance(filters['name'], str):
-            queryset = queryset.filter(name__icontains=filters['name'])
-
-        if 'manufacturer' in filters and isinstance(filters['manufacturer'], str):
-            queryset = queryset.filter(manufacturer__name__icontains=filters['manufacturer'])
-        
-        if length == queryset.count() and any(filters.values()) is False and "group_by" not in filters:
-            return []
-
-        return queryset
+        filters = ListingFilterSet(self.request.query_params)
+        if self.action == 'list' and filters.is_empty() and "group_by" not in filters.params:
+            return queryset.none()
+        return filters.filter(queryset)
 
     def get_serializer_class(self):
         # if groubpy is in request query params, then serializer should be ListingGroupByLabelSeriazlizer
@@ -68,6 +65,48 @@ class ListingViewSet(viewsets.ModelViewSet):
         if groupby == 'characteristics__label':
             return ListingGroupByLabelSeriazlizer
         return self.serializer_class
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        try:
+            context['variant_stock'] = parse_bool(self.request.query_params.get('variant_stock', ''))
+        except ValueError:
+            context['variant_stock'] = False
+        return context
+
+    def list(self, request, *args, **kwargs):
+        """
+            `?facets=1` (or `?facets=category,price,...`) adds the facet counts
+            of the whole filtered set to the page, see apps.listings.facets.
+        """
+        response = super().list(request, *args, **kwargs)
+        try:
+            names = parse_facets(request.query_params.get('facets', ''))
+        except ValueError:
+            return response
+        if response.status_code == 200:
+            queryset = self.filter_queryset(self.get_queryset())
+            response.data['facets'] = cached_facet_counts(queryset, request.query_params, names)
+        return response
+
+    def bulk_destroy(self, request, *args, **kwargs):
+        """
+            DELETE /listings/product/?ids=1,2,3 soft deletes those listings,
+            DELETE /listings/product/?manufacturer_id=4 every listing matching
+            the filters. Without ids or a valid filter nothing is deleted.
+        """
+        filters = ListingFilterSet(request.query_params)
+        queryset = filters.filter(self.get_queryset())
+        raw_ids = [raw_id for value in request.query_params.getlist('ids') for raw_id in value.split(',') if raw_id]
+        try:
+            ids = [int(raw_id) for raw_id in raw_ids]
+        except ValueError:
+            return Response({'ids': 'A comma separated list of listing ids is expected.'}, status=status.HTTP_400_BAD_REQUEST)
+        if ids:
+            queryset = queryset.filter(id__in=ids)
+        elif not any(filters.parsed()):
+            return Response({'ids': 'Give the ids of the listings to delete, or filters.'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'deleted': soft_delete_listings(queryset)})
     
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -76,12 +115,53 @@ class ListingViewSet(viewsets.ModelViewSet):
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
     
-class ManufacturerViewSet(viewsets.ModelViewSet):
+class ListingCardViewSet(ConditionalGetMixin, CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
+    """
+        Catalog cards served from the ListingCard read model: a page is one
+        SELECT on listings joined to their card.
+    """
+    queryset = Listing.objects.filter(is_active=True).select_related('card').order_by('name')
+    serializer_class = ListingCardSerializer
+    permission_classes = [IsAdminOrReadOnly]
+    pagination_class = ListingPagination
+
+    def filter_queryset(self, queryset):
+        return ListingFilterSet(self.request.query_params).filter(queryset)
+
+class ManufacturerViewSet(ConditionalGetMixin, CachedResponseMixin, viewsets.ModelViewSet):
     queryset = Manufacturer.objects.all()
     serializer_class = ManufacturerSerializer
+    parser_classes = CATALOG_PARSER_CLASSES
     permission_classes = [IsAdminOrReadOnly]
     pagination_class = DefaultPagination
 
+class ImageUploadViewSet(viewsets.ViewSet):
+    """
+        Image bytes go straight to the bucket, never through a worker:
+        POST /listings/upload/ {"content_type": "image/png", "folder": "product"}
+        returns a presigned PUT `url` and a `token`. Once the file is PUT,
+        the token stands for the image wherever one is expected
+        ({"image": token} in product images, a category image...), or
+        POST /listings/upload/confirm/ {"image": token} registers it as an
+        ImageModel.
+    """
+    permission_classes = [IsAdminUser]
+
+    def create(self, request):
+        serializer = PresignedUploadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response(presigned_upload(**serializer.validated_data), status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['post'])
+    def confirm(self, request):
+        token = request.data.get('image')
+        if not isinstance(token, str) or not token.startswith(TOKEN_PREFIX):
+            return Response({'image': 'The token of a presigned upload is expected.'}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = ImageModelSerializer(data={'image': token}, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
 class CouponViewSet(viewsets.ModelViewSet):
     queryset = Coupon.objects.all()
     serializer_class = CouponSerializer
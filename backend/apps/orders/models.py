@@ -27,6 +27,8 @@ STATUS_CHOICES = (
         (5, _('sent')),
         (6, _('completed')),
     )
+# from that status on, the units of the order are sold rather than reserved
+PAID = 3
 
 
 class Order(models.Model):
@@ -44,7 +46,7 @@ class Order(models.Model):
     tracking_numbers = ArrayField(models.CharField(max_length=128), blank=True, null=True)
     shipping_fee = models.FloatField(_('shipping fee'), default=0.0)  # type: ignore
 
-    created_at = models.DateTimeField(_('created at'), auto_now=True)
+    created_at = models.DateTimeField(_('created at'), auto_now_add=True, db_index=True)
     last_update = models.DateTimeField(_('last update'), auto_now=True)
 
     selected_coupon = models.ForeignKey('listings.Coupon', on_delete=models.PROTECT, blank=True, null=True, related_name='applied_to')
@@ -68,4 +70,14 @@ class Order(models.Model):
 
         # django is autistic
         self.last_update = datetime.now()
-        return super().save(force_insert, force_update, using, update_fields)
\ No newline at end of file
+        return super().save(force_insert, force_update, using, update_fields)
+
+
+class OrderItem(models.Model):
+    """
+        `quantity` units of a product (a SKU, see apps.listings.inventory)
+        reserved by the order until it is paid, sold from then on.
+    """
+    order = models.ForeignKey(Order, related_name='items', on_delete=models.CASCADE)
+    product = models.ForeignKey('listings.Product', related_name='order_items', on_delete=models.PROTECT)
+    quantity = models.PositiveIntegerField(_('quantity'), default=1)
@@ -1,8 +1,56 @@
+from django.db import transaction
 from rest_framework import serializers
 
-from .models import Order
+from apps.listings import inventory
+
+from .models import PAID, Order, OrderItem
+
+
+class OrderItemSerializer(serializers.ModelSerializer):
+    quantity = serializers.IntegerField(min_value=1, default=1)
+
+    class Meta:
+        model = OrderItem
+        fields = ['product', 'quantity']
+
 
 class OrderSerializer(serializers.ModelSerializer):
+    items = OrderItemSerializer(many=True, required=False)
+
     class Meta:
         model = Order
-        fields = '__all__'
\ No newline at end of file
+        fields = '__all__'
+
+    @transaction.atomic
+    def create(self, validated_data):
+        """
+            Reserves the units of the items, the whole order fails when one
+            of them doesn't have enough left. Created paid, they are sold.
+        """
+        items = validated_data.pop('items', [])
+        order = super().create(validated_data)
+        for item in items:
+            OrderItem.objects.create(order=order, **item)
+            if order.status >= PAID:
+                moved = inventory.sell(item['product'], item['quantity'], reserved=False)
+            else:
+                moved = inventory.reserve(item['product'], item['quantity'])
+            if not moved:
+                raise serializers.ValidationError({'items': f'Not enough units left of product {item["product"].pk}.'})
+        return order
+
+    @transaction.atomic
+    def update(self, instance, validated_data):
+        """
+            The items can't be changed once ordered. Paying the order sells
+            the units it reserved.
+        """
+        if 'items' in validated_data:
+            raise serializers.ValidationError({'items': 'The items of an order can not be changed.'})
+        paid = instance.status < PAID <= validated_data.get('status', instance.status)
+        order = super().update(instance, validated_data)
+        if paid:
+            for item in order.items.select_related('product'):
+                if not inventory.sell(item.product, item.quantity):
+                    raise serializers.ValidationError({'items': f'The units of product {item.product_id} are no longer reserved.'})
+        return order
@@ -1,3 +1,82 @@
-from django.test import TestCase
+from rest_framework import status
 
-# Create your tests here.
+from apps.listings.models import Listing
+from apps.listings.tests.utils import BaseTestCase
+
+from .models import Order
+
+
+class OrderInventoryTests(BaseTestCase):
+    url = '/orders/'
+
+    def setUp(self):
+        super().setUp()
+        listing = Listing.objects.get(id=self.create_legit_listing().data['id'])
+        # Color Blue, stock 3
+        self.product = listing.products.get(characteristics__value='Blue')
+        self.client.force_authenticate(user=self.admin_user)
+
+    def tearDown(self):
+        # the items protect their products
+        Order.objects.all().delete()
+        return super().tearDown()
+
+    def order(self, quantity, **data):
+        return self.client.post(self.url, {
+            'email': 'buyer@outlook.pl', 'items': [{'product': self.product.id, 'quantity': quantity}], **data,
+        }, format='json')
+
+    def test_created_order_reserves_and_payment_sells(self):
+        response = self.order(2)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.reserved, self.product.sold), (2, 0))
+
+        response = self.client.patch(f'{self.url}{response.data["id"]}/', {'status': 3}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.reserved, self.product.sold), (0, 2))
+
+        # paying again sells nothing more
+        response = self.client.patch(f'{self.url}{response.data["id"]}/', {'status': 4}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.reserved, self.product.sold), (0, 2))
+
+    def test_order_over_stock_is_refused(self):
+        self.assertEqual(self.order(2).status_code, status.HTTP_201_CREATED)
+        response = self.order(2)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Order.objects.count(), 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.reserved, 2)
+
+        response = self.order(1, status=3)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.reserved, self.product.sold), (2, 1))
+
+    def test_deleted_unpaid_order_releases_its_units(self):
+        response = self.order(3)
+        response = self.client.delete(f'{self.url}{response.data["id"]}/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.reserved, self.product.available), (0, 3))
+
+    def test_orders_are_admin_only(self):
+        self.order(1)
+        self.client.force_authenticate(user=None)
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_401_UNAUTHORIZED)
+        self.client.force_authenticate(user=self.client_user)
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.order(1).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_cursor_pages(self):
+        for _ in range(3):
+            Order.objects.create(email='buyer@outlook.pl')
+        response = self.client.get(self.url, {'pagination': 'cursor', 'page_size': 2}, format='json')
+        ids = [order['id'] for order in response.data['results']]
+        response = self.client.get(response.data['next'], format='json')
+        ids += [order['id'] for order in response.data['results']]
+        self.assertIsNone(response.data['next'])
+        self.assertEqual(ids, [str(pk) for pk in Order.objects.order_by('-created_at', '-id').values_list('id', flat=True)])
@@ -0,0 +1,11 @@
+from rest_framework import routers
+from django.urls import path, include
+from .views import OrderViewset
+
+router = routers.DefaultRouter()
+router.register('', OrderViewset)
+
+
+urlpatterns = [
+    path('', include(router.urls)),
+]
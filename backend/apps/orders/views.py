@@ -1,17 +1,25 @@
+from django.db import transaction
 from django.shortcuts import render
 from rest_framework import viewsets
-from apps.listings.pagination import DefaultPagination
-
-from apps.users.permissions import IsAdminOrReadOnly
+from rest_framework.permissions import IsAdminUser
+from apps.listings import inventory
+from apps.listings.pagination import OrderPagination
 
 from .serializers import OrderSerializer
-from .models import Order
+from .models import PAID, Order
 
 
 class OrderViewset(viewsets.ModelViewSet):
     queryset = Order.objects.all()  # type: ignore
     serializer_class = OrderSerializer
-    permission_classes = [IsAdminOrReadOnly]
-    pagination_class = DefaultPagination
-
+    # orders hold the customers' emails and addresses
+    permission_classes = [IsAdminUser]
+    pagination_class = OrderPagination
 
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        # an order deleted before it is paid gives its units back
+        if instance.status < PAID:
+            for item in instance.items.select_related('product'):
+                inventory.release(item.product, item.quantity)
+        instance.delete()
@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 import os
 from pathlib import Path
 
+from boto3.s3.transfer import TransferConfig
 from environs import Env
 
 env = Env()
@@ -43,6 +44,7 @@ DJANGO_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
 ]
 
 INSTALLED_APPS = DJANGO_APPS + [
@@ -133,6 +135,27 @@ DATABASES = {
     }
 }
 
+# Cache
+# Redis when REDIS_URL is set (see docker-compose.yaml), local memory otherwise (tests, dev)
+REDIS_URL = env.str("REDIS_URL", default=None)  # type: ignore
+
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
+# Seconds an anonymous catalog response stays cached, writes invalidate it anyway
+CATALOG_CACHE_TIMEOUT = env.int("CATALOG_CACHE_TIMEOUT", default=60 * 15)  # type: ignore
+
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": ("apps.users.auth.CookieTokenAuthentication",),
 }
@@ -194,6 +217,30 @@ USE_TZ = True
 
 STATIC_URL = "static/"
 
+# Multipart uploads are streamed to a temporary file whatever their size, then
+# to the bucket in chunks of IMAGE_UPLOAD_CHUNK_SIZE bytes, so the memory of a
+# worker doesn't grow with the size of the uploaded images.
+FILE_UPLOAD_HANDLERS = ["django.core.files.uploadhandler.TemporaryFileUploadHandler"]
+FILE_UPLOAD_TEMP_DIR = env.str("FILE_UPLOAD_TEMP_DIR", default=None)  # type: ignore
+IMAGE_UPLOAD_CHUNK_SIZE = env.int("IMAGE_UPLOAD_CHUNK_SIZE", default=8 * 1024 * 1024)  # type: ignore
+# Threads uploading the images of a request in parallel (apps.listings.uploads)
+IMAGE_UPLOAD_WORKERS = env.int("IMAGE_UPLOAD_WORKERS", default=4)  # type: ignore
+# Presigned uploads (apps.listings.uploads): the PUT url lifetime, how long the
+# upload can then be used, and the largest image accepted
+IMAGE_UPLOAD_URL_EXPIRES = env.int("IMAGE_UPLOAD_URL_EXPIRES", default=60 * 15)  # type: ignore
+IMAGE_UPLOAD_TOKEN_MAX_AGE = env.int("IMAGE_UPLOAD_TOKEN_MAX_AGE", default=60 * 60 * 24)  # type: ignore
+IMAGE_UPLOAD_MAX_SIZE = env.int("IMAGE_UPLOAD_MAX_SIZE", default=20 * 1024 * 1024)  # type: ignore
+# Images given as urls are fetched by apps.listings.ingestion, that many at a
+# time over one HTTP client, and no larger than IMAGE_UPLOAD_MAX_SIZE
+REMOTE_IMAGE_CONCURRENCY = env.int("REMOTE_IMAGE_CONCURRENCY", default=8)  # type: ignore
+REMOTE_IMAGE_TIMEOUT = env.float("REMOTE_IMAGE_TIMEOUT", default=10.0)  # type: ignore
+# Hosts fetched even though they resolve to a loopback or private address,
+# any other such host is refused
+REMOTE_IMAGE_PRIVATE_HOSTS = env.list("REMOTE_IMAGE_PRIVATE_HOSTS", default=[])  # type: ignore
+# Image derivatives and storage deletions run on a background thread of the
+# worker (apps.listings.background), rather than right after the request's commit
+BACKGROUND_TASKS = env.bool("BACKGROUND_TASKS", default=True)  # type: ignore
+
 R2_BUCKET_CONFIG = {
     "BACKEND": "storages.backends.s3boto3.S3Boto3Storage",
     "OPTIONS": {
@@ -201,14 +248,31 @@ R2_BUCKET_CONFIG = {
         "secret_key": env.str("R2_SECRET_KEY"),
         "bucket_name": env.str("R2_BUCKET"),
         "endpoint_url": env.str("R2_ENDPOINT"),
+        "transfer_config": TransferConfig(
+            multipart_threshold=IMAGE_UPLOAD_CHUNK_SIZE,
+            multipart_chunksize=IMAGE_UPLOAD_CHUNK_SIZE,
+            max_concurrency=2,
+        ),
     },
 }
 AWS_S3_STORAGE_BUCKET_NAME = env.str("R2_BUCKET")
 AWS_S3_SIGNATURE_VERSION="s3v4"
 os.environ.setdefault('S3_USE_SIGV4', 'True')
 
+# Media names never get new content (images are named after their hash,
+# derivatives after their image), so caches never need to revalidate them
+IMAGE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+R2_MEDIA_CONFIG = {
+    **R2_BUCKET_CONFIG,
+    "OPTIONS": {**R2_BUCKET_CONFIG["OPTIONS"], "object_parameters": {"CacheControl": IMAGE_CACHE_CONTROL}},
+}
+
+# Public base url of the media bucket (an R2 public bucket or a CDN in front
+# of it). When set, media urls are built from it rather than presigned.
+MEDIA_PUBLIC_URL = env.str("MEDIA_PUBLIC_URL", default="")  # type: ignore
+
 STORAGES = {
-    "default": R2_BUCKET_CONFIG,
+    "default": R2_MEDIA_CONFIG,
     "staticfiles": R2_BUCKET_CONFIG,
 }
 
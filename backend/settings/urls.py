@@ -21,4 +21,5 @@ urlpatterns = [
     path("admin/", admin.site.urls),
     path("auth/", include("apps.users.urls")),
     path("listings/", include("apps.listings.urls")),
+    path("orders/", include("apps.orders.urls")),
 ]